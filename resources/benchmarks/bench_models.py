@@ -0,0 +1,276 @@
+# Copyright (C) 2024 Eneo Tecnologia S.L.
+#
+# Authors:
+# Miguel Álvarez Adsuara <malvarez@redborder.com>
+# Pablo Rodriguez Flores <prodriguez@redborder.com>
+#
+# This program is free software: you can redistribute it and/or modify it under the terms of the
+# GNU Affero General Public License as published by the Free Software Foundation, either version 3
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without
+# even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with this program.
+# If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Micro-benchmarks of the model code paths that dominate the cost of a request, with
+regression tracking against a stored baseline.
+
+Every case is timed and its peak memory measured with tracemalloc on synthetic druid
+responses from FakeDruid. Results can be saved as a JSON baseline, and later runs fail
+when a case is slower or uses more memory than the baseline by more than a threshold.
+Baselines depend on the machine, so regenerate them on the machine that checks them.
+
+Run from the root of the repository:
+
+    python -m resources.benchmarks.bench_models --save-baseline
+    python -m resources.benchmarks.bench_models
+"""
+import os
+import sys
+import json
+import time
+import timeit
+import platform
+import argparse
+import tracemalloc
+import numpy as np
+import pandas as pd
+
+from resources.benchmarks.fake_druid import FakeDruid
+from resources.src.ai.outliers import Autoencoder
+from resources.src.ai.shallow_outliers import ShallowOutliers
+from resources.src.ai.outliers_identifier import OutlierIdentifier
+from resources.src.druid.query_builder import QueryBuilder
+from resources.src.druid.utils import to_iso8601
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+AI_PATH = os.path.join(BENCHMARKS, "..", "src", "ai")
+DRUID_DATA = os.path.join(BENCHMARKS, "..", "src", "druid", "data")
+BASELINE = os.path.join(BENCHMARKS, "baselines", "models.json")
+BASE_TIME = 1672531200
+
+def druid_response(fake, minutes, granularity="pt1m"):
+    """
+    Generate the druid response of the traffic query for a number of minutes.
+
+    Args:
+        fake (FakeDruid): source of the synthetic traffic.
+        minutes (int): length of the interval queried.
+        granularity (str): druid granularity of the buckets.
+
+    Returns:
+        (list): druid timeseries response.
+    """
+    builder = QueryBuilder(
+        os.path.join(DRUID_DATA, "aggregations.json"), os.path.join(DRUID_DATA, "postAggregations.json")
+    )
+    with open(os.path.join(DRUID_DATA, "trafficquery.json"), 'r') as json_file:
+        query = json.load(json_file)
+    query = builder.set_time_origin(builder.modify_granularity(query, granularity), to_iso8601(BASE_TIME))
+    query = builder.set_time_interval(query, to_iso8601(BASE_TIME), to_iso8601(BASE_TIME + 60*minutes))
+    return fake.timeseries(builder.modify_aggregations(query))
+
+def model_cases(sizes):
+    """
+    Build the benchmark cases of the Autoencoder and ShallowOutliers for each series length.
+
+    Args:
+        sizes (list): series lengths in minutes.
+
+    Returns:
+        (dict): function to benchmark by case name.
+    """
+    fake = FakeDruid(seed=1)
+    autoencoder = Autoencoder(os.path.join(AI_PATH, "traffic.keras"), os.path.join(AI_PATH, "traffic.ini"))
+    autoencoder.warm_up()
+    shallow = ShallowOutliers()
+    cases = {}
+    for size in sizes:
+        raw_json = druid_response(fake, size)
+        data, timestamps = autoencoder.input_json(raw_json)
+        sliced = autoencoder.slice(autoencoder.rescale(data))
+        predicted, loss = autoencoder.calculate_predictions(data)
+        predicted = pd.DataFrame(predicted, columns=autoencoder.columns)
+        predicted['timestamp'] = timestamps
+        anomalies = predicted[loss > autoencoder.avg_loss + 5*autoencoder.std_loss]
+        arr = np.array([row["result"]["bytes"] for row in raw_json], dtype=float)
+        smoothed = shallow.predict(arr)
+        encoded = shallow.encode_timestamp(pd.Series([row["timestamp"] for row in raw_json]))
+        cases.update({
+            f"Autoencoder.input_json[{size}]": lambda raw_json=raw_json: autoencoder.input_json(raw_json),
+            f"Autoencoder.slice[{size}]": lambda data=data: autoencoder.slice(data),
+            f"Autoencoder.calculate_predictions[{size}]": lambda data=data: autoencoder.calculate_predictions(data),
+            f"Autoencoder.flatten[{size}]": lambda sliced=sliced: autoencoder.flatten(sliced),
+            f"Autoencoder.output_json[{size}]": lambda a=anomalies, p=predicted: autoencoder.output_json("bytes", a, p),
+            f"ShallowOutliers.predict[{size}]": lambda arr=arr: shallow.predict(arr),
+            f"ShallowOutliers.get_outliers[{size}]": lambda a=arr, s=smoothed, e=encoded: shallow.get_outliers(a, s, e),
+            f"ShallowOutliers.compute_json[{size}]": lambda raw_json=raw_json: shallow.compute_json(raw_json)
+        })
+    return cases
+
+def identifier_cases(ip_counts, minutes=60):
+    """
+    Build the benchmark cases of the OutlierIdentifier for each number of IPs.
+
+    Args:
+        ip_counts (list): numbers of IPs.
+        minutes (int): minutes of traffic of each IP.
+
+    Returns:
+        (dict): function to benchmark by case name.
+    """
+    fake = FakeDruid(seed=1, anomaly_rate=0.05)
+    cases = {}
+    for ips in ip_counts:
+        outliers, all_ips_data = fake.ip_traffic(ips, minutes, BASE_TIME)
+        cases[f"OutlierIdentifier.execute[{ips}]"] = (
+            lambda o=outliers, d=all_ips_data: OutlierIdentifier().execute(o, d)
+        )
+    return cases
+
+def measure(function, repeat=5, min_time=0.2):
+    """
+    Measure the time and peak memory of a function.
+
+    The function runs enough times per repetition to last about min_time seconds and the
+    fastest repetition is kept. The peak memory is measured in a separate call, because
+    tracing allocations slows the function down.
+
+    Args:
+        function (callable): function to measure.
+        repeat (int): repetitions of the timing.
+        min_time (float): approximate seconds of each repetition.
+
+    Returns:
+        (dict): seconds per call and peak bytes allocated during a call.
+    """
+    start = time.perf_counter()
+    function()
+    number = max(1, int(min_time/max(time.perf_counter() - start, 1e-9)))
+    seconds = min(timeit.repeat(function, number=number, repeat=repeat))/number
+    tracemalloc.start()
+    try:
+        function()
+        _, peak_bytes = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {"seconds": seconds, "peak_bytes": peak_bytes}
+
+def run(cases, repeat=5, min_time=0.2):
+    """
+    Measure every case.
+
+    Args:
+        cases (dict): function to benchmark by case name.
+        repeat (int): repetitions of the timing.
+        min_time (float): approximate seconds of each repetition.
+
+    Returns:
+        (dict): measurements by case name.
+    """
+    return {name: measure(function, repeat, min_time) for name, function in cases.items()}
+
+def compare(results, baseline, time_threshold=0.25, memory_threshold=0.25, memory_slack=64*1024):
+    """
+    Find the cases that regressed with respect to a baseline.
+
+    Args:
+        results (dict): measurements by case name.
+        baseline (dict): baseline measurements by case name.
+        time_threshold (float): allowed relative increase of the time.
+        memory_threshold (float): allowed relative increase of the peak memory.
+        memory_slack (int): increase of the peak memory in bytes that is always allowed,
+          so tiny allocations do not fail the comparison.
+
+    Returns:
+        (list): description of each regression.
+    """
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        if result["seconds"] > base["seconds"]*(1 + time_threshold):
+            regressions.append(
+                f"{name}: {1000*result['seconds']:.3f} ms vs {1000*base['seconds']:.3f} ms baseline"
+            )
+        if result["peak_bytes"] > base["peak_bytes"]*(1 + memory_threshold) + memory_slack:
+            regressions.append(
+                f"{name}: peak {result['peak_bytes']/1024:.0f} KiB vs {base['peak_bytes']/1024:.0f} KiB baseline"
+            )
+    return regressions
+
+def load_baseline(path):
+    """
+    Load the measurements of a baseline file.
+
+    Args:
+        path (str): path of the baseline.
+
+    Returns:
+        (dict): baseline measurements by case name, empty if the file does not exist.
+    """
+    try:
+        with open(path, 'r') as baseline_file:
+            return json.load(baseline_file)["results"]
+    except FileNotFoundError:
+        return {}
+
+def save_baseline(path, results):
+    """
+    Save measurements as a baseline, together with the environment they were taken in.
+
+    Args:
+        path (str): path of the baseline.
+        results (dict): measurements by case name.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    environment = {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "machine": platform.machine(),
+        "processor": platform.processor()
+    }
+    with open(path, 'w') as baseline_file:
+        json.dump({"environment": environment, "results": results}, baseline_file, indent=2, sort_keys=True)
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmarks of the model hot paths")
+    parser.add_argument("--sizes", default="1440,10080", help="comma separated series lengths in minutes")
+    parser.add_argument("--ips", default="10,100", help="comma separated numbers of IPs for the identifier")
+    parser.add_argument("--filter", default="", help="only run the cases whose name contains this text")
+    parser.add_argument("--repeat", type=int, default=5, help="repetitions of the timing")
+    parser.add_argument("--min-time", type=float, default=0.2, help="approximate seconds of each repetition")
+    parser.add_argument("--baseline", default=BASELINE, help="path of the baseline file")
+    parser.add_argument("--save-baseline", action="store_true", help="store the results as the new baseline")
+    parser.add_argument("--time-threshold", type=float, default=0.25, help="allowed relative slowdown")
+    parser.add_argument("--memory-threshold", type=float, default=0.25, help="allowed relative peak memory increase")
+    args = parser.parse_args()
+    cases = model_cases([int(size) for size in args.sizes.split(",") if size])
+    cases.update(identifier_cases([int(ips) for ips in args.ips.split(",") if ips]))
+    cases = {name: function for name, function in cases.items() if args.filter in name}
+    results = run(cases, args.repeat, args.min_time)
+    baseline = load_baseline(args.baseline)
+    print(f"{'case':<48}{'ms/call':>12}{'baseline':>12}{'peak KiB':>12}{'baseline':>12}")
+    for name, result in results.items():
+        base = baseline.get(name, {})
+        print(
+            f"{name:<48}{1000*result['seconds']:>12.3f}{1000*base.get('seconds', float('nan')):>12.3f}"
+            f"{result['peak_bytes']/1024:>12.0f}{base.get('peak_bytes', float('nan'))/1024:>12.0f}"
+        )
+    if args.save_baseline:
+        save_baseline(args.baseline, dict(load_baseline(args.baseline), **results))
+        print(f"Baseline saved to {args.baseline}")
+        return
+    regressions = compare(results, baseline, args.time_threshold, args.memory_threshold)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    sys.exit(1 if regressions else 0)
+
+if __name__ == '__main__':
+    main()
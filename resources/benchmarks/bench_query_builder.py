@@ -0,0 +1,110 @@
+# Copyright (C) 2024 Eneo Tecnologia S.L.
+#
+# Authors:
+# Miguel Álvarez Adsuara <malvarez@redborder.com>
+# Pablo Rodriguez Flores <prodriguez@redborder.com>
+#
+# This program is free software: you can redistribute it and/or modify it under the terms of the
+# GNU Affero General Public License as published by the Free Software Foundation, either version 3
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without
+# even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with this program.
+# If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Benchmark of the cost of building druid queries with the QueryBuilder.
+
+Run from the root of the repository:
+
+    python -m resources.benchmarks.bench_query_builder
+"""
+import os
+import json
+import copy
+import timeit
+import argparse
+
+from resources.src.druid.query_builder import QueryBuilder
+
+DRUID_DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src", "druid", "data")
+
+def load_traffic_query():
+    """
+    Load the query used by the training job.
+
+    Returns:
+        (dict): druid query.
+    """
+    with open(os.path.join(DRUID_DATA, "trafficquery.json"), 'r') as json_file:
+        return json.load(json_file)
+
+def serialized_post_aggregations(builder, query):
+    """
+    Reference implementation of modify_aggregations that serializes the post aggregations
+    on every call and deep copies the query to avoid sharing its nested objects.
+
+    Args:
+        builder (QueryBuilder): builder with the aggregations.
+        query (dict): druid query.
+
+    Returns:
+        (dict): the modified query.
+    """
+    new_query = copy.deepcopy(query)
+    new_query["aggregations"] = builder.aggregations
+    spg = builder.granularity_to_seconds(query["granularity"]["period"])
+    post_aggregations = json.dumps(builder.post_aggregations).replace('"seconds_per_granularity"', str(spg))
+    new_query["postAggregations"] = json.loads(post_aggregations)
+    return new_query
+
+def build_training_query(builder, query, granularity):
+    """
+    Build a training query the way the training job does.
+
+    Args:
+        builder (QueryBuilder): query builder.
+        query (dict): druid query.
+        granularity (str): druid granularity.
+
+    Returns:
+        (dict): the query.
+    """
+    new_query = builder.modify_filter(query, {"type": "selector", "dimension": "sensor_name", "value": "FlowSensor"})
+    new_query = builder.set_time_origin(new_query, "2023-01-01T00:00:00Z")
+    new_query = builder.set_time_interval(new_query, "2023-01-01T00:00:00Z", "2023-01-02T00:00:00Z")
+    return builder.modify_aggregations(builder.modify_granularity(new_query, granularity))
+
+def run(number):
+    """
+    Time each way of building a query.
+
+    Args:
+        number (int): executions of each case.
+
+    Returns:
+        (dict): microseconds per execution of each case.
+    """
+    builder = QueryBuilder(
+        os.path.join(DRUID_DATA, "aggregations.json"), os.path.join(DRUID_DATA, "postAggregations.json")
+    )
+    query = load_traffic_query()
+    cases = {
+        "modify_aggregations (serialized)": lambda: serialized_post_aggregations(builder, query),
+        "modify_aggregations": lambda: builder.modify_aggregations(query),
+        "training query": lambda: build_training_query(builder, query, "pt5m")
+    }
+    return {name: min(timeit.repeat(case, number=number, repeat=5))/number*1e6 for name, case in cases.items()}
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of the druid query builder")
+    parser.add_argument("--number", type=int, default=10000, help="executions of each case")
+    args = parser.parse_args()
+    for name, microseconds in run(args.number).items():
+        print(f"{name:<36}{microseconds:>10.2f} us/query")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,235 @@
+# Copyright (C) 2024 Eneo Tecnologia S.L.
+#
+# Authors:
+# Miguel Álvarez Adsuara <malvarez@redborder.com>
+# Pablo Rodriguez Flores <prodriguez@redborder.com>
+#
+# This program is free software: you can redistribute it and/or modify it under the terms of the
+# GNU Affero General Public License as published by the Free Software Foundation, either version 3
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without
+# even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with this program.
+# If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Training throughput benchmark of the Trainer.
+
+Runs the data preparation and fit of the Trainer on synthetic druid responses, or on files of the
+training data cache, for every combination of dataset size, batch size and TensorFlow
+thread setting. Each combination runs in its own process, because the TensorFlow thread
+pools cannot be changed once they exist and so the peak RSS of every run is its own.
+
+Run from the root of the repository:
+
+    python -m resources.benchmarks.bench_training --days 1,7 --batch-sizes 32,128 --threads 0,2,4
+"""
+import os
+import sys
+import json
+import time
+import resource
+import argparse
+import itertools
+import subprocess
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.abspath(os.path.join(BENCHMARKS, "..", ".."))
+AI_PATH = os.path.join(BENCHMARKS, "..", "src", "ai")
+GRANULARITIES = "pt1m,pt2m,pt5m,pt15m,pt30m,pt1h,pt2h,pt8h"
+
+def peak_rss():
+    """
+    Get the peak resident memory of this process.
+
+    Returns:
+        (int): bytes.
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss*1024
+
+def synthetic_data(days, granularities, seed=0):
+    """
+    Generate the training data of a model from the fake druid broker.
+
+    Args:
+        days (float): days of history of each granularity.
+        granularities (list): druid granularities queried.
+        seed (int): seed of the synthetic traffic.
+
+    Returns:
+        (list): druid response of each granularity.
+    """
+    from resources.benchmarks.bench_models import druid_response
+    from resources.benchmarks.fake_druid import FakeDruid
+    fake = FakeDruid(seed=seed)
+    return [druid_response(fake, int(days*1440), granularity) for granularity in granularities]
+
+def cached_data(paths):
+    """
+    Load training data from files of the training data cache.
+
+    Args:
+        paths (list): npz files written by TrainingDataCache.
+
+    Returns:
+        (list): druid response of each file.
+    """
+    from resources.src.redborder.training_cache import TrainingDataCache
+    raw_data = []
+    for path in paths:
+        cached = TrainingDataCache(os.path.dirname(os.path.abspath(path)), 0, None).load(path)
+        if cached is None:
+            raise ValueError(f"Could not load training cache file {path}")
+        _, timestamps, columns = cached
+        raw_data.append(TrainingDataCache.to_rows(timestamps, columns))
+    return raw_data
+
+def run(raw_data, epochs, batch_size, intra_op_threads=0, inter_op_threads=0, model_file=None, model_config_file=None):
+    """
+    Prepare the data and train a model in memory, timing each stage. The model files are
+    not modified.
+
+    Args:
+        raw_data (list): druid responses used for training.
+        epochs (int): training epochs.
+        batch_size (int): slices per batch.
+        intra_op_threads (int): TensorFlow threads inside an operation, 0 for the default.
+        inter_op_threads (int): TensorFlow threads running operations, 0 for the default.
+        model_file (str): .keras file of the model, the traffic model by default.
+        model_config_file (str): .ini file of the model.
+
+    Returns:
+        (dict): number of training samples, data preparation and fit times, epoch times,
+          samples per second and peak RSS.
+    """
+    import tensorflow as tf
+    if intra_op_threads:
+        tf.config.threading.set_intra_op_parallelism_threads(intra_op_threads)
+    if inter_op_threads:
+        tf.config.threading.set_inter_op_parallelism_threads(inter_op_threads)
+    from resources.src.ai.trainer import Trainer
+
+    class EpochTimer(tf.keras.callbacks.Callback):
+        def on_epoch_begin(self, epoch, logs=None):
+            self.start = time.perf_counter()
+
+        def on_epoch_end(self, epoch, logs=None):
+            epoch_times.append(time.perf_counter() - self.start)
+
+    epoch_times = []
+    trainer = Trainer(
+        model_file or os.path.join(AI_PATH, "traffic.keras"),
+        model_config_file or os.path.join(AI_PATH, "traffic.ini")
+    )
+    model_rss = peak_rss()
+    start = time.perf_counter()
+    data = trainer.prepare_series_for_training(raw_data)
+    prep_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    trainer.fit(data, epochs, batch_size, callbacks=[EpochTimer()])
+    fit_seconds = time.perf_counter() - start
+    samples = len(trainer.slice_starts(data))
+    steady = epoch_times[1:] or epoch_times
+    return {
+        "samples": samples,
+        "prep_seconds": prep_seconds,
+        "fit_seconds": fit_seconds,
+        "prep_share": prep_seconds/(prep_seconds + fit_seconds),
+        "first_epoch_seconds": epoch_times[0],
+        "epoch_seconds": sum(steady)/len(steady),
+        "samples_per_second": samples/(sum(steady)/len(steady)),
+        "model_rss_bytes": model_rss,
+        "peak_rss_bytes": peak_rss()
+    }
+
+def run_in_subprocess(setting, args):
+    """
+    Benchmark one setting in a new process.
+
+    Args:
+        setting (dict): days, batch size and thread counts of the run.
+        args (argparse.Namespace): options shared by every run.
+
+    Returns:
+        (dict): the setting together with the measurements of the run.
+
+    Raises:
+        RuntimeError: if the run fails.
+    """
+    command = [
+        sys.executable, "-m", "resources.benchmarks.bench_training", "--worker",
+        "--days", str(setting["days"]), "--batch-sizes", str(setting["batch_size"]),
+        "--threads", str(setting["intra_op_threads"]), "--inter-op-threads", str(setting["inter_op_threads"]),
+        "--epochs", str(args.epochs), "--granularities", args.granularities
+    ]
+    if args.cache_files:
+        command += ["--cache-files", args.cache_files]
+    process = subprocess.run(command, cwd=ROOT, capture_output=True, text=True)
+    for line in reversed(process.stdout.splitlines()):
+        if line.startswith("RESULT "):
+            return dict(setting, **json.loads(line[len("RESULT "):]))
+    raise RuntimeError(f"Benchmark run {setting} failed:\n{process.stderr[-2000:]}")
+
+def format_report(results):
+    """
+    Format the benchmark results as a table.
+
+    Args:
+        results (list): setting and measurements of each run.
+
+    Returns:
+        (str): the table.
+    """
+    lines = [
+        f"{'days':>6}{'batch':>7}{'intra':>7}{'inter':>7}{'samples':>9}{'prep s':>9}{'fit s':>9}"
+        f"{'prep %':>8}{'epoch s':>9}{'samples/s':>11}{'peak RSS MiB':>14}"
+    ]
+    for result in results:
+        lines.append(
+            f"{result['days']:>6g}{result['batch_size']:>7}{result['intra_op_threads']:>7}{result['inter_op_threads']:>7}"
+            f"{result['samples']:>9}{result['prep_seconds']:>9.2f}{result['fit_seconds']:>9.2f}"
+            f"{100*result['prep_share']:>8.1f}{result['epoch_seconds']:>9.3f}{result['samples_per_second']:>11.1f}"
+            f"{result['peak_rss_bytes']/2**20:>14.0f}"
+        )
+    return "\n".join(lines)
+
+def main():
+    parser = argparse.ArgumentParser(description="Training throughput benchmark of the Trainer")
+    parser.add_argument("--days", default="1,7", help="comma separated days of history per granularity")
+    parser.add_argument("--batch-sizes", default="32,128", help="comma separated batch sizes")
+    parser.add_argument("--threads", default="0", help="comma separated TensorFlow intra-op threads, 0 for the default")
+    parser.add_argument("--inter-op-threads", type=int, default=0, help="TensorFlow inter-op threads, 0 for the default")
+    parser.add_argument("--epochs", type=int, default=3, help="training epochs of each run")
+    parser.add_argument("--granularities", default=GRANULARITIES, help="comma separated granularities of the synthetic data")
+    parser.add_argument("--cache-files", default="", help="comma separated training cache files used instead of synthetic data")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.worker:
+        if args.cache_files:
+            raw_data = cached_data(args.cache_files.split(","))
+        else:
+            raw_data = synthetic_data(float(args.days), args.granularities.split(","))
+        result = run(raw_data, args.epochs, int(args.batch_sizes), int(args.threads), args.inter_op_threads)
+        print("RESULT " + json.dumps(result))
+        return
+    days = [float(value) for value in args.days.split(",")] if not args.cache_files else [0]
+    settings = [
+        {"days": day, "batch_size": batch_size, "intra_op_threads": threads, "inter_op_threads": args.inter_op_threads}
+        for day, batch_size, threads in itertools.product(
+            days, map(int, args.batch_sizes.split(",")), map(int, args.threads.split(","))
+        )
+    ]
+    results = []
+    for setting in settings:
+        results.append(run_in_subprocess(setting, args))
+        print(format_report(results[-1:]).splitlines()[-1] if len(results) > 1 else format_report(results), flush=True)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(results, output_file, indent=2)
+
+if __name__ == '__main__':
+    main()
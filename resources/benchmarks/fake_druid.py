@@ -0,0 +1,286 @@
+# Copyright (C) 2024 Eneo Tecnologia S.L.
+#
+# Authors:
+# Miguel Álvarez Adsuara <malvarez@redborder.com>
+# Pablo Rodriguez Flores <prodriguez@redborder.com>
+#
+# This program is free software: you can redistribute it and/or modify it under the terms of the
+# GNU Affero General Public License as published by the Free Software Foundation, either version 3
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without
+# even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with this program.
+# If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Local stand-in for the druid broker that answers timeseries queries with synthetic
+seasonal traffic, so the service can be exercised without a druid cluster.
+
+Run from the root of the repository:
+
+    python -m resources.benchmarks.fake_druid --port 8082 --delay 0.05
+"""
+import json
+import math
+import time
+import zlib
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from resources.src.druid.resampler import evaluate
+from resources.src.druid.utils import parse_iso8601, to_iso8601
+
+BYTES_PER_MINUTE = 5e7
+FIELD_SCALE = {"bytes": 1, "sum_bytes": 1, "pkts": 1/800, "sum_pkts": 1/800, "flows": 1/20000, "events": 1/20000}
+
+class FakeDruid:
+    """
+    Synthetic druid timeseries data with daily and weekly seasonality, noise and
+    injected anomalies. The values only depend on the bucket and the seed, so every
+    query for the same bucket gets the same answer.
+
+    Args:
+        delay (float): seconds each response is delayed.
+        jitter (float): maximum random seconds added to the delay.
+        anomaly_rate (float): fraction of buckets whose traffic is multiplied by
+          anomaly_factor.
+        anomaly_factor (float): size of the injected anomalies.
+        seed (int): seed of the noise and anomalies.
+    """
+    def __init__(self, delay=0.0, jitter=0.0, anomaly_rate=0.01, anomaly_factor=8.0, seed=0):
+        self.delay = float(delay)
+        self.jitter = float(jitter)
+        self.anomaly_rate = float(anomaly_rate)
+        self.anomaly_factor = float(anomaly_factor)
+        self.seed = int(seed)
+        self.server = None
+        self.thread = None
+        self.queries = 0
+
+    def noise(self, epoch, salt=0):
+        """
+        Get a deterministic pseudo random number of a bucket.
+
+        Args:
+            epoch (float): start of the bucket.
+            salt (int): distinguishes numbers of the same bucket.
+
+        Returns:
+            (float): number in [0, 1).
+        """
+        return zlib.crc32(f"{self.seed}:{salt}:{int(epoch)}".encode()) / 2**32
+
+    def is_anomaly(self, epoch):
+        """
+        Check whether an anomaly was injected in a bucket.
+
+        Args:
+            epoch (float): start of the bucket.
+
+        Returns:
+            (bool): True if the traffic of the bucket is anomalous.
+        """
+        return self.noise(epoch, salt=1) < self.anomaly_rate
+
+    def traffic(self, epoch):
+        """
+        Get the traffic level of an instant relative to the daily mean.
+
+        Args:
+            epoch (float): epoch seconds.
+
+        Returns:
+            (float): traffic level.
+        """
+        day = (epoch % 86400)/86400
+        week = (epoch % 604800)/604800
+        level = 1 + 0.6*math.sin(2*math.pi*(day - 0.35)) + 0.15*math.sin(2*math.pi*week)
+        level *= 0.9 + 0.2*self.noise(epoch)
+        if self.is_anomaly(epoch):
+            level *= self.anomaly_factor
+        return max(level, 0.05)
+
+    def aggregate(self, aggregation, epoch, seconds):
+        """
+        Compute the value of an aggregation for a bucket.
+
+        Args:
+            aggregation (dict): druid aggregation.
+            epoch (float): start of the bucket.
+            seconds (int): length of the bucket.
+
+        Returns:
+            (float): value of the aggregation.
+        """
+        if aggregation.get("type") == "filtered":
+            salt = zlib.crc32(json.dumps(aggregation.get("filter"), sort_keys=True).encode()) % 7
+            return self.aggregate(aggregation["aggregator"], epoch + salt*60, seconds)
+        level = self.traffic(epoch)
+        if aggregation.get("type") in ("hyperUnique", "cardinality", "thetaSketch"):
+            return 50*level*math.log2(1 + seconds/60)
+        minutes = seconds/60
+        scale = FIELD_SCALE.get(aggregation.get("fieldName", aggregation.get("name")), 1/1000)
+        value = BYTES_PER_MINUTE*minutes*level*scale
+        return int(value) if aggregation.get("type", "").startswith("long") or aggregation.get("type") == "count" else value
+
+    def timeseries(self, query):
+        """
+        Answer a timeseries query.
+
+        Args:
+            query (dict): druid query.
+
+        Returns:
+            (list): druid timeseries response.
+
+        Raises:
+            ValueError: if the query is not a timeseries query with a period granularity.
+        """
+        granularity = query.get("granularity", {})
+        if query.get("queryType") != "timeseries" or not isinstance(granularity, dict):
+            raise ValueError("Only timeseries queries with a period granularity are supported")
+        seconds = granularity_seconds(granularity.get("period", "pt1m"))
+        origin = parse_iso8601(granularity.get("origin")) or 0
+        rows = []
+        for interval in query.get("intervals", []):
+            start, _, end = interval.partition("/")
+            start, end = parse_iso8601(start), parse_iso8601(end)
+            bucket = origin + math.floor((start - origin)/seconds)*seconds
+            while bucket < end:
+                result = {
+                    aggregation.get("name", aggregation.get("aggregator", {}).get("name")): self.aggregate(
+                        aggregation, bucket, seconds
+                    )
+                    for aggregation in query.get("aggregations", [])
+                }
+                for post_aggregation in query.get("postAggregations", []):
+                    result[post_aggregation["name"]] = evaluate(post_aggregation, result)
+                rows.append({"timestamp": to_iso8601(bucket), "result": result})
+                bucket += seconds
+        if query.get("descending"):
+            rows.reverse()
+        return rows
+
+    def ip_traffic(self, ips, minutes, start=1672531200, seed=0):
+        """
+        Generate the per IP traffic and outliers taken by the IP identifier.
+
+        Args:
+            ips (int): number of IPs.
+            minutes (int): minutes of traffic of each IP.
+            start (float): epoch of the first minute.
+            seed (int): seed of the share of traffic of each IP.
+
+        Returns:
+            (tuple): outliers and druid timeseries response of each IP.
+        """
+        rng = random.Random(seed)
+        timestamps = [start + 60*minute for minute in range(minutes)]
+        bytes_aggregation = {"type": "longSum", "name": "bytes"}
+        all_ips_data = {}
+        for i in range(ips):
+            share, shift = rng.uniform(0.1, 1), rng.randrange(60)
+            all_ips_data[f"10.0.{i//256}.{i%256}"] = [{
+                "timestamp": to_iso8601(timestamp),
+                "result": {"bytes": int(share*self.aggregate(bytes_aggregation, timestamp + shift, 60))}
+            } for timestamp in timestamps]
+        outliers = [
+            {"timestamp": to_iso8601(timestamp), "expected": 0} for timestamp in timestamps if self.is_anomaly(timestamp)
+        ]
+        return outliers, all_ips_data
+
+    def handler(self):
+        """
+        Build the request handler of the HTTP server.
+
+        Returns:
+            (type): BaseHTTPRequestHandler subclass bound to this instance.
+        """
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                fake.queries += 1
+                try:
+                    status, response = 200, fake.timeseries(json.loads(body))
+                except Exception as e:
+                    status, response = 500, {"error": "Unknown exception", "errorMessage": str(e)}
+                time.sleep(fake.delay + random.random()*fake.jitter)
+                payload = json.dumps(response).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def start(self, host="127.0.0.1", port=0):
+        """
+        Serve the broker endpoint from a background thread.
+
+        Args:
+            host (str): address to bind.
+            port (int): port to bind, 0 for any free port.
+
+        Returns:
+            (str): URL of the druid endpoint.
+        """
+        self.server = ThreadingHTTPServer((host, port), self.handler())
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return f"http://{host}:{self.server.server_port}/druid/v2/"
+
+    def stop(self):
+        """
+        Stop the HTTP server.
+        """
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+def granularity_seconds(period):
+    """
+    Get the seconds of a druid ISO 8601 period such as 'pt5m' or 'p1d'.
+
+    Args:
+        period (str): druid period.
+
+    Returns:
+        (int): seconds of the period.
+    """
+    units = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}
+    period = period.lower()
+    return int(''.join(filter(str.isdigit, period)) or 1)*units[period[-1]]
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake druid broker with synthetic traffic")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8082)
+    parser.add_argument("--delay", type=float, default=0.0, help="seconds each response is delayed")
+    parser.add_argument("--jitter", type=float, default=0.0, help="maximum random seconds added to the delay")
+    parser.add_argument("--anomaly-rate", type=float, default=0.01, help="fraction of anomalous buckets")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    fake = FakeDruid(args.delay, args.jitter, args.anomaly_rate, seed=args.seed)
+    print(f"Fake druid listening on {fake.start(args.host, args.port)}")
+    try:
+        fake.thread.join()
+    except KeyboardInterrupt:
+        fake.stop()
+
+if __name__ == '__main__':
+    main()
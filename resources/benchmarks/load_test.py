@@ -0,0 +1,311 @@
+# Copyright (C) 2024 Eneo Tecnologia S.L.
+#
+# Authors:
+# Miguel Álvarez Adsuara <malvarez@redborder.com>
+# Pablo Rodriguez Flores <prodriguez@redborder.com>
+#
+# This program is free software: you can redistribute it and/or modify it under the terms of the
+# GNU Affero General Public License as published by the Free Software Foundation, either version 3
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without
+# even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with this program.
+# If not, see <https://www.gnu.org/licenses/>.
+
+"""
+End-to-end load test of the API server against the fake druid broker.
+
+The service runs in a subprocess with the production gunicorn configuration, querying a
+FakeDruid started by this script, while a pool of clients drives '/api/v1/outliers' and
+'/api/v1/ip_identifier'. Throughput and p50/p95/p99 latency are reported per route, model
+and payload size.
+
+Run from the root of the repository:
+
+    python -m resources.benchmarks.load_test --duration 30 --concurrency 8 --sizes 60,360,1440
+"""
+import os
+import sys
+import json
+import time
+import base64
+import socket
+import random
+import argparse
+import threading
+import subprocess
+import requests
+from concurrent.futures import ThreadPoolExecutor
+
+from resources.benchmarks.fake_druid import FakeDruid
+from resources.src.druid.utils import to_iso8601
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+TRAFFIC_QUERY = os.path.join(ROOT, "resources", "src", "druid", "data", "trafficquery.json")
+BASE_TIME = 1672531200
+
+def percentile(values, p):
+    """
+    Get a percentile of a list of values with linear interpolation.
+
+    Args:
+        values (list): samples.
+        p (float): percentile between 0 and 100.
+
+    Returns:
+        (float): the percentile, or 0 if there are no samples.
+    """
+    if not values:
+        return 0.0
+    values = sorted(values)
+    rank = (len(values) - 1)*p/100
+    lower = int(rank)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower])*(rank - lower)
+
+def summarize(samples, duration):
+    """
+    Aggregate the samples of a load test.
+
+    Args:
+        samples (list): tuples of (route, model, size, seconds, ok).
+        duration (float): seconds the test lasted.
+
+    Returns:
+        (list): requests, errors, throughput and latency percentiles in milliseconds of
+          each route, model and payload size.
+    """
+    groups = {}
+    for route, model, size, seconds, ok in samples:
+        group = groups.setdefault((route, model, size), {"latencies": [], "errors": 0})
+        group["latencies"].append(seconds)
+        group["errors"] += not ok
+    return [{
+        "route": route,
+        "model": model,
+        "size": size,
+        "requests": len(group["latencies"]),
+        "errors": group["errors"],
+        "throughput": len(group["latencies"])/duration if duration else 0.0,
+        "p50_ms": 1000*percentile(group["latencies"], 50),
+        "p95_ms": 1000*percentile(group["latencies"], 95),
+        "p99_ms": 1000*percentile(group["latencies"], 99)
+    } for (route, model, size), group in sorted(groups.items(), key=lambda item: tuple(map(str, item[0])))]
+
+def format_report(report):
+    """
+    Format the summary of a load test as a table.
+
+    Args:
+        report (list): output of summarize.
+
+    Returns:
+        (str): the table.
+    """
+    lines = [f"{'route':<16}{'model':<12}{'size':>8}{'requests':>10}{'errors':>8}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"]
+    for row in report:
+        lines.append(
+            f"{row['route']:<16}{row['model']:<12}{row['size']:>8}{row['requests']:>10}{row['errors']:>8}"
+            f"{row['throughput']:>10.2f}{row['p50_ms']:>10.1f}{row['p95_ms']:>10.1f}{row['p99_ms']:>10.1f}"
+        )
+    return "\n".join(lines)
+
+def outliers_request(model, minutes, offset):
+    """
+    Build the form of an '/api/v1/outliers' request.
+
+    Args:
+        model (str): model name, or 'default' for the shallow model.
+        minutes (int): minutes of traffic requested.
+        offset (int): minutes the interval is shifted, so the response cache does not
+          serve every request.
+
+    Returns:
+        (dict): form fields of the request.
+    """
+    with open(TRAFFIC_QUERY) as query_file:
+        query = json.load(query_file)
+    start = BASE_TIME + 60*offset
+    query["granularity"] = {"type": "period", "period": "pt1m", "origin": to_iso8601(BASE_TIME)}
+    query["intervals"] = [f"{to_iso8601(start)}/{to_iso8601(start + 60*minutes)}"]
+    query["aggregations"] = [
+        {"type": "longSum", "name": "bytes", "fieldName": "sum_bytes"},
+        {"type": "longSum", "name": "pkts", "fieldName": "sum_pkts"},
+        {"type": "longSum", "name": "flows", "fieldName": "events"},
+        {"type": "hyperUnique", "name": "clients", "fieldName": "clients"}
+    ]
+    form = {"query": base64.b64encode(json.dumps(query).encode()).decode()}
+    if model != "default":
+        form["model"] = base64.b64encode(model.encode()).decode()
+    return form
+
+def ip_identifier_request(fake, ips, minutes, seed=0):
+    """
+    Build the form of an '/api/v1/ip_identifier' request with synthetic traffic per IP.
+
+    Args:
+        fake (FakeDruid): source of the synthetic traffic.
+        ips (int): number of IPs.
+        minutes (int): minutes of traffic of each IP.
+        seed (int): seed of the share of traffic of each IP.
+
+    Returns:
+        (dict): form fields of the request.
+    """
+    outliers, all_ips_data = fake.ip_traffic(ips, minutes, BASE_TIME, seed)
+    return {"payload": json.dumps({"outliers": outliers, "all_ips_data": all_ips_data})}
+
+def free_port():
+    """
+    Get a free TCP port of the loopback interface.
+
+    Returns:
+        (int): the port.
+    """
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def serve(druid_url, port):
+    """
+    Run the API server with the production gunicorn configuration, querying the given
+    druid endpoint and listening on the given port.
+
+    Args:
+        druid_url (str): druid broker endpoint.
+        port (int): port to listen on.
+    """
+    from resources.src.druid.client import DruidClient
+    from resources.src.server import rest, production
+    rest.druid_client = DruidClient(
+        query_builder=rest.query_modifier, **dict(rest.druid_client_options(), druid_endpoint=druid_url)
+    )
+    options = production.gunicorn_options(rest.config)
+    options["bind"] = f"127.0.0.1:{port}"
+    production.GunicornApp(rest.APIServer(), options).run()
+
+def start_service(druid_url, port, timeout=120):
+    """
+    Start the API server in a subprocess and wait until it answers health checks.
+
+    Args:
+        druid_url (str): druid broker endpoint.
+        port (int): port the service listens on.
+        timeout (float): seconds to wait for the service.
+
+    Returns:
+        (subprocess.Popen): the service process.
+
+    Raises:
+        RuntimeError: if the service does not become healthy in time.
+    """
+    process = subprocess.Popen(
+        [sys.executable, "-m", "resources.benchmarks.load_test", "--serve", "--druid", druid_url, "--port", str(port)],
+        cwd=ROOT
+    )
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Service exited with code {process.returncode}")
+        try:
+            if requests.get(f"http://127.0.0.1:{port}/health", timeout=1).status_code == 200:
+                return process
+        except requests.RequestException:
+            pass
+        time.sleep(0.5)
+    process.terminate()
+    raise RuntimeError("Service did not become healthy")
+
+def run_load(url, scenarios, duration, concurrency):
+    """
+    Send requests from a pool of clients, picking a random scenario for each request.
+
+    Args:
+        url (str): base URL of the service.
+        scenarios (list): tuples of (route, model, size, form builder). The form builder
+          takes a request number and returns the form fields.
+        duration (float): seconds the load lasts.
+        concurrency (int): number of concurrent clients.
+
+    Returns:
+        (tuple): samples of (route, model, size, seconds, ok) and the real duration.
+    """
+    samples = []
+    lock = threading.Lock()
+    deadline = time.time() + duration
+    counter = iter(range(sys.maxsize))
+
+    def client(seed):
+        rng = random.Random(seed)
+        session = requests.Session()
+        while time.time() < deadline:
+            route, model, size, build = rng.choice(scenarios)
+            form = build(next(counter))
+            start = time.perf_counter()
+            try:
+                response = session.post(f"{url}/api/v1/{route}", data=form, timeout=300)
+                body = response.json()
+                ok = response.status_code == 200 and not (isinstance(body, dict) and body.get("status") == "error")
+            except (requests.RequestException, ValueError):
+                ok = False
+            with lock:
+                samples.append((route, model, size, time.perf_counter() - start, ok))
+
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(client, range(concurrency)))
+    return samples, time.time() - start
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test of the outliers API against a fake druid")
+    parser.add_argument("--duration", type=float, default=30, help="seconds of load")
+    parser.add_argument("--concurrency", type=int, default=8, help="concurrent clients")
+    parser.add_argument("--models", default="default,traffic", help="comma separated models to query")
+    parser.add_argument("--sizes", default="60,360,1440", help="comma separated minutes of traffic per query")
+    parser.add_argument("--ip-sizes", default="10,100", help="comma separated IPs per ip_identifier request, empty to skip")
+    parser.add_argument("--druid-delay", type=float, default=0.02, help="seconds each druid response is delayed")
+    parser.add_argument("--druid-jitter", type=float, default=0.02, help="maximum random seconds added to the delay")
+    parser.add_argument("--url", help="URL of an already running service instead of starting one")
+    parser.add_argument("--output", help="write the report as JSON to this file")
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--druid", help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.serve:
+        serve(args.druid, args.port)
+        return
+
+    fake = FakeDruid(args.druid_delay, args.druid_jitter)
+    druid_url = fake.start()
+    process = None
+    url = args.url
+    if url is None:
+        port = free_port()
+        process = start_service(druid_url, port)
+        url = f"http://127.0.0.1:{port}"
+    scenarios = [
+        ("outliers", model, minutes, lambda n, model=model, minutes=minutes: outliers_request(model, minutes, n))
+        for model in filter(None, args.models.split(","))
+        for minutes in map(int, filter(None, args.sizes.split(",")))
+    ]
+    ip_forms = {ips: ip_identifier_request(fake, ips, 60) for ips in map(int, filter(None, args.ip_sizes.split(",")))}
+    scenarios += [("ip_identifier", "-", ips, lambda n, form=form: form) for ips, form in ip_forms.items()]
+    try:
+        samples, duration = run_load(url, scenarios, args.duration, args.concurrency)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+        fake.stop()
+    report = summarize(samples, duration)
+    print(format_report(report))
+    print(f"{len(samples)/duration:.2f} req/s overall, {fake.queries} druid queries")
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump({"duration": duration, "concurrency": args.concurrency, "results": report}, output_file, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -22,7 +22,9 @@ import sys
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
 from resources.src.logger.logger import logger
 from resources.src.server.rest import APIServer, config
+from resources.src.server import production
 from resources.src.server.production import GunicornApp
+from resources.src.server import inference
 from resources.src.redborder.rq import RqManager
 
 class Outliers:
@@ -51,6 +53,8 @@ class Outliers:
             self.run_test_server(False)
         if "train" in self.environment:
             self.rq_manager.schedule_train_job()
+        if "scoring" in self.environment:
+            self.rq_manager.run_scoring_worker()
         if "test" in self.environment:
             self.run_test_server(True)
 
@@ -69,22 +73,61 @@ class Outliers:
         Run the production server.
 
         This function runs the production server using Gunicorn.
+
+        If preload_models is enabled, every worker starts loading and warming up the configured
+        models in the background right after being forked, and /ready answers 503 until they
+        are warm. Models are not loaded in the master process because TensorFlow's runtime
+        thread pools do not survive a fork.
+
+        Set PROMETHEUS_MULTIPROC_DIR so /metrics aggregates the samples of every worker.
         """
         logger.info("Starting Outliers API REST")
-        __binding_host__ = config.get("OutliersServerProduction", "outliers_binding_address")
-        __binding_port__ = config.get("OutliersServerProduction", "outliers_server_port")
-        gunicorn_workers = config.get("OutliersServerProduction", "outliers_server_workers")
-        gunicorn_threads = config.get("OutliersServerProduction", "outliers_server_threads")
-        options = {
-            'bind': f"{__binding_host__}:{__binding_port__}",
-            'workers': gunicorn_workers,
-            'threads': gunicorn_threads,
-            'worker_class': 'gthread',
-            'max_requests': 100,
-            'max_worker_lifetime': 3600
-        }
-        self.server = APIServer()
+        options = production.gunicorn_options(config)
+        preload = config.get("OutliersServerProduction", "preload_models", fallback="false").lower() == "true"
+        model_names = self.get_model_names() if preload else []
+        inference_client = None
+        if config.get("InferenceServer", "enabled", fallback="false").lower() == "true":
+            inference_client = self.start_inference_server(model_names)
+            options['on_exit'] = lambda server: self.inference_process.terminate()
+        self.server = APIServer(inference_client)
+        if preload:
+            options['post_worker_init'] = lambda worker: self.server.start_warm_up(model_names)
         self.app = GunicornApp(self.server, options)
         self.app.run()
 
-_Outliers = Outliers()
\ No newline at end of file
+    def start_inference_server(self, model_names):
+        """
+        Start the process that owns the deep learning models of this node. Workers send it
+        their predictions through shared memory, so they do not load the models themselves.
+
+        Args:
+            model_names (list): models loaded before serving.
+
+        Returns:
+            InferenceClient: client the workers use to reach the server.
+        """
+        socket_path = config.get("InferenceServer", "socket_path", fallback="/run/rb-aioutliers/inference.sock")
+        authkey = os.urandom(32)
+        self.inference_process = inference.start_server(
+            socket_path,
+            authkey,
+            os.path.join(os.path.dirname(os.path.abspath(__file__)), "ai"),
+            APIServer.model_registry_options(),
+            max_batch = int(config.get("InferenceServer", "max_batch", fallback="512")),
+            batch_wait = float(config.get("InferenceServer", "batch_wait_ms", fallback="5"))/1000,
+            preload = model_names
+        )
+        return inference.InferenceClient(socket_path, authkey)
+
+    def get_model_names(self):
+        """
+        Get the names of the models configured for this node.
+
+        Returns:
+            list: names of the models.
+        """
+        model_names = config.get("Outliers", "model_names")
+        return [name.strip() for name in model_names.split(",") if name.strip()]
+
+if __name__ == '__main__':
+    _Outliers = Outliers()
@@ -32,6 +32,8 @@ import pandas as pd
 import tensorflow as tf
 
 from resources.src.logger import logger
+from resources.src.metrics import metrics
+from resources.src.druid import columns
 
 class Autoencoder:
     """
@@ -41,7 +43,7 @@ class Autoencoder:
         model_file (str): Path to model .keras file.
         model_config (dict): Model parameters (metrics, timestamps, etc...)
     """
-    def __init__(self, model_file, model_config_file):
+    def __init__(self, model_file, model_config_file, model=None):
         """
         Initializes the Autoencoder model and defines constants.
 
@@ -57,7 +59,10 @@ class Autoencoder:
                 loss_mult_metric (float): Extra penalty in the loss function for guessing wrong metrics.
                 loss_mult_minute (float): Extra penalty in the loss function for guessing wrong
                   'minute' field.
+            model (optional): Object with a keras-like predict method used instead of loading
+              the model file, e.g. a model served by another process.
         """
+        self.name = os.path.splitext(os.path.basename(model_file))[0]
         try:
             self.check_existence(model_file, model_config_file)
         except FileNotFoundError as e:
@@ -78,6 +83,9 @@ class Autoencoder:
         except Exception as e:
             logger.logger.error(f"Could not load model conif: {e}")
             raise e
+        if model is not None:
+            self.model = model
+            return
         try:
             self.model = tf.keras.models.load_model(
                 model_file,
@@ -87,6 +95,14 @@ class Autoencoder:
             logger.logger.error(f"Could not load model {e}")
             raise e
 
+    def warm_up(self):
+        """
+        Run a prediction over dummy data so the first real request does not pay for
+        tracing and initializing the model's predict function.
+        """
+        dummy = np.zeros((1, self.window_size*self.num_window, len(self.columns)))
+        self.model.predict(dummy, verbose=0)
+
     def check_existence(self, model_file, model_config_file):
         """
         Check existence of model files and copy them if missing.
@@ -214,26 +230,39 @@ class Autoencoder:
             anomalies (numpy.ndarray): anomalies detected
             loss (numpy.ndarray): loss function for each entry
         """
-        prep_data = self.slice(self.rescale(data))
-        predicted = self.model.predict(prep_data)
-        loss = self.flatten(self.model_loss(prep_data, predicted, single_value = False).numpy())
-        predicted = self.descale(self.flatten(predicted))
-        return predicted, loss
+        with metrics.timer("preprocess", self.name):
+            prep_data = self.slice(self.rescale(data))
+        with metrics.timer("predict", self.name):
+            predicted = self.model.predict(prep_data)
+        return self.postprocess(prep_data, predicted)
 
-    def compute_json(self, metric, raw_json):
+    def postprocess(self, prep_data, predicted):
         """
-        Main method used for anomaly detection.
+        Calculate the loss of a prediction and bring it back to the original scale.
 
-        Make the model process Json data and output to RedBorder prediction Json format.
-        It includes the prediction for each timestamp and the anomalies detected.
+        Args:
+            prep_data (numpy.ndarray): 3D numpy array given to the model.
+            predicted (numpy.ndarray): 3D numpy array predicted by the model.
+        Returns:
+            predicted (numpy.ndarray): predicted data
+            loss (numpy.ndarray): loss function for each entry
+        """
+        with metrics.timer("postprocess", self.name):
+            loss = self.flatten(self.model_loss(prep_data, predicted, single_value = False).numpy())
+            predicted = self.descale(self.flatten(predicted))
+        return predicted, loss
+
+    def prepare_json(self, metric, raw_json):
+        """
+        Validate the input of the model and transform it into a numpy.ndarray.
 
         Args:
             metric (string): the name of field being analyzed.
             raw_json (dict): deserialized Json druid response with the data.
 
         Returns:
-            (dict): deserialized Json with the anomalies and predictions for the data with RedBorder
-              prediction Json format.
+            data (numpy.ndarray): transformed data.
+            timestamps (pandas.Series): pandas series with the timestamp of each entry.
         """
         if metric=="" or metric not in self.metrics:
             error_msg = f"Model has not a metric called {metric}"
@@ -243,19 +272,93 @@ class Autoencoder:
             error_msg = f"Input data is empty"
             logger.logger.error(error_msg)
             raise ValueError(error_msg)
-        threshold = self.avg_loss+5*self.std_loss
-        data, timestamps = self.input_json(raw_json)
+        with metrics.timer("input_json", self.name):
+            data, timestamps = self.input_json(raw_json)
         if self.window_size*self.num_window > len(data):
             error_msg = ("Too few datapoints for current model. The model "
                          f"needs at least {self.window_size*self.num_window } "
                          f"datapoints but only {len(data)} were inputted.")
             logger.logger.error(error_msg)
             raise ValueError(error_msg)
+        return data, timestamps
+
+    def result_json(self, metric, predicted, loss, timestamps):
+        """
+        Detect the anomalies of a prediction and format it as a RedBorder prediction Json.
+
+        Args:
+            metric (string): the name of field being analyzed.
+            predicted (numpy.ndarray): predicted data.
+            loss (numpy.ndarray): loss function for each entry.
+            timestamps (pandas.Series): pandas series with the timestamp of each entry.
+
+        Returns:
+            (dict): deserialized Json with the anomalies and predictions.
+        """
+        threshold = self.avg_loss+5*self.std_loss
+        with metrics.timer("output_json", self.name):
+            predicted = pd.DataFrame(predicted, columns=self.columns)
+            predicted['timestamp'] = timestamps
+            anomalies = predicted[loss>threshold]
+            return self.output_json(metric, anomalies, predicted)
+
+    def compute_json(self, metric, raw_json):
+        """
+        Main method used for anomaly detection.
+
+        Make the model process Json data and output to RedBorder prediction Json format.
+        It includes the prediction for each timestamp and the anomalies detected.
+
+        Args:
+            metric (string): the name of field being analyzed.
+            raw_json (dict): deserialized Json druid response with the data.
+
+        Returns:
+            (dict): deserialized Json with the anomalies and predictions for the data with RedBorder
+              prediction Json format.
+        """
+        data, timestamps = self.prepare_json(metric, raw_json)
         predicted, loss = self.calculate_predictions(data)
-        predicted = pd.DataFrame(predicted, columns=self.columns)
-        predicted['timestamp'] = timestamps
-        anomalies = predicted[loss>threshold]
-        return self.output_json(metric, anomalies, predicted)
+        return self.result_json(metric, predicted, loss, timestamps)
+
+    def compute_json_batch(self, items):
+        """
+        Process several inputs with a single call to the model.
+
+        The slices of every valid input are stacked and predicted together, then split back
+        and formatted separately. Inputs that fail validation get an error instead of a
+        prediction without affecting the rest.
+
+        Args:
+            items (list): (metric, raw_json) tuples.
+
+        Returns:
+            (list): deserialized Json with the prediction or an error for each item, in order.
+        """
+        results = [None]*len(items)
+        prepared = []
+        for index, (metric, raw_json) in enumerate(items):
+            try:
+                data, timestamps = self.prepare_json(metric, raw_json)
+                with metrics.timer("preprocess", self.name):
+                    prep_data = self.slice(self.rescale(data))
+                prepared.append((index, metric, prep_data, timestamps))
+            except Exception as e:
+                results[index] = self.return_error(e)
+        if not prepared:
+            return results
+        with metrics.timer("predict", self.name):
+            predicted = self.model.predict(np.concatenate([item[2] for item in prepared]), verbose=0)
+        offset = 0
+        for index, metric, prep_data, timestamps in prepared:
+            item_predicted = predicted[offset:offset+len(prep_data)]
+            offset += len(prep_data)
+            try:
+                item_predicted, loss = self.postprocess(prep_data, item_predicted)
+                results[index] = self.result_json(metric, item_predicted, loss, timestamps)
+            except Exception as e:
+                results[index] = self.return_error(e)
+        return results
 
     def granularity_from_dataframe(self, dataframe):
         """
@@ -279,13 +382,14 @@ class Autoencoder:
         Also returns the timestamps for each entry.
 
         Args:
-            raw_json (dict): deserialized Json druid response with the data.
+            raw_json (list or TimeseriesColumns): deserialized Json druid response with the data,
+              or the response parsed by columns.
 
         Returns:
             data (numpy.ndarray): transformed data.
             timestamps (pandas.Series): pandas series with the timestamp of each entry.
         """
-        data = pd.json_normalize(raw_json)
+        data = columns.to_frame(raw_json)
         data["granularity"] = self.granularity_from_dataframe(data)
         data.rename(columns={f"result.{metric}": metric for metric in self.metrics}, inplace=True)
         timestamps = data['timestamp']
@@ -330,6 +434,16 @@ class Autoencoder:
         finally:
             tf.keras.backend.clear_session()
 
+    @staticmethod
+    def execute_prediction_model_batch(autoencoder, items):
+        try:
+            return autoencoder.compute_json_batch(items)
+        except Exception as e:
+            logger.logger.error("Could not execute deep learning model")
+            return [autoencoder.return_error(e) for _ in items]
+        finally:
+            tf.keras.backend.clear_session()
+
     @staticmethod
     def return_error(error="error"):
         """
@@ -22,6 +22,8 @@ import pandas as pd
 from sklearn.ensemble import IsolationForest
 
 from resources.src.logger import logger
+from resources.src.metrics import metrics
+from resources.src.druid import columns
 
 class ShallowOutliers:
     """
@@ -162,20 +164,24 @@ class ShallowOutliers:
         It includes the prediction for each timestamp and the anomalies detected.
 
         Args:
-            raw_json (Json): druid Json response with the data.
+            raw_json (Json or TimeseriesColumns): druid Json response with the data, or the
+              response parsed by columns.
 
         Returns:
             (Json): Json with the anomalies and predictions for the data with RedBorder prediction
               Json format.
         """
-        data = pd.json_normalize(raw_json)
-        arr = self.extract_array(data)
-        smoothed_arr = self.predict(arr)
-        encoded_timestamp = self.encode_timestamp(data["timestamp"])
-        outliers = self.get_outliers(arr, smoothed_arr, other=encoded_timestamp)
-        data["smooth"] = smoothed_arr
-        predicted = data[["timestamp","smooth"]].rename(columns={"smooth":"forecast"})
-        anomalies = data[["timestamp","smooth"]].rename(columns={"smooth":"expected"}).loc[outliers]
+        with metrics.timer("input_json"):
+            data = columns.to_frame(raw_json)
+            arr = self.extract_array(data)
+        with metrics.timer("predict"):
+            smoothed_arr = self.predict(arr)
+            encoded_timestamp = self.encode_timestamp(data["timestamp"])
+            outliers = self.get_outliers(arr, smoothed_arr, other=encoded_timestamp)
+        with metrics.timer("output_json"):
+            data["smooth"] = smoothed_arr
+            predicted = data[["timestamp","smooth"]].rename(columns={"smooth":"forecast"})
+            anomalies = data[["timestamp","smooth"]].rename(columns={"smooth":"expected"}).loc[outliers]
         return  {
             "anomalies":anomalies.to_dict(orient="records"),
             "predicted":predicted.to_dict(orient="records"),
@@ -28,6 +28,7 @@ import sys
 import datetime
 import numpy as np
 import configparser
+import tensorflow as tf
 from datetime import datetime
 from tensorflow.keras.optimizers import AdamW
 
@@ -45,19 +46,22 @@ class Trainer(Autoencoder):
     Args:
         model_file (str): Path to model's .keras file.
         model_config_file (dict): Path to model's .ini file.
+        shuffle_buffer (int): Number of slices the training shuffle draws from.
     """
 
-    def __init__(self, model_file, model_config_file):
+    def __init__(self, model_file, model_config_file, shuffle_buffer=10000):
         """
         Class initialization.
 
         Args:
             model_file (str): Path to model's .keras file.
             model_config_file (dict): Path to model's .ini file.
+            shuffle_buffer (int): Number of slices the training shuffle draws from.
         """
         super().__init__(model_file, model_config_file)
         self.model_file = model_file
         self.model_config_file = model_config_file
+        self.shuffle_buffer = int(shuffle_buffer)
         self.model.compile(loss = self.model_loss, optimizer = AdamW(learning_rate = 0.00001))
 
     def save_model(self, save_model_file, save_config_file):
@@ -106,19 +110,33 @@ class Trainer(Autoencoder):
         """
         return data
 
+    def prepare_series_for_training(self, raw_data):
+        """
+        Transform the training data into the rescaled series the slices are taken from.
+
+        Args:
+            raw_data (list): list with the response form one or more druid queries, as rows or
+              as TimeseriesColumns.
+
+        Returns:
+            (numpy ndarray): 2D array with the rescaled data of every query, one after another.
+        """
+        data = np.concatenate([self.input_json(query_json)[0] for query_json in raw_data], axis = 0)
+        return self.rescale(data)
+
     def prepare_data_for_training(self, raw_data, augment = False):
         """
         Prepares data to be used for training the model.
 
         Args:
-            raw_data (list): list with the response form one or more druid queries.
+            raw_data (list): list with the response form one or more druid queries, as rows or
+              as TimeseriesColumns.
             augment (boolean): set to True to generate more data for training.
 
         Returns:
             prep_data (numpy ndarray): transformed data for its use in the model.
         """
-        data = np.concatenate([self.input_json(query_json)[0] for query_json in raw_data], axis = 0)
-        prep_data = self.rescale(data)
+        prep_data = self.prepare_series_for_training(raw_data)
         if augment:
             #TODO actually augment data
             prep_data = self.data_augmentation(prep_data)
@@ -126,6 +144,92 @@ class Trainer(Autoencoder):
             prep_data = self.slice(prep_data)
         return prep_data
 
+    def slice_starts(self, data):
+        """
+        Get where each slice of a series starts, the same slices taken by slice.
+
+        Args:
+            data (numpy ndarray): 2D array with the rescaled series.
+
+        Returns:
+            (numpy ndarray): index of the first row of each slice.
+        """
+        return np.arange(0, len(data) - self.window_size*self.num_window + 1, self.window_size)
+
+    def training_dataset(self, data, batch_size=32, shuffle=True):
+        """
+        Build the input pipeline of the model. Slices are taken from the series as they are
+        consumed instead of being materialized, so the memory used does not grow with the
+        overlap of the slices. The order of the slices is shuffled within a bounded buffer
+        and batches are prepared while the model trains on the previous ones.
+
+        Args:
+            data (numpy ndarray): 2D array with the rescaled series.
+            batch_size (int): how many slices should the model take at once.
+            shuffle (boolean): set to False to keep the slices in order.
+
+        Returns:
+            (tf.data.Dataset): batches of (slices, slices).
+
+        Raises:
+            ValueError: if the series is shorter than a slice.
+        """
+        starts = self.slice_starts(data)
+        if len(starts) == 0:
+            error_msg = ("Too few datapoints for training. The model needs at least "
+                         f"{self.window_size*self.num_window} datapoints but only {len(data)} were given.")
+            logger.logger.error(error_msg)
+            raise ValueError(error_msg)
+        series = tf.constant(data, dtype=tf.float32)
+        slice_length = self.window_size*self.num_window
+        dataset = tf.data.Dataset.from_tensor_slices(starts)
+        if shuffle:
+            dataset = dataset.shuffle(min(self.shuffle_buffer, len(starts)), reshuffle_each_iteration=True)
+        dataset = dataset.map(
+            lambda start: series[start:start + slice_length], num_parallel_calls=tf.data.AUTOTUNE
+        )
+        return dataset.map(lambda window: (window, window)).batch(batch_size).prefetch(tf.data.AUTOTUNE)
+
+    def fit(self, data, epochs=20, batch_size=32, callbacks=None):
+        """
+        Train the model to reconstruct the slices of a series.
+
+        Args:
+            data (numpy ndarray): 2D array returned by prepare_series_for_training.
+            epochs (int): how many times should the model train on the data.
+            batch_size (int): how many slices should the model take at once
+            for training.
+            callbacks (None or list): keras callbacks called during training.
+
+        Returns:
+            (keras.callbacks.History): loss of each epoch.
+        """
+        return self.model.fit(
+            self.training_dataset(data, batch_size), epochs = epochs, verbose = 0, callbacks = callbacks
+        )
+
+    def training_loss(self, data, batch_size=32):
+        """
+        Compute the mean and standard deviation of the loss of the model on every element of
+        the slices of a series, one batch at a time.
+
+        Args:
+            data (numpy ndarray): 2D array returned by prepare_series_for_training.
+            batch_size (int): how many slices are predicted at once.
+
+        Returns:
+            (tuple): mean and standard deviation of the loss.
+        """
+        total, total_squares, count = 0.0, 0.0, 0
+        for window, _ in self.training_dataset(data, batch_size, shuffle=False):
+            loss = self.model_loss(window, self.model(window, training=False), single_value=False)
+            loss = tf.cast(loss, tf.float64)
+            total += float(tf.reduce_sum(loss))
+            total_squares += float(tf.reduce_sum(tf.square(loss)))
+            count += int(tf.size(loss))
+        mean = total/count
+        return mean, np.sqrt(max(total_squares/count - mean**2, 0.0))
+
     def train(self, raw_data, epochs=20, batch_size=32, backup_path=None):
         """
         Given a druid query response, it is fed to the model for training.
@@ -141,9 +245,9 @@ class Trainer(Autoencoder):
             backup_path = "./backups/"
         date = datetime.now().strftime("%y-%m-%dT%H:%M")
         self.save_model(f"{backup_path}{date}.keras",f"{backup_path}{date}.ini")
-        prep_data = self.prepare_data_for_training(raw_data)
-        self.model.fit(x=prep_data, y=prep_data, epochs = epochs, batch_size = batch_size, verbose = 0)
-        loss = self.model_loss(prep_data, self.model.predict(prep_data), single_value=False).numpy()
-        self.avg_loss = 0.9*self.avg_loss + 0.1*loss.mean()
-        self.std_loss = 0.9*self.std_loss + 0.1*loss.std()
+        data = self.prepare_series_for_training(raw_data)
+        self.fit(data, epochs, batch_size)
+        loss_mean, loss_std = self.training_loss(data, batch_size)
+        self.avg_loss = 0.9*self.avg_loss + 0.1*loss_mean
+        self.std_loss = 0.9*self.std_loss + 0.1*loss_std
         self.save_model(self.model_file ,self.model_config_file)
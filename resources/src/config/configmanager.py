@@ -30,18 +30,22 @@ class ConfigManager:
         with open(config_file, 'r') as file:
             self.config.read_file(file)
 
-    def get(self, section, option):
+    def get(self, section, option, fallback=None):
         """
         Get the value of an option in a section.
 
         Args:
             section (str): The section name.
             option (str): The option name.
+            fallback (str, optional): Value returned when the section or option does not
+                exist. If not provided, a missing option raises an error.
 
         Returns:
             str: The value of the specified option in the specified section.
         """
-        return self.config.get(section, option)
+        if fallback is None:
+            return self.config.get(section, option)
+        return self.config.get(section, option, fallback=fallback)
 
     def set(self, section, option, value):
         """
@@ -15,23 +15,137 @@
 # You should have received a copy of the GNU Affero General Public License along with this program.
 # If not, see <https://www.gnu.org/licenses/>.
 
-
-import requests
+import os
 import json
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from resources.src.metrics import metrics
+from resources.src.druid import columns
+
+class CountingReader:
+    """
+    File-like wrapper that counts the bytes read from a stream.
+
+    Args:
+        stream: file-like object to read from.
+    """
+    def __init__(self, stream):
+        self.stream = stream
+        self.bytes = 0
+
+    def read(self, size=-1):
+        chunk = self.stream.read(size)
+        self.bytes += len(chunk)
+        return chunk
 
 class DruidClient:
-    def __init__(self, druid_endpoint):
+    def __init__(self, druid_endpoint, pool_size=20, connect_timeout=5, read_timeout=120,
+                 retries=3, retry_backoff=0.5, gzip=True, query_builder=None, chunk_max_buckets=0,
+                 chunk_parallelism=4):
         """
         Initialize a DruidClient instance with the specified Druid endpoint.
 
+        The connections to the broker are kept alive in a pool shared by every thread of
+        the process. Queries that fail with a transient 5xx error or a connection error are
+        retried with exponential backoff, which is safe since druid queries are read only.
+
         Args:
             druid_endpoint (str): The URL of the Druid endpoint.
+            pool_size (int): Maximum connections kept open to the broker.
+            connect_timeout (float): Seconds to wait for a connection.
+            read_timeout (float): Seconds to wait for data from the broker.
+            retries (int): Times a failed query is retried.
+            retry_backoff (float): Backoff factor in seconds between retries.
+            gzip (bool): Whether to ask the broker for gzip compressed responses.
+            query_builder (QueryBuilder, optional): Builder used to split long queries.
+            chunk_max_buckets (int): Timeseries queries with more granularity buckets are
+              split into chunks of this size that run in parallel and are merged into a
+              single response. 0 disables the splitting.
+            chunk_parallelism (int): Chunks of a query executed at the same time.
         """
         self.druid_endpoint = druid_endpoint
+        self.pool_size = int(pool_size)
+        self.timeout = (float(connect_timeout), float(read_timeout))
+        self.retries = int(retries)
+        self.retry_backoff = float(retry_backoff)
+        self.gzip = gzip
+        self.query_builder = query_builder
+        self.chunk_max_buckets = int(chunk_max_buckets)
+        self.chunk_parallelism = int(chunk_parallelism)
+        self.lock = threading.Lock()
+        self.session = None
+        self.session_pid = None
+        self.executor = None
+        self.executor_pid = None
+
+    def get_session(self):
+        """
+        Get the pooled session of this process. Connections are not shared with forked
+        processes (gunicorn workers or rq work-horses), so a new session is created when
+        the process id changes.
+
+        Returns:
+            requests.Session: session with the connection pool and retry policy.
+        """
+        pid = os.getpid()
+        with self.lock:
+            if self.session is None or self.session_pid != pid:
+                retry = Retry(
+                    total=self.retries,
+                    backoff_factor=self.retry_backoff,
+                    status_forcelist=(500, 502, 503, 504),
+                    allowed_methods=frozenset(["POST"]),
+                    raise_on_status=False
+                )
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, max_retries=retry)
+                session = requests.Session()
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                session.headers.update({
+                    "Content-Type": "application/json",
+                    "Accept-Encoding": "gzip" if self.gzip else "identity"
+                })
+                self.session = session
+                self.session_pid = pid
+            return self.session
+
+    def get_executor(self):
+        """
+        Get the thread pool that runs the chunks of split queries in this process.
+
+        Returns:
+            ThreadPoolExecutor: pool of this process.
+        """
+        pid = os.getpid()
+        with self.lock:
+            if self.executor is None or self.executor_pid != pid:
+                self.executor = ThreadPoolExecutor(max_workers=self.chunk_parallelism, thread_name_prefix="druid-chunk")
+                self.executor_pid = pid
+            return self.executor
+
+    def split(self, druid_query):
+        """
+        Split a query into chunks if it is long enough.
+
+        Args:
+            druid_query (dict): The Druid query in dictionary format.
+
+        Returns:
+            list: Queries to execute, in the order of the response.
+        """
+        if self.query_builder is None or self.chunk_max_buckets <= 0:
+            return [druid_query]
+        return self.query_builder.split_intervals(druid_query, self.chunk_max_buckets)
 
     def execute_query(self, druid_query):
         """
-        Execute a Druid query using the specified query dictionary.
+        Execute a Druid query using the specified query dictionary. The response is
+        decoded row by row while it is streamed.
 
         Args:
             druid_query (dict): The Druid query in dictionary format.
@@ -39,14 +153,73 @@ class DruidClient:
         Returns:
             dict: The response from the Druid query in JSON format.
 
+        Raises:
+            Exception: If the Druid query fails with a non-200 status code, or a chunk of a
+              split query does not return a list of rows.
+        """
+        chunks = self.split(druid_query)
+        if len(chunks) == 1:
+            return self.execute(druid_query, columns.load_json)
+        merged = []
+        for rows in self.get_executor().map(lambda chunk: self.execute(chunk, columns.load_json), chunks):
+            if not isinstance(rows, list):
+                raise Exception(f"Druid query chunk did not return a list of rows: {rows}")
+            if merged and rows and rows[0].get("timestamp") == merged[-1].get("timestamp"):
+                rows = rows[1:]
+            merged.extend(rows)
+        return merged
+
+    def execute_query_columns(self, druid_query, fields=None):
+        """
+        Execute a Druid timeseries query and parse the response into columns as it is
+        received, without building the list of rows.
+
+        Args:
+            druid_query (dict): The Druid query in dictionary format.
+            fields (list, optional): Fields of the result to keep. All of them by default.
+
+        Returns:
+            TimeseriesColumns: The response from the Druid query by columns.
+
         Raises:
             Exception: If the Druid query fails with a non-200 status code.
         """
-        query_json = json.dumps(druid_query)
-        response = requests.post(self.druid_endpoint, data=query_json)
+        parse = lambda reader: columns.parse_timeseries(reader, fields)
+        chunks = self.split(druid_query)
+        if len(chunks) == 1:
+            return self.execute(druid_query, parse)
+        return columns.TimeseriesColumns.concatenate(
+            list(self.get_executor().map(lambda chunk: self.execute(chunk, parse), chunks))
+        )
+
+    def execute(self, druid_query, parse):
+        """
+        Send a Druid query and parse the response while it is streamed.
 
-        if response.status_code == 200:
-            response_json = response.json()
-            return response_json
+        Args:
+            druid_query (dict): The Druid query in dictionary format.
+            parse (callable): Function that parses the response from a file-like object.
 
-        raise Exception(f"Druid query failed with status code {response.status_code}.")
+        Returns:
+            The parsed response.
+
+        Raises:
+            Exception: If the Druid query fails with a non-200 status code.
+        """
+        query_json = json.dumps(druid_query)
+        start = time.perf_counter()
+        outcome = "error"
+        try:
+            with self.get_session().post(
+                self.druid_endpoint, data=query_json, timeout=self.timeout, stream=True
+            ) as response:
+                if response.status_code != 200:
+                    raise Exception(f"Druid query failed with status code {response.status_code}.")
+                response.raw.decode_content = True
+                reader = CountingReader(response.raw)
+                response_data = parse(reader)
+                metrics.DRUID_RESPONSE_BYTES.inc(reader.bytes)
+                outcome = "success"
+                return response_data
+        finally:
+            metrics.DRUID_QUERY_LATENCY.labels(outcome).observe(time.perf_counter() - start)
@@ -0,0 +1,283 @@
+# Copyright (C) 2024 Eneo Tecnologia S.L.
+#
+# Authors:
+# Miguel Álvarez Adsuara <malvarez@redborder.com>
+# Pablo Rodriguez Flores <prodriguez@redborder.com>
+#
+# This program is free software: you can redistribute it and/or modify it under the terms of the
+# GNU Affero General Public License as published by the Free Software Foundation, either version 3
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without
+# even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with this program.
+# If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Incremental parsing of druid timeseries responses into NumPy columns, so large
+responses never exist as a list of nested dictionaries.
+"""
+import json
+import codecs
+import numpy as np
+import pandas as pd
+
+class ColumnBuffer:
+    """
+    Growable NumPy array with amortized constant time appends.
+
+    Args:
+        capacity (int): initial number of elements.
+        dtype: NumPy type of the elements.
+    """
+    def __init__(self, capacity=1024, dtype=np.float64):
+        self.data = np.empty(capacity, dtype=dtype)
+        self.size = 0
+
+    def append(self, value):
+        """
+        Add a value at the end of the buffer, doubling its capacity when full.
+
+        Args:
+            value: value to add.
+        """
+        if self.size == len(self.data):
+            grown = np.empty(max(1, 2*len(self.data)), dtype=self.data.dtype)
+            grown[:self.size] = self.data[:self.size]
+            self.data = grown
+        self.data[self.size] = value
+        self.size += 1
+
+    def fill(self, value, count):
+        """
+        Add the same value several times.
+
+        Args:
+            value: value to add.
+            count (int): times to add it.
+        """
+        for _ in range(count):
+            self.append(value)
+
+    def values(self):
+        """
+        Get the values of the buffer.
+
+        Returns:
+            (numpy.ndarray): view of the elements added.
+        """
+        return self.data[:self.size]
+
+class TimeseriesColumns:
+    """
+    Druid timeseries response stored by columns.
+
+    Args:
+        timestamps (numpy.ndarray): timestamps of the buckets as datetime64[ms].
+        columns (dict): values of each field of the result, in order of appearance.
+    """
+    def __init__(self, timestamps, columns):
+        self.timestamps = timestamps
+        self.columns = columns
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    @staticmethod
+    def concatenate(parts):
+        """
+        Join responses of consecutive intervals. A bucket repeated at the start of a part
+        is taken from the previous part.
+
+        Args:
+            parts (list): TimeseriesColumns in order.
+
+        Returns:
+            (TimeseriesColumns): the joined response.
+        """
+        names = list(dict.fromkeys(name for part in parts for name in part.columns))
+        kept = []
+        for part in parts:
+            keep = np.ones(len(part), dtype=bool)
+            if kept and len(kept[-1][1]) and len(part):
+                keep = part.timestamps != kept[-1][1][-1]
+            kept.append((part, part.timestamps[keep], keep))
+        return TimeseriesColumns(
+            np.concatenate([timestamps for _, timestamps, _ in kept]).astype('datetime64[ms]'),
+            {
+                name: np.concatenate([
+                    part.columns[name][keep] if name in part.columns else np.full(keep.sum(), np.nan)
+                    for part, _, keep in kept
+                ]).astype(np.float64)
+                for name in names
+            }
+        )
+
+    def timestamp_strings(self):
+        """
+        Get the timestamps with the druid format.
+
+        Returns:
+            (numpy.ndarray): timestamps such as '2023-01-01T00:00:00.000Z'.
+        """
+        return np.char.add(np.datetime_as_string(self.timestamps, unit='ms'), 'Z')
+
+    def to_frame(self):
+        """
+        Get the response as the dataframe pandas.json_normalize would build from it.
+
+        Returns:
+            (pandas.DataFrame): 'timestamp' column followed by a 'result.<field>' column
+              for each field.
+        """
+        frame = {"timestamp": self.timestamp_strings()}
+        frame.update({f"result.{name}": values for name, values in self.columns.items()})
+        return pd.DataFrame(frame)
+
+def to_frame(raw_json):
+    """
+    Normalize a druid timeseries response, as a list of rows or as columns.
+
+    Args:
+        raw_json (list or TimeseriesColumns): druid response.
+
+    Returns:
+        (pandas.DataFrame): 'timestamp' column and a 'result.<field>' column for each field.
+    """
+    if isinstance(raw_json, TimeseriesColumns):
+        return raw_json.to_frame()
+    return pd.json_normalize(raw_json)
+
+def iter_values(stream, chunk_size=64*1024):
+    """
+    Incrementally decode the elements of a json array.
+
+    Args:
+        stream: file-like object with the utf-8 encoded json array.
+        chunk_size (int): bytes read at a time.
+
+    Yields:
+        Each element of the array, as it is decoded.
+
+    Raises:
+        ValueError: if the stream is not a valid json array.
+    """
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder("utf-8")()
+    buffer, index, previous, eof = "", 0, None, False
+    while True:
+        while index < len(buffer) and buffer[index] in " \t\r\n":
+            index += 1
+        if index < len(buffer):
+            char = buffer[index]
+            if previous is None:
+                if char != "[":
+                    raise ValueError("Druid response is not a json array")
+                previous, index = "[", index + 1
+                continue
+            if previous == "]":
+                raise ValueError("Druid response has data after the end of the json array")
+            if previous == "value":
+                if char not in ",]":
+                    raise ValueError("Druid response is not a valid json array")
+                previous, index = char, index + 1
+                continue
+            if char == "]" and previous == "[":
+                previous, index = "]", index + 1
+                continue
+            try:
+                value, end = decoder.raw_decode(buffer, index)
+            except json.JSONDecodeError:
+                if eof:
+                    raise ValueError("Druid response is not a valid json array")
+            else:
+                # A number cut at the end of the buffer may continue in the next chunk.
+                if eof or buffer[end:].strip("0123456789.eE+-"):
+                    previous, index = "value", end
+                    yield value
+                    continue
+        elif eof:
+            if previous == "]":
+                return
+            raise ValueError("Druid response ended before the end of the json array")
+        chunk = stream.read(chunk_size)
+        eof = not chunk
+        buffer = buffer[index:] + text_decoder.decode(chunk or b"", final=eof)
+        index = 0
+
+class PrefixedReader:
+    """
+    File-like object that returns some already read bytes before the rest of a stream.
+
+    Args:
+        prefix (bytes): bytes returned first.
+        stream: file-like object with the rest of the data.
+    """
+    def __init__(self, prefix, stream):
+        self.prefix = prefix
+        self.stream = stream
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            data, self.prefix = self.prefix + self.stream.read(), b""
+            return data
+        if self.prefix:
+            data, self.prefix = self.prefix[:size], self.prefix[size:]
+            return data
+        return self.stream.read(size)
+
+def load_json(stream, chunk_size=64*1024):
+    """
+    Decode a json document from a stream. Arrays are decoded element by element as they
+    are read, so the raw body is never held in memory at once. Any other document, such
+    as a druid error, is read whole.
+
+    Args:
+        stream: file-like object with the utf-8 encoded json document.
+        chunk_size (int): bytes read at a time.
+
+    Returns:
+        The decoded document.
+
+    Raises:
+        ValueError: if the stream is not valid json.
+    """
+    head = stream.read(chunk_size)
+    reader = PrefixedReader(head, stream)
+    if head.lstrip()[:1] == b"[":
+        return list(iter_values(reader, chunk_size))
+    return json.load(reader)
+
+def parse_timeseries(stream, fields=None, chunk_size=64*1024):
+    """
+    Parse a druid timeseries response into columns while it is read.
+
+    Args:
+        stream: file-like object with the druid response.
+        fields (list): fields of the result to keep. All of them if not given.
+        chunk_size (int): bytes read at a time.
+
+    Returns:
+        (TimeseriesColumns): the parsed response. Missing or null values are NaN.
+
+    Raises:
+        ValueError: if the stream is not a valid druid timeseries response.
+    """
+    timestamps = ColumnBuffer(dtype='datetime64[ms]')
+    columns = {name: ColumnBuffer() for name in fields or []}
+    for row in iter_values(stream, chunk_size):
+        if not isinstance(row, dict) or "timestamp" not in row:
+            raise ValueError("Druid response is not a timeseries")
+        result = row.get("result") or {}
+        if fields is None:
+            for name in result:
+                if name not in columns:
+                    columns[name] = ColumnBuffer()
+                    columns[name].fill(np.nan, timestamps.size)
+        timestamps.append(np.datetime64(row["timestamp"].rstrip("Z"), 'ms'))
+        for name, column in columns.items():
+            value = result.get(name)
+            column.append(np.nan if value is None else value)
+    return TimeseriesColumns(timestamps.values(), {name: column.values() for name, column in columns.items()})
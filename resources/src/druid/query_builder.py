@@ -22,13 +22,20 @@ processed by the model.
 """
 import os
 import json
+import math
 
 from resources.src.logger import logger
+from resources.src.druid.utils import parse_iso8601, to_iso8601
 
 class QueryBuilder:
     """
     Class used to modify the manager usual query to exctract data about
     more fields from a module.
+
+    The queries returned are overlays: a new top level dictionary that shares every
+    object it does not change with the original query and with the templates of the
+    builder. The original query is never modified, and the queries built must be
+    treated as read only, replacing values instead of mutating them.
     """
     def __init__(self, aggregations, post_aggregations):
         """
@@ -52,6 +59,8 @@ class QueryBuilder:
             error_msg=f"PostAggregations decoding failed."
             logger.logger.error(error_msg)
             raise e
+        self.seconds_cache = {}
+        self.post_aggregations_cache = {}
 
     def load_json(self, path):
         """
@@ -86,6 +95,9 @@ class QueryBuilder:
         Returns:
             - (int): number of seconds in the granularity.
         """
+        seconds = self.seconds_cache.get(granularity) if isinstance(granularity, str) else None
+        if seconds is not None:
+            return seconds
         if not isinstance(granularity, str):
             error_msg="Granularity must be a string"
             logger.logger.error(error_msg)
@@ -99,8 +111,10 @@ class QueryBuilder:
             "fifteen_minute": 900, "thirty_minute": 1800,
             "m": 60, "h": 3600, "d": 86400
         }
+        key = granularity
         granularity = granularity.lower()
         if granularity in base_granularities:
+            self.seconds_cache[key] = base_granularities[granularity]
             return base_granularities[granularity]
         try:
             multiplier = base_granularities[granularity[-1]]
@@ -109,8 +123,46 @@ class QueryBuilder:
             error_msg='Invalid granularity'
             logger.logger.error(error_msg)
             raise ValueError(error_msg)
+        self.seconds_cache[key] = numbers * multiplier
         return numbers * multiplier
 
+    def post_aggregations_for(self, granularity):
+        """
+        Get the post aggregations with the seconds of a granularity. They are compiled
+        once for each number of seconds and shared by every query, so they must not be
+        modified.
+
+        Args:
+            -granularity (string): druid granularity.
+        Returns:
+            -(list): post aggregations of the granularity.
+        """
+        spg = self.granularity_to_seconds(granularity)
+        post_aggregations = self.post_aggregations_cache.get(spg)
+        if post_aggregations is None:
+            post_aggregations = self.post_aggregations_cache.setdefault(
+                spg, self.compile_template(self.post_aggregations, spg)
+            )
+        return post_aggregations
+
+    def compile_template(self, template, spg):
+        """
+        Replace the "seconds_per_granularity" placeholders of a template.
+
+        Args:
+            -template: deserialized json with the placeholders.
+            -spg (int): seconds per granularity.
+        Returns:
+            -a new object with the placeholders replaced.
+        """
+        if template == "seconds_per_granularity":
+            return spg
+        if isinstance(template, dict):
+            return {key: self.compile_template(value, spg) for key, value in template.items()}
+        if isinstance(template, list):
+            return [self.compile_template(value, spg) for value in template]
+        return template
+
     def modify_aggregations(self, query):
         """
         Modify a druid query to add every field the traffic module uses.
@@ -126,10 +178,7 @@ class QueryBuilder:
         new_query=query.copy()
         new_query["aggregations"] = self.aggregations
         granularity = query.get("granularity", {}).get("period", "minute")
-        spg = self.granularity_to_seconds(granularity)
-        post_aggregations = json.dumps(self.post_aggregations)
-        post_aggregations = post_aggregations.replace('"seconds_per_granularity"', str(spg))
-        new_query["postAggregations"] = json.loads(post_aggregations)
+        new_query["postAggregations"] = self.post_aggregations_for(granularity)
         return new_query
 
     def modify_granularity(self, query, gran):
@@ -143,7 +192,7 @@ class QueryBuilder:
             -query (dict): the modified query.
         """
         new_query=query.copy()
-        new_query["granularity"]["period"] = gran
+        new_query["granularity"] = dict(query.get("granularity", {}), period=gran)
         return new_query
 
     def modify_filter(self, query, filter_druid):
@@ -170,7 +219,7 @@ class QueryBuilder:
             -query: the modified query.
         """
         new_query=query.copy()
-        new_query["granularity"]["origin"] = time
+        new_query["granularity"] = dict(query.get("granularity", {}), origin=time)
         return new_query
 
     def set_time_interval(self, query, time_start, time_end):
@@ -189,3 +238,107 @@ class QueryBuilder:
             f"{time_start}/{time_end}"
         ]
         return new_query
+
+    def split_intervals(self, query, max_buckets):
+        """
+        Split a timeseries query whose intervals hold more than a number of granularity
+        buckets into queries over consecutive chunks of at most that many buckets. The
+        chunks are aligned to the buckets of the query, so no bucket is split between two
+        of them.
+
+        Args:
+            -query (dict): dictionary with the druid query.
+            -max_buckets (int): maximum buckets of each chunk.
+        Returns:
+            -(list): queries of the chunks in the order of the response, or a list with
+              the original query if it does not need or support splitting.
+        """
+        granularity = query.get("granularity")
+        if (max_buckets <= 0 or query.get("queryType") != "timeseries"
+                or not isinstance(granularity, dict) or not isinstance(query.get("intervals"), list)):
+            return [query]
+        try:
+            seconds = self.granularity_to_seconds(granularity.get("period"))
+        except ValueError:
+            return [query]
+        origin = parse_iso8601(granularity.get("origin")) or 0
+        chunk_seconds = max_buckets*seconds
+        chunks = []
+        for interval in query["intervals"]:
+            start, _, end = str(interval).partition("/")
+            start, end = parse_iso8601(start), parse_iso8601(end)
+            if start is None or end is None:
+                return [query]
+            boundary = origin + math.floor((start - origin)/seconds)*seconds + chunk_seconds
+            while boundary < end:
+                chunks.append(f"{to_iso8601(start)}/{to_iso8601(boundary)}")
+                start, boundary = boundary, boundary + chunk_seconds
+            chunks.append(f"{to_iso8601(start)}/{to_iso8601(end)}")
+        if len(chunks) == len(query["intervals"]):
+            return [query]
+        if query.get("descending"):
+            chunks.reverse()
+        return [self.set_intervals(query, [chunk]) for chunk in chunks]
+
+    def set_intervals(self, query, intervals):
+        """
+        Modify a druid query to change its intervals
+
+        Args:
+            -query: dictionary with the druid query.
+            -intervals (list): druid intervals.
+        Returns:
+            -query: the modified query.
+        """
+        new_query=query.copy()
+        new_query["intervals"] = intervals
+        return new_query
+
+    def group_by_filters(self, query, filters):
+        """
+        Modify a druid query to compute its aggregations for several filters at once.
+        Each aggregation is wrapped in a filtered aggregator named '<key>::<name>' and the
+        query filter becomes the union of the filters. Post aggregations are removed, since
+        they refer to the original names.
+
+        Args:
+            -query (dict): dictionary with the druid query.
+            -filters (dict): druid filter of each key.
+        Returns:
+            -query: the modified query.
+        """
+        new_query=query.copy()
+        new_query["aggregations"] = [
+            {"type": "filtered", "filter": filter_druid, "aggregator": dict(aggregation, name=f"{key}::{aggregation['name']}")}
+            for key, filter_druid in filters.items()
+            for aggregation in query.get("aggregations", [])
+        ]
+        new_query["filter"] = {"type": "or", "fields": list(filters.values())}
+        new_query.pop("postAggregations", None)
+        return new_query
+
+    def split_grouped_response(self, rows, keys, skip_empty=True):
+        """
+        Split the response of a query built with group_by_filters into the timeseries of
+        each filter.
+
+        Args:
+            -rows (list): druid timeseries response.
+            -keys (list): keys of the filters.
+            -skip_empty (bool): leave out the buckets where every aggregation of a filter
+              is zero, as druid does with 'skipEmptyBuckets' for the rows it did not match.
+        Returns:
+            -(dict): timeseries of each key.
+        """
+        split = {key: [] for key in keys}
+        for row in rows:
+            results = {key: {} for key in keys}
+            for name, value in row.get("result", {}).items():
+                key, separator, field = name.partition("::")
+                if separator and key in results:
+                    results[key][field] = value
+            for key, result in results.items():
+                if skip_empty and not any(result.values()):
+                    continue
+                split[key].append({"timestamp": row["timestamp"], "result": result})
+        return split
@@ -0,0 +1,171 @@
+# Copyright (C) 2024 Eneo Tecnologia S.L.
+#
+# Authors:
+# Miguel Álvarez Adsuara <malvarez@redborder.com>
+# Pablo Rodriguez Flores <prodriguez@redborder.com>
+#
+# This program is free software: you can redistribute it and/or modify it under the terms of the
+# GNU Affero General Public License as published by the Free Software Foundation, either version 3
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without
+# even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with this program.
+# If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Local roll-up of fine grained druid timeseries to coarser granularities, so the
+training job queries druid once at the finest granularity and only asks it again for
+the aggregations that cannot be merged.
+"""
+import math
+from collections import OrderedDict
+
+from resources.src.druid.utils import parse_iso8601, to_iso8601
+
+ADDITIVE_AGGREGATIONS = {"count", "longSum", "doubleSum", "floatSum"}
+
+class Resampler:
+    """
+    Build the druid queries of the training data and derive every granularity from the
+    finest one.
+
+    Sums are rolled up locally. Aggregations that cannot be summed, such as the
+    hyperUnique count of clients, are fetched from druid at each granularity with a query
+    that only contains them. Post aggregations are computed locally with the seconds of
+    each granularity.
+
+    Args:
+        query_builder (QueryBuilder): builder with the aggregations and post aggregations.
+    """
+    def __init__(self, query_builder):
+        self.query_builder = query_builder
+        self.additive = [
+            aggregation for aggregation in query_builder.aggregations
+            if aggregation.get("type") in ADDITIVE_AGGREGATIONS
+        ]
+        self.non_additive = [
+            aggregation for aggregation in query_builder.aggregations
+            if aggregation.get("type") not in ADDITIVE_AGGREGATIONS
+        ]
+
+    def base_query(self, query, granularity):
+        """
+        Get the query of every aggregation at the finest granularity.
+
+        Args:
+            query (dict): druid query with the filter and interval.
+            granularity (str): finest granularity.
+
+        Returns:
+            (dict): query without post aggregations.
+        """
+        new_query = self.query_builder.modify_granularity(query, granularity)
+        new_query["aggregations"] = self.additive + self.non_additive
+        new_query.pop("postAggregations", None)
+        return new_query
+
+    def non_additive_query(self, query, granularity):
+        """
+        Get the query of the aggregations that can not be rolled up.
+
+        Args:
+            query (dict): druid query with the filter and interval.
+            granularity (str): granularity of the query.
+
+        Returns:
+            (dict): query with the non additive aggregations only, or None if there are none.
+        """
+        if not self.non_additive:
+            return None
+        new_query = self.query_builder.modify_granularity(query, granularity)
+        new_query["aggregations"] = list(self.non_additive)
+        new_query.pop("postAggregations", None)
+        return new_query
+
+    def resample(self, rows, query, granularity, non_additive_rows=None):
+        """
+        Roll up a timeseries to a coarser granularity. Buckets are aligned to the origin
+        of the query granularity, as druid does.
+
+        Args:
+            rows (list): druid timeseries response at the finest granularity.
+            query (dict): druid query with the granularity origin.
+            granularity (str): target granularity.
+            non_additive_rows (list): druid response with the non additive aggregations
+              at the target granularity.
+
+        Returns:
+            (list): timeseries at the target granularity with its post aggregations.
+        """
+        seconds = self.query_builder.granularity_to_seconds(granularity)
+        origin = parse_iso8601(query.get("granularity", {}).get("origin")) or 0
+        buckets = OrderedDict()
+        for row in rows:
+            start = origin + math.floor((parse_iso8601(row["timestamp"]) - origin)/seconds)*seconds
+            bucket = buckets.setdefault(start, {aggregation["name"]: 0 for aggregation in self.additive})
+            for aggregation in self.additive:
+                bucket[aggregation["name"]] += row["result"].get(aggregation["name"]) or 0
+        non_additive = {
+            parse_iso8601(row["timestamp"]): row["result"] for row in (non_additive_rows or [])
+        }
+        resampled = []
+        for start, result in buckets.items():
+            for aggregation in self.non_additive:
+                result[aggregation["name"]] = non_additive.get(start, {}).get(aggregation["name"], 0)
+            resampled.append({"timestamp": to_iso8601(start), "result": result})
+        return self.add_post_aggregations(resampled, granularity)
+
+    def add_post_aggregations(self, rows, granularity):
+        """
+        Compute the post aggregations of a timeseries.
+
+        Args:
+            rows (list): druid timeseries response without post aggregations.
+            granularity (str): granularity of the timeseries.
+
+        Returns:
+            (list): the same rows with the post aggregations added to their result.
+        """
+        post_aggregations = self.query_builder.post_aggregations_for(granularity)
+        for row in rows:
+            for post_aggregation in post_aggregations:
+                row["result"][post_aggregation["name"]] = evaluate(post_aggregation, row["result"])
+        return rows
+
+def evaluate(post_aggregation, result):
+    """
+    Evaluate a druid post aggregation over the aggregations of a row.
+
+    Args:
+        post_aggregation (dict): druid post aggregation.
+        result (dict): aggregated values of the row.
+
+    Returns:
+        (float): value of the post aggregation. Division by zero is 0, as in druid.
+    """
+    kind = post_aggregation.get("type")
+    if kind == "constant":
+        return float(post_aggregation["value"])
+    if kind in ("fieldAccess", "finalizingFieldAccess", "hyperUniqueCardinality"):
+        return float(result.get(post_aggregation["fieldName"]) or 0)
+    if kind != "arithmetic":
+        raise ValueError(f"Unsupported post aggregation type {kind}")
+    values = [evaluate(field, result) for field in post_aggregation["fields"]]
+    value = values[0]
+    for operand in values[1:]:
+        if post_aggregation["fn"] == "+":
+            value += operand
+        elif post_aggregation["fn"] == "-":
+            value -= operand
+        elif post_aggregation["fn"] == "*":
+            value *= operand
+        elif post_aggregation["fn"] == "/":
+            value = value/operand if operand else 0.0
+        elif post_aggregation["fn"] == "quotient":
+            value = value/operand
+        else:
+            raise ValueError(f"Unsupported arithmetic function {post_aggregation['fn']}")
+    return value
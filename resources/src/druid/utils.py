@@ -0,0 +1,69 @@
+# Copyright (C) 2024 Eneo Tecnologia S.L.
+#
+# Authors:
+# Miguel Álvarez Adsuara <malvarez@redborder.com>
+# Pablo Rodriguez Flores <prodriguez@redborder.com>
+#
+# This program is free software: you can redistribute it and/or modify it under the terms of the
+# GNU Affero General Public License as published by the Free Software Foundation, either version 3
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without
+# even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with this program.
+# If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Helpers shared by the druid client, the training job and the API server to identify
+queries and to read and write the timestamps of druid intervals.
+"""
+import json
+import hashlib
+from datetime import datetime, timezone
+
+def fingerprint(*parts):
+    """
+    Compute a stable hash of a set of json serializable objects.
+
+    Args:
+        parts: objects to include in the fingerprint.
+
+    Returns:
+        (str): hex digest identifying the objects.
+    """
+    serialized = json.dumps(parts, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(serialized.encode('utf-8')).hexdigest()
+
+def parse_iso8601(value):
+    """
+    Parse an ISO 8601 timestamp as the ones used in druid intervals.
+
+    Args:
+        value (str): timestamp such as '2023-01-01T00:00:00.000Z'.
+
+    Returns:
+        (float or None): epoch seconds or None if it could not be parsed.
+    """
+    if not isinstance(value, str) or not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+def to_iso8601(epoch):
+    """
+    Format epoch seconds as a druid compatible ISO 8601 timestamp.
+
+    Args:
+        epoch (float): epoch seconds.
+
+    Returns:
+        (str): timestamp with the format '2023-01-01T00:00:00.000Z'.
+    """
+    return datetime.fromtimestamp(epoch, tz=timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.000Z')
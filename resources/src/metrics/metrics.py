@@ -0,0 +1,139 @@
+# Copyright (C) 2024 Eneo Tecnologia S.L.
+#
+# Authors:
+# Miguel Álvarez Adsuara <malvarez@redborder.com>
+# Pablo Rodriguez Flores <prodriguez@redborder.com>
+#
+# This program is free software: you can redistribute it and/or modify it under the terms of the
+# GNU Affero General Public License as published by the Free Software Foundation, either version 3
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without
+# even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with this program.
+# If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Prometheus instrumentation of the service.
+
+When the PROMETHEUS_MULTIPROC_DIR environment variable is set before this module is
+imported, every gunicorn worker writes its samples to that directory and the exposition
+aggregates all of them, so /metrics reports the same values whichever worker serves it.
+"""
+import os
+import time
+from contextlib import contextmanager
+from prometheus_client import (
+    REGISTRY, CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess
+)
+
+STAGE_LATENCY = Histogram(
+    "rb_aioutliers_stage_seconds",
+    "Time spent in each stage of a request",
+    ["model", "stage"],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+)
+ERRORS = Counter(
+    "rb_aioutliers_errors",
+    "Errors by the stage where they happened",
+    ["stage"]
+)
+CACHE_REQUESTS = Counter(
+    "rb_aioutliers_cache_requests",
+    "Response cache lookups by result (hit, stale or miss)",
+    ["result"]
+)
+COALESCED_CALLS = Counter(
+    "rb_aioutliers_coalesced_calls",
+    "Calls that shared the result of an identical call in progress",
+    ["kind"]
+)
+MODEL_LOADS = Counter(
+    "rb_aioutliers_model_loads",
+    "Deep learning models loaded into memory",
+    ["model"]
+)
+S3_SYNC_BYTES = Counter(
+    "rb_aioutliers_s3_sync_bytes",
+    "Bytes downloaded from S3 by the model sync"
+)
+DRUID_QUERY_LATENCY = Histogram(
+    "rb_aioutliers_druid_query_seconds",
+    "Time spent in each druid query, retries included, by outcome",
+    ["outcome"],
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+)
+DRUID_RESPONSE_BYTES = Counter(
+    "rb_aioutliers_druid_response_bytes",
+    "Decoded bytes of the druid query responses"
+)
+ADMISSION_QUEUE_DEPTH = Gauge(
+    "rb_aioutliers_admission_queue_depth",
+    "Requests waiting for a slot of a route or model",
+    ["limiter"],
+    multiprocess_mode="livesum"
+)
+ADMISSION_IN_FLIGHT = Gauge(
+    "rb_aioutliers_admission_in_flight",
+    "Requests holding a slot of a route or model",
+    ["limiter"],
+    multiprocess_mode="livesum"
+)
+ADMISSION_REJECTED = Counter(
+    "rb_aioutliers_admission_rejected",
+    "Requests rejected with 429 by the admission control",
+    ["limiter"]
+)
+
+@contextmanager
+def timer(stage, model="default"):
+    """
+    Measure the time spent in a block and count it as an error if it raises.
+
+    Args:
+        stage (str): name of the stage being measured.
+        model (str): name of the model the stage runs for.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        ERRORS.labels(stage).inc()
+        raise
+    finally:
+        STAGE_LATENCY.labels(model, stage).observe(time.perf_counter() - start)
+
+def is_multiprocess():
+    """
+    Check whether the metrics are shared between processes.
+
+    Returns:
+        bool: True if the multiprocess directory is configured.
+    """
+    return "PROMETHEUS_MULTIPROC_DIR" in os.environ
+
+def export():
+    """
+    Render the metrics in the Prometheus text format.
+
+    Returns:
+        tuple: body and content type of the exposition.
+    """
+    registry = REGISTRY
+    if is_multiprocess():
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+def mark_process_dead(pid):
+    """
+    Discard the live samples of a process that exited. Counters and histograms of the
+    process are kept so totals do not decrease when gunicorn recycles a worker.
+
+    Args:
+        pid (int): id of the process.
+    """
+    if is_multiprocess():
+        multiprocess.mark_process_dead(pid)
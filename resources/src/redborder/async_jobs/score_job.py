@@ -0,0 +1,73 @@
+# Copyright (C) 2024 Eneo Tecnologia S.L.
+#
+# Authors:
+# Miguel Álvarez Adsuara <malvarez@redborder.com>
+# Pablo Rodriguez Flores <prodriguez@redborder.com>
+#
+# This program is free software: you can redistribute it and/or modify it under the terms of the
+# GNU Affero General Public License as published by the Free Software Foundation, either version 3
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without
+# even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with this program.
+# If not, see <https://www.gnu.org/licenses/>.
+
+
+from resources.src.logger.logger import logger
+from resources.src.server.rest import ModelRunner
+
+class RbOutlierScoreJob:
+    """
+    Scoring jobs run by the scoring workers, for requests too long to be answered within an
+    HTTP request. The models and the druid client are set up once per worker process and
+    reused by the following jobs. The rest of the API server is not started.
+    """
+    server = None
+
+    def setup_server(self):
+        """
+        Set up the models and the druid access that run the jobs.
+
+        Returns:
+            ModelRunner: the runner shared by the jobs of this process.
+        """
+        if RbOutlierScoreJob.server is None:
+            RbOutlierScoreJob.server = ModelRunner()
+        return RbOutlierScoreJob.server
+
+    def score_outliers(self, druid_query=None, data=None, model='default', metric='bytes'):
+        """
+        Detect the outliers of a druid query or of the given data.
+
+        Args:
+            druid_query (dict): druid query for the data that we want to analyze.
+            data (dict): data to analyze, used instead of the druid query.
+            model (str): the name of the model we want to use.
+            metric (str): the name of field being analyzed.
+
+        Returns:
+            dict: the model's predictions and the outliers detected, or an error.
+        """
+        server = self.setup_server()
+        logger.info(f"Running scoring job with model {model}")
+        if data is None:
+            data = server.get_data_from_druid(druid_query, model)
+        return server.run_model(data, metric, model)
+
+    def identify_ips(self, outliers, all_ips_data):
+        """
+        Identify the IPs implicated in a set of outliers.
+
+        Args:
+            outliers (list): outliers detected.
+            all_ips_data (dict): traffic of each IP.
+
+        Returns:
+            dict: implicated IPs.
+        """
+        server = self.setup_server()
+        logger.info("Running ip identifier job")
+        return server.identifier.train_and_execute_model(outliers, all_ips_data)
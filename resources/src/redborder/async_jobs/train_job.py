@@ -16,17 +16,24 @@
 # If not, see <https://www.gnu.org/licenses/>.
 
 
-import sys, os, json
+import sys, os, json, time, math
+from datetime import timedelta
+from concurrent.futures import ThreadPoolExecutor, wait
 
 from resources.src.rbntp.ntplib import NTPClient
 from resources.src.ai.trainer import Trainer
 from resources.src.logger.logger import logger
 from resources.src.druid.client import DruidClient
-from resources.src.server.rest import config
+from resources.src.server.rest import config, druid_client_options
 from resources.src.druid.query_builder import QueryBuilder
+from resources.src.druid.resampler import Resampler
+from resources.src.redborder.training_cache import TrainingDataCache
 from resources.src.redborder.s3 import S3
+from resources.src.metrics import metrics
 
 class RbOutlierTrainJob:
+    granularities = ["pt1m", "pt2m", "pt5m", "pt15m", "pt30m", "pt1h", "pt2h", "pt8h"]
+
     def __init__(self) -> None:
         """
         Initialize the Outliers application.
@@ -36,6 +43,7 @@ class RbOutlierTrainJob:
         self.models= None
         self.query_builder = None
         self.s3_client = None
+        self.training_cache = None
         self.main_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..")
 
     def setup_s3(self):
@@ -122,24 +130,37 @@ class RbOutlierTrainJob:
         self.setup_s3()
         logger.info("Starting Outliers Train Job")
         redborder_ntp = self.initialize_ntp_client()
+        self.query_builder = QueryBuilder(self.get_aggregation_config_path(), self.get_post_aggregations_config_path())
         druid_client = self.initialize_druid_client()
 
         manager_time = redborder_ntp.get_ntp_time()
 
         traffic_query = self.load_traffic_query()
 
-        self.query_builder = QueryBuilder(self.get_aggregation_config_path(), self.get_post_aggregations_config_path())
         query = self.query_builder.modify_aggregations(traffic_query)
+        self.training_cache = self.initialize_training_cache()
 
         self.model_names = model_names.join(model_names.split()).split(',')
         self.setup_remote_model_sync()
 
+        grouped_data = {}
+        if len(self.model_names) > 1 and config.get("TrainingData", "grouped_queries", fallback="true").lower() == "true":
+            try:
+                grouped_data = self.fetch_grouped_traffic_data(
+                    self.model_names, self.training_query(query, redborder_ntp, manager_time), druid_client, self.granularities
+                )
+            except Exception as e:
+                logger.error(f"Grouped training queries failed, fetching the data of each model separately: {e}")
+
         for model_name in self.model_names:
             self.trainer = Trainer(
                 os.path.join(self.main_dir, "ai", f"{model_name}.keras"),
                 os.path.join(self.main_dir, "ai", f"{model_name}.ini"),
+                config.get("Outliers", "shuffle_buffer", fallback="10000")
+            )
+            self.process_model_data(
+                model_name, query, redborder_ntp, manager_time, druid_client, grouped_data.get(model_name)
             )
-            self.process_model_data(model_name, query, redborder_ntp, manager_time, druid_client)
 
     def initialize_ntp_client(self):
         """
@@ -152,12 +173,28 @@ class RbOutlierTrainJob:
 
     def initialize_druid_client(self):
         """
-        Initialize the Druid client.
+        Initialize the Druid client. Long queries are split with the query builder of
+        the job.
 
         Returns:
             DruidClient: The initialized Druid client.
         """
-        return DruidClient(config.get("Druid", "druid_endpoint"))
+        return DruidClient(query_builder=self.query_builder, **druid_client_options())
+
+    def initialize_training_cache(self):
+        """
+        Initialize the local cache of training data.
+
+        Returns:
+            TrainingDataCache: The initialized cache, or None if it is disabled.
+        """
+        if config.get("TrainingData", "cache_enabled", fallback="true").lower() != "true":
+            return None
+        return TrainingDataCache(
+            config.get("TrainingData", "cache_dir", fallback="./training_cache/"),
+            config.get("TrainingData", "retention_days", fallback="7"),
+            self.query_builder.granularity_to_seconds
+        )
 
     def load_traffic_query(self):
         """
@@ -223,7 +260,30 @@ class RbOutlierTrainJob:
             self.upload_model_results_back_to_s3(model_name)
             self.upload_model_config_results_back_to_s3(model_name)
 
-    def process_model_data(self, model_name, query, redborder_ntp, manager_time, druid_client):
+    def training_query(self, query, redborder_ntp, manager_time):
+        """
+        Set the interval and granularity origin of the training data in a query.
+
+        Args:
+            query (dict): The query to be modified.
+            redborder_ntp (NTPClient): The NTP client.
+            manager_time (datetime): The manager time.
+
+        Returns:
+            dict: The query for the training window.
+        """
+        history = timedelta(days=float(config.get("TrainingData", "history_days", fallback="1")))
+        origin = start_time = redborder_ntp.time_to_iso8601_time(manager_time - history)
+        if self.training_cache is not None:
+            # Cached buckets are only reusable if the bucket grid does not move between runs
+            manager_time = manager_time.replace(second=0, microsecond=0)
+            start_time = redborder_ntp.time_to_iso8601_time(manager_time - history)
+            origin = redborder_ntp.time_to_iso8601_time(manager_time.replace(hour=0, minute=0))
+        end_time = redborder_ntp.time_to_iso8601_time(manager_time)
+        query = self.query_builder.set_time_origin(query, origin)
+        return self.query_builder.set_time_interval(query, start_time, end_time)
+
+    def process_model_data(self, model_name, query, redborder_ntp, manager_time, druid_client, traffic_data=None):
         """
         Process data and train the model.
 
@@ -233,24 +293,210 @@ class RbOutlierTrainJob:
             redborder_ntp (NTPClient): The NTP client.
             manager_time (datetime): The manager time.
             druid_client (DruidClient): The Druid client.
+            traffic_data (list, optional): Training data already fetched for the model.
 
         This function processes data, modifies the query, and trains the model.
         """
-        rb_granularities=["pt1m", "pt2m", "pt5m", "pt15m", "pt30m", "pt1h", "pt2h", "pt8h"]
-        start_time = redborder_ntp.time_to_iso8601_time(redborder_ntp.get_substracted_day_time(manager_time))
-        end_time = redborder_ntp.time_to_iso8601_time(manager_time)
-        model_filter = self.get_model_filter(model_name)
-        query = self.query_builder.modify_filter(query, model_filter)
-        query = self.query_builder.set_time_origin(query, start_time)
-        query = self.query_builder.set_time_interval(query, start_time, end_time)
-        traffic_data=[]
-        for gran in rb_granularities:
-            temp_query = self.query_builder.modify_granularity(query,gran)
-            traffic_data.append(druid_client.execute_query(temp_query))
+        if traffic_data is None:
+            model_filter = self.get_model_filter(model_name)
+            query = self.query_builder.modify_filter(query, model_filter)
+            query = self.training_query(query, redborder_ntp, manager_time)
+            traffic_data = self.fetch_traffic_data(model_name, query, druid_client, self.granularities)
+        if not traffic_data:
+            logger.error(f"No training data could be fetched for model {model_name}, skipping it")
+            return
         self.trainer.train(
             traffic_data,
             int(config.get("Outliers", "epochs")),
             int(config.get("Outliers", "batch_size")),
             config.get("Outliers", "backup_path")
         )
-        self.upload_results_back_to_s3()
\ No newline at end of file
+        self.upload_results_back_to_s3()
+
+    def fetch_traffic_data(self, model_name, query, druid_client, granularities):
+        """
+        Get the training data of a model at every granularity.
+
+        By default druid is queried once at the first, finest, granularity and the rest
+        are rolled up locally, so only the aggregations that can not be summed are queried
+        again for each granularity. A granularity whose data could not be fetched is
+        dropped from the training data.
+
+        Args:
+            model_name (str): Model identifier.
+            query (dict): The query with the filter and interval of the model.
+            druid_client (DruidClient): The Druid client.
+            granularities (list): Granularities to fetch, from finest to coarsest.
+
+        Returns:
+            list: Druid responses of the granularities fetched, in the given order.
+        """
+        start = time.time()
+        if config.get("TrainingData", "local_resampling", fallback="true").lower() != "true":
+            queries = {
+                gran: self.query_builder.modify_aggregations(self.query_builder.modify_granularity(query, gran))
+                for gran in granularities
+            }
+            results = self.execute_queries(model_name, queries, druid_client)
+            traffic_data = [results[gran] for gran in granularities if gran in results]
+        else:
+            traffic_data = self.fetch_resampled_traffic_data(model_name, query, druid_client, granularities)
+        duration = time.time() - start
+        metrics.STAGE_LATENCY.labels(model_name, "training_fetch").observe(duration)
+        logger.info(
+            f"Fetched {len(traffic_data)} of {len(granularities)} granularities for model {model_name} "
+            f"in {duration:.2f}s"
+        )
+        return traffic_data
+
+    def fetch_resampled_traffic_data(self, model_name, query, druid_client, granularities):
+        """
+        Fetch the finest granularity of the training data and derive the others from it.
+
+        Args:
+            model_name (str): Model identifier.
+            query (dict): The query with the filter and interval of the model.
+            druid_client (DruidClient): The Druid client.
+            granularities (list): Granularities to fetch, from finest to coarsest.
+
+        Returns:
+            list: Timeseries of the granularities obtained, in the given order.
+        """
+        resampler = Resampler(self.query_builder)
+        results = self.execute_queries(model_name, self.resampled_queries(resampler, query, granularities), druid_client)
+        return self.resampled_traffic_data(resampler, results, query, granularities)
+
+    def resampled_queries(self, resampler, query, granularities):
+        """
+        Build the queries needed to derive every granularity from the finest one.
+
+        Args:
+            resampler (Resampler): The resampler of the training data.
+            query (dict): The query with the filter and interval.
+            granularities (list): Granularities to fetch, from finest to coarsest.
+
+        Returns:
+            dict: Druid queries by granularity.
+        """
+        queries = {granularities[0]: resampler.base_query(query, granularities[0])}
+        for gran in granularities[1:]:
+            non_additive_query = resampler.non_additive_query(query, gran)
+            if non_additive_query is not None:
+                queries[gran] = non_additive_query
+        return queries
+
+    def resampled_traffic_data(self, resampler, results, query, granularities):
+        """
+        Roll up the finest granularity to the others.
+
+        Args:
+            resampler (Resampler): The resampler of the training data.
+            results (dict): Druid responses of the queries from resampled_queries.
+            query (dict): The query with the granularity origin.
+            granularities (list): Granularities to fetch, from finest to coarsest.
+
+        Returns:
+            list: Timeseries of the granularities obtained, in the given order.
+        """
+        base = granularities[0]
+        if base not in results:
+            return []
+        traffic_data = []
+        for gran in granularities[1:]:
+            if resampler.non_additive and gran not in results:
+                continue
+            traffic_data.append(resampler.resample(results[base], query, gran, results.get(gran)))
+        return [resampler.add_post_aggregations(results[base], base)] + traffic_data
+
+    def fetch_grouped_traffic_data(self, model_names, query, druid_client, granularities):
+        """
+        Get the training data of several models with the queries of a single model. The
+        aggregations of every model are computed in the same queries with filtered
+        aggregators and the responses are split locally.
+
+        Args:
+            model_names (list): Model identifiers.
+            query (dict): The query with the interval of the training data.
+            druid_client (DruidClient): The Druid client.
+            granularities (list): Granularities to fetch, from finest to coarsest.
+
+        Returns:
+            dict: Training data of each model, in the order of the granularities. Models
+            whose data could not be fetched this way are left out, so they are fetched with
+            their own queries.
+        """
+        start = time.time()
+        filters = {model_name: self.get_model_filter(model_name) for model_name in model_names}
+        resampler = Resampler(self.query_builder)
+        local_resampling = config.get("TrainingData", "local_resampling", fallback="true").lower() == "true"
+        if local_resampling:
+            queries = self.resampled_queries(resampler, query, granularities)
+        else:
+            queries = {gran: resampler.base_query(query, gran) for gran in granularities}
+        queries = {gran: self.query_builder.group_by_filters(gran_query, filters) for gran, gran_query in queries.items()}
+        results = self.execute_queries("grouped", queries, druid_client)
+        if len(results) < len(queries):
+            logger.error("Some grouped training queries failed, fetching the data of each model separately")
+            return {}
+        skip_empty = str(query.get("context", {}).get("skipEmptyBuckets", "false")).lower() == "true"
+        split = {
+            gran: self.query_builder.split_grouped_response(rows, model_names, skip_empty) for gran, rows in results.items()
+        }
+        grouped_data = {}
+        for model_name in model_names:
+            model_results = {gran: models[model_name] for gran, models in split.items()}
+            if not all(model_results.values()):
+                logger.info(f"Grouped training queries returned no data for model {model_name}, fetching it separately")
+                continue
+            if local_resampling:
+                grouped_data[model_name] = self.resampled_traffic_data(resampler, model_results, query, granularities)
+            else:
+                grouped_data[model_name] = [
+                    resampler.add_post_aggregations(model_results[gran], gran)
+                    for gran in granularities if gran in model_results
+                ]
+        duration = time.time() - start
+        metrics.STAGE_LATENCY.labels("grouped", "training_fetch").observe(duration)
+        logger.info(f"Fetched the training data of {len(model_names)} models with {len(queries)} queries in {duration:.2f}s")
+        return grouped_data
+
+    def execute_queries(self, model_name, queries, druid_client):
+        """
+        Execute druid queries concurrently.
+
+        Each query is limited by the druid query timeout, and all of them by the time they
+        would take if every round of the pool hit that timeout. A query that fails or does
+        not finish in time is left out of the results.
+
+        Args:
+            model_name (str): Model identifier.
+            queries (dict): Druid queries by granularity.
+            druid_client (DruidClient): The Druid client.
+
+        Returns:
+            dict: Druid responses of the queries that succeeded, by granularity.
+        """
+        parallelism = max(1, min(int(config.get("TrainingData", "fetch_parallelism", fallback="4")), len(queries)))
+        query_timeout = float(config.get("TrainingData", "query_timeout", fallback="120"))
+        executor = ThreadPoolExecutor(max_workers=parallelism)
+        futures = {}
+        for gran, temp_query in queries.items():
+            temp_query["context"] = dict(temp_query.get("context", {}), timeout=int(query_timeout*1000))
+            if self.training_cache is not None:
+                futures[executor.submit(
+                    self.training_cache.fetch, model_name, temp_query, druid_client.execute_query
+                )] = gran
+            else:
+                futures[executor.submit(druid_client.execute_query, temp_query)] = gran
+        done, _ = wait(futures, timeout=query_timeout*math.ceil(len(queries)/parallelism))
+        executor.shutdown(wait=False, cancel_futures=True)
+        results = {}
+        for future, gran in futures.items():
+            if future not in done:
+                logger.error(f"Druid query for model {model_name} at {gran} timed out, dropping it")
+                continue
+            try:
+                results[gran] = future.result()
+            except Exception as e:
+                logger.error(f"Druid query for model {model_name} at {gran} failed, dropping it: {e}")
+        return results
@@ -0,0 +1,188 @@
+# Copyright (C) 2024 Eneo Tecnologia S.L.
+#
+# Authors:
+# Miguel Álvarez Adsuara <malvarez@redborder.com>
+# Pablo Rodriguez Flores <prodriguez@redborder.com>
+#
+# This program is free software: you can redistribute it and/or modify it under the terms of the
+# GNU Affero General Public License as published by the Free Software Foundation, either version 3
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without
+# even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with this program.
+# If not, see <https://www.gnu.org/licenses/>.
+
+
+import os
+import json
+import time
+import fcntl
+import tempfile
+
+from resources.src.logger import logger
+from resources.src.metrics import metrics
+
+class ModelSync:
+    """
+    Keep a local directory in sync with a folder of the S3 bucket.
+
+    Only one process per node performs the sync: the one holding an exclusive lock on a
+    file of the local directory. Objects whose ETag and size did not change since the last
+    sync are skipped, and new objects are downloaded to a temporary file and renamed over
+    the old one, so readers never see a partially written model.
+
+    Args:
+        s3_client (S3): client of the bucket.
+        prefix (str): folder of the bucket to sync.
+        local_dir (str): local directory where the objects are stored.
+    """
+    def __init__(self, s3_client, prefix, local_dir):
+        self.s3_client = s3_client
+        self.prefix = prefix
+        self.local_dir = local_dir
+        self.lock_path = os.path.join(local_dir, ".s3_sync.lock")
+        self.manifest_path = os.path.join(local_dir, ".s3_sync.json")
+        self.lock_file = None
+        self.last_sync = {}
+
+    def acquire_leadership(self):
+        """
+        Try to become the process that syncs this node. Once acquired, the lock is kept
+        until the process exits.
+
+        Returns:
+            bool: True if this process is the leader.
+        """
+        if self.lock_file is not None:
+            return True
+        lock_file = open(self.lock_path, 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self.lock_file = lock_file
+        logger.logger.info(f"Process {os.getpid()} is now in charge of the S3 sync")
+        return True
+
+    def load_manifest(self):
+        """
+        Load the ETag and size of the objects downloaded in previous syncs.
+
+        Returns:
+            dict: metadata of each downloaded object by key.
+        """
+        try:
+            with open(self.manifest_path, 'r') as manifest_file:
+                return json.load(manifest_file)
+        except (OSError, ValueError):
+            return {}
+
+    def save_manifest(self, manifest):
+        """
+        Atomically save the metadata of the downloaded objects.
+
+        Args:
+            manifest (dict): metadata of each downloaded object by key.
+        """
+        fd, temp_path = tempfile.mkstemp(dir=self.local_dir, prefix=".s3_sync.")
+        with os.fdopen(fd, 'w') as manifest_file:
+            json.dump(manifest, manifest_file)
+        self.replace(temp_path, self.manifest_path)
+
+    def replace(self, temp_path, path):
+        """
+        Rename a temporary file over its final path. mkstemp creates files readable only
+        by their owner, so the file gets the mode of the one it replaces, or 0644 for a
+        new file, before it becomes visible to the processes that load the models.
+
+        Args:
+            temp_path (str): path of the temporary file.
+            path (str): final path of the file.
+        """
+        try:
+            mode = os.stat(path).st_mode & 0o777
+        except FileNotFoundError:
+            mode = 0o644
+        os.chmod(temp_path, mode)
+        os.replace(temp_path, path)
+
+    def is_up_to_date(self, obj, manifest):
+        """
+        Check whether the local copy of an object matches the remote one.
+
+        Args:
+            obj (dict): key, etag and size of the remote object.
+            manifest (dict): metadata of each downloaded object by key.
+
+        Returns:
+            bool: True if the object does not need to be downloaded.
+        """
+        local_path = os.path.join(self.local_dir, obj["key"].split("/")[-1])
+        known = manifest.get(obj["key"])
+        return (
+            known is not None and known.get("etag") == obj["etag"] and known.get("size") == obj["size"]
+            and os.path.isfile(local_path) and os.path.getsize(local_path) == obj["size"]
+        )
+
+    def download(self, obj):
+        """
+        Download an object to a temporary file and rename it to its final path.
+
+        Args:
+            obj (dict): key, etag and size of the remote object.
+
+        Returns:
+            bool: True if the object was downloaded.
+        """
+        file_name = obj["key"].split("/")[-1]
+        fd, temp_path = tempfile.mkstemp(dir=self.local_dir, prefix=f".{file_name}.")
+        os.close(fd)
+        try:
+            if not self.s3_client.download_file(obj["key"], temp_path):
+                return False
+            self.replace(temp_path, os.path.join(self.local_dir, file_name))
+            return True
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def sync(self):
+        """
+        Download the objects that changed since the last sync, if this process is the
+        leader of the node.
+
+        Returns:
+            dict: number of objects listed, downloaded and skipped, bytes transferred and
+              duration of the sync, or None if another process is in charge of the sync.
+        """
+        if not self.acquire_leadership():
+            return None
+        start = time.time()
+        manifest = self.load_manifest()
+        stats = {"objects": 0, "downloaded": 0, "skipped": 0, "bytes": 0}
+        for obj in self.s3_client.list_objects_with_metadata_in_folder(self.prefix):
+            if obj["key"].endswith("/"):
+                continue
+            stats["objects"] += 1
+            if self.is_up_to_date(obj, manifest):
+                stats["skipped"] += 1
+                continue
+            if self.download(obj):
+                manifest[obj["key"]] = {"etag": obj["etag"], "size": obj["size"]}
+                stats["downloaded"] += 1
+                stats["bytes"] += obj["size"]
+        if stats["downloaded"]:
+            self.save_manifest(manifest)
+        stats["duration"] = time.time() - start
+        self.last_sync = stats
+        metrics.S3_SYNC_BYTES.inc(stats["bytes"])
+        metrics.STAGE_LATENCY.labels("default", "s3_sync").observe(stats["duration"])
+        logger.logger.info(
+            f"S3 sync: {stats['downloaded']} of {stats['objects']} objects downloaded, "
+            f"{stats['bytes']} bytes in {stats['duration']:.2f}s"
+        )
+        return stats
@@ -17,7 +17,9 @@
 
 
 import sys, os, time
-from rq import Queue
+from rq import Queue, SimpleWorker
+from rq.job import Job
+from rq.exceptions import NoSuchJobError
 from redis import Redis
 from datetime import datetime
 from croniter import croniter
@@ -33,7 +35,12 @@ class RqManager:
 
         This class manages the job service across all redborder cluster running this service
         """
-        self.rq_queue = Queue(connection=Redis(host=self.fetch_redis_hostname(), port=self.fetch_redis_port(), password=self.fetch_redis_secret()))
+        self.redis = Redis(host=self.fetch_redis_hostname(), port=self.fetch_redis_port(), password=self.fetch_redis_secret())
+        self.rq_queue = Queue(connection=self.redis)
+        self.scoring_queue = Queue(
+            config.get("ScoringJobs", "queue_name", fallback="scoring"),
+            connection=self.redis
+        )
 
     def fetch_queue_default_job_hour(self):
         """
@@ -118,3 +125,56 @@ class RqManager:
         logger.info("Waiting for re-queue...")
         time.sleep(delay)
         self.schedule_train_job()
+
+    def enqueue_scoring_job(self, function, **kwargs):
+        """
+        Enqueue a scoring job in the scoring queue. The result is kept in Redis for
+        result_ttl seconds after it finishes.
+
+        Args:
+            function (callable): job to run.
+            kwargs: arguments of the job.
+
+        Returns:
+            str: id of the job.
+        """
+        job = self.scoring_queue.enqueue(
+            function,
+            kwargs=kwargs,
+            job_timeout=int(config.get("ScoringJobs", "job_timeout", fallback="1800")),
+            result_ttl=int(config.get("ScoringJobs", "result_ttl", fallback="3600")),
+            failure_ttl=int(config.get("ScoringJobs", "failure_ttl", fallback="3600"))
+        )
+        logger.info(f"Enqueued scoring job {job.id}")
+        return job.id
+
+    def fetch_job_status(self, job_id):
+        """
+        Fetch the status of a scoring job and its result once it finished.
+
+        Args:
+            job_id (str): id of the job.
+
+        Returns:
+            dict: status of the job, with its result if it finished or the error if it failed,
+              or None if the job does not exist or expired.
+        """
+        try:
+            job = Job.fetch(job_id, connection=self.redis)
+        except NoSuchJobError:
+            return None
+        status = job.get_status()
+        response = {"job_id": job_id, "job_status": str(status.value if hasattr(status, "value") else status)}
+        if job.is_finished:
+            response["result"] = job.return_value()
+        elif job.is_failed:
+            response["error"] = (job.exc_info or "").strip().split("\n")[-1]
+        return response
+
+    def run_scoring_worker(self):
+        """
+        Consume the scoring queue until the process is stopped. Jobs run in this process
+        instead of a forked one, so the models loaded by a job are reused by the next ones.
+        """
+        logger.info(f"Starting scoring worker on queue {self.scoring_queue.name}")
+        SimpleWorker([self.scoring_queue], connection=self.redis).work()
@@ -58,8 +58,10 @@ class S3:
         try:
             self.s3_client.download_file(self.bucket_name, s3_key, local_file_path)
             print(f"Downloaded {s3_key} from S3 to {local_file_path}")
+            return True
         except Exception as e:
             print(f"Error downloading file from S3: {str(e)}")
+            return False
 
     """
     List all objects in the S3 bucket.
@@ -89,6 +91,24 @@ class S3:
         except Exception as e:
             print(f"Error listing objects in S3 folder '{folder_prefix}': {str(e)}")
             return []
+
+    def list_objects_with_metadata_in_folder(self, folder_prefix):
+        """
+        List all objects in the S3 bucket in a specific prefix together with their ETag
+        and size, so callers can tell whether an object changed without downloading it.
+
+        Returns:
+            list: dictionaries with the 'key', 'etag' and 'size' of each object.
+        """
+        try:
+            response = self.s3_client.list_objects(Bucket=self.bucket_name, Prefix=folder_prefix)
+            return [
+                {"key": obj['Key'], "etag": obj.get('ETag', '').strip('"'), "size": obj.get('Size', 0)}
+                for obj in response.get('Contents', [])
+            ]
+        except Exception as e:
+            print(f"Error listing objects in S3 folder '{folder_prefix}': {str(e)}")
+            return []
     """
     Delete an object from the S3 bucket.
 
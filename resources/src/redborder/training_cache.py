@@ -0,0 +1,196 @@
+# Copyright (C) 2024 Eneo Tecnologia S.L.
+#
+# Authors:
+# Miguel Álvarez Adsuara <malvarez@redborder.com>
+# Pablo Rodriguez Flores <prodriguez@redborder.com>
+#
+# This program is free software: you can redistribute it and/or modify it under the terms of the
+# GNU Affero General Public License as published by the Free Software Foundation, either version 3
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without
+# even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with this program.
+# If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Local cache of the druid timeseries used to train the models, so each training run
+only queries the buckets that were not fetched by the previous ones.
+"""
+import os
+import math
+import tempfile
+import numpy as np
+
+from resources.src.druid.utils import fingerprint, parse_iso8601, to_iso8601
+
+class TrainingDataCache:
+    """
+    Columnar cache of druid timeseries responses, stored as one npz file per model, query
+    and granularity.
+
+    The buckets before the last cached one are assumed final, so a query only asks druid
+    for the interval starting at the last cached bucket, which could have been partial.
+    Buckets older than the retention are evicted when the file is rewritten. The cache is
+    only useful when the bucket grid does not move between runs, so the queries should
+    use a fixed granularity origin.
+
+    Args:
+        cache_dir (str): directory where the files are stored.
+        retention_days (float): days of data kept for each query.
+        granularity_to_seconds (callable): seconds of a druid granularity.
+    """
+    def __init__(self, cache_dir, retention_days, granularity_to_seconds):
+        self.cache_dir = cache_dir
+        self.retention = float(retention_days)*86400
+        self.granularity_to_seconds = granularity_to_seconds
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def path(self, model_name, query):
+        """
+        Get the file of a query. Queries that only differ in their interval, origin or
+        context share the file.
+
+        Args:
+            model_name (str): model identifier.
+            query (dict): druid query.
+
+        Returns:
+            (str): path to the npz file.
+        """
+        key_query = {key: value for key, value in query.items() if key not in ("intervals", "context")}
+        key_query["granularity"] = {
+            key: value for key, value in query.get("granularity", {}).items() if key != "origin"
+        }
+        period = key_query["granularity"].get("period", "")
+        return os.path.join(self.cache_dir, f"{model_name}_{period}_{fingerprint(key_query)[:16]}.npz")
+
+    def load(self, path):
+        """
+        Load the cached timeseries of a query.
+
+        Args:
+            path (str): path to the npz file.
+
+        Returns:
+            (tuple): covered interval and origin, epoch timestamps and dict with the values
+              of each field, or None if there is no usable cache.
+        """
+        try:
+            with np.load(path) as cached:
+                return cached["coverage"], cached["timestamp"], {
+                    name[len("result."):]: cached[name] for name in cached.files if name.startswith("result.")
+                }
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def save(self, path, coverage, timestamps, columns):
+        """
+        Atomically save the timeseries of a query.
+
+        Args:
+            path (str): path to the npz file.
+            coverage (tuple): start and end of the interval fetched and origin of the buckets.
+            timestamps (numpy.ndarray): epoch timestamps of the buckets.
+            columns (dict): values of each field.
+        """
+        fd, temp_path = tempfile.mkstemp(dir=self.cache_dir, prefix=".training_cache.")
+        try:
+            with os.fdopen(fd, 'wb') as cache_file:
+                np.savez(
+                    cache_file, coverage=np.array(coverage, dtype=np.float64), timestamp=timestamps,
+                    **{f"result.{name}": values for name, values in columns.items()}
+                )
+            os.replace(temp_path, path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    @staticmethod
+    def to_columns(rows):
+        """
+        Transform a druid timeseries response into columns.
+
+        Args:
+            rows (list): druid timeseries response.
+
+        Returns:
+            (tuple): epoch timestamps and dict with the values of each field.
+        """
+        names = sorted({name for row in rows for name in row["result"]})
+        timestamps = np.array([parse_iso8601(row["timestamp"]) for row in rows], dtype=np.float64)
+        columns = {
+            name: np.array([row["result"].get(name, np.nan) for row in rows], dtype=np.float64) for name in names
+        }
+        return timestamps, columns
+
+    @staticmethod
+    def to_rows(timestamps, columns):
+        """
+        Transform columns back into a druid timeseries response.
+
+        Args:
+            timestamps (numpy.ndarray): epoch timestamps of the buckets.
+            columns (dict): values of each field.
+
+        Returns:
+            (list): druid timeseries response.
+        """
+        names = list(columns)
+        values = [columns[name].tolist() for name in names]
+        return [
+            {
+                "timestamp": to_iso8601(timestamp),
+                "result": {name: column[index] for name, column in zip(names, values) if not math.isnan(column[index])}
+            }
+            for index, timestamp in enumerate(timestamps.tolist())
+        ]
+
+    def fetch(self, model_name, query, execute_query):
+        """
+        Get the timeseries of a query, querying druid only for the buckets that are not
+        cached.
+
+        Args:
+            model_name (str): model identifier.
+            query (dict): druid timeseries query with a single interval.
+            execute_query (callable): function that executes a druid query.
+
+        Returns:
+            (list): druid timeseries response for the interval of the query.
+        """
+        start, end = (parse_iso8601(value) for value in query["intervals"][0].split("/"))
+        seconds = self.granularity_to_seconds(query["granularity"]["period"])
+        origin = parse_iso8601(query["granularity"].get("origin")) or 0
+        bucket = lambda epoch: origin + math.floor((epoch - origin)/seconds)*seconds
+        path = self.path(model_name, query)
+        cached = self.load(path)
+        fetch_from, covered_from = start, start
+        if cached is not None and (cached[0][2] - origin) % seconds == 0 and cached[0][0] <= start <= cached[0][1]:
+            covered_from = float(cached[0][0])
+            fetch_from = max(start, bucket(float(cached[0][1])))
+            keep = cached[1] < fetch_from
+            cached = (cached[1][keep], {name: values[keep] for name, values in cached[2].items()})
+        else:
+            cached = None
+        rows = []
+        if fetch_from < end:
+            rows = execute_query(dict(query, intervals=[f"{to_iso8601(fetch_from)}/{to_iso8601(end)}"]))
+        timestamps, columns = self.to_columns(rows)
+        if cached is not None:
+            for name in set(columns) | set(cached[1]):
+                columns[name] = np.concatenate([
+                    cached[1].get(name, np.full(len(cached[0]), np.nan)),
+                    columns.get(name, np.full(len(timestamps), np.nan))
+                ])
+            timestamps = np.concatenate([cached[0], timestamps])
+        retained_from = max(covered_from, bucket(end - max(self.retention, end - start)))
+        retained = timestamps >= retained_from
+        self.save(
+            path, (retained_from, end, origin), timestamps[retained],
+            {name: values[retained] for name, values in columns.items()}
+        )
+        in_interval = timestamps >= bucket(start)
+        return self.to_rows(timestamps[in_interval], {name: values[in_interval] for name, values in columns.items()})
@@ -0,0 +1,235 @@
+# Copyright (C) 2024 Eneo Tecnologia S.L.
+#
+# Authors:
+# Miguel Álvarez Adsuara <malvarez@redborder.com>
+# Pablo Rodriguez Flores <prodriguez@redborder.com>
+#
+# This program is free software: you can redistribute it and/or modify it under the terms of the
+# GNU Affero General Public License as published by the Free Software Foundation, either version 3
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without
+# even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with this program.
+# If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Admission control of the API server. Requests wait in a bounded queue for a free slot of
+their route and model, and are rejected right away when the queue is full or they cannot
+start before their deadline, so an overloaded worker answers 429 instead of piling up
+threads blocked on druid or TensorFlow.
+"""
+import math
+import time
+import threading
+from contextlib import contextmanager
+
+from resources.src.metrics import metrics
+
+class Rejected(Exception):
+    """
+    Raised when a request cannot be admitted.
+
+    Args:
+        limiter (str): name of the limiter that rejected the request.
+        retry_after (int): seconds the client should wait before retrying.
+    """
+    def __init__(self, limiter, retry_after):
+        super().__init__(f"Too many requests for {limiter}")
+        self.limiter = limiter
+        self.retry_after = retry_after
+
+class Limiter:
+    """
+    Bounded number of concurrent executions with a bounded waiting queue.
+
+    Args:
+        name (str): name used in metrics and errors.
+        max_in_flight (int): maximum concurrent executions.
+        max_queue (int): maximum requests waiting for a slot.
+        queue_timeout (float): maximum seconds a request waits for a slot.
+        clock (callable): monotonic clock.
+    """
+    def __init__(self, name, max_in_flight, max_queue, queue_timeout, clock=time.monotonic):
+        self.name = name
+        self.max_in_flight = max(1, int(max_in_flight))
+        self.max_queue = max(0, int(max_queue))
+        self.queue_timeout = float(queue_timeout)
+        self.clock = clock
+        self.condition = threading.Condition()
+        self.in_flight = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.service_time = 0.0
+
+    def retry_after(self):
+        """
+        Estimate when a slot will be free from the average execution time. The caller must
+        hold the condition.
+
+        Returns:
+            (int): seconds to wait before retrying, at least 1.
+        """
+        pending = (self.waiting + 1) / self.max_in_flight
+        return max(1, math.ceil(self.service_time * pending))
+
+    def reject(self):
+        """
+        Count a rejection and raise it. The caller must hold the condition.
+
+        Raises:
+            Rejected: always.
+        """
+        self.rejected += 1
+        metrics.ADMISSION_REJECTED.labels(self.name).inc()
+        raise Rejected(self.name, self.retry_after())
+
+    def acquire(self):
+        """
+        Take a slot, waiting in the queue up to queue_timeout.
+
+        Raises:
+            Rejected: if the queue is full or no slot was freed in time.
+        """
+        deadline = self.clock() + self.queue_timeout
+        with self.condition:
+            if self.in_flight >= self.max_in_flight:
+                if self.waiting >= self.max_queue:
+                    self.reject()
+                self.waiting += 1
+                metrics.ADMISSION_QUEUE_DEPTH.labels(self.name).inc()
+                try:
+                    while self.in_flight >= self.max_in_flight:
+                        remaining = deadline - self.clock()
+                        if remaining <= 0:
+                            self.reject()
+                        self.condition.wait(remaining)
+                finally:
+                    self.waiting -= 1
+                    metrics.ADMISSION_QUEUE_DEPTH.labels(self.name).dec()
+            self.in_flight += 1
+            self.admitted += 1
+            metrics.ADMISSION_IN_FLIGHT.labels(self.name).inc()
+
+    def release(self, elapsed):
+        """
+        Free a slot and wake up the next waiting request.
+
+        Args:
+            elapsed (float): seconds the slot was held.
+        """
+        with self.condition:
+            self.in_flight -= 1
+            self.service_time = elapsed if not self.service_time else 0.8*self.service_time + 0.2*elapsed
+            metrics.ADMISSION_IN_FLIGHT.labels(self.name).dec()
+            self.condition.notify()
+
+    @contextmanager
+    def slot(self):
+        """
+        Hold a slot while the block runs.
+
+        Raises:
+            Rejected: if the request could not be admitted.
+        """
+        self.acquire()
+        start = self.clock()
+        try:
+            yield
+        finally:
+            self.release(self.clock() - start)
+
+    def stats(self):
+        """
+        Get the state of the limiter.
+
+        Returns:
+            (dict): limits, requests in flight and queued, admitted and rejected requests.
+        """
+        with self.condition:
+            return {
+                "max_in_flight": self.max_in_flight,
+                "max_queue": self.max_queue,
+                "in_flight": self.in_flight,
+                "queue_depth": self.waiting,
+                "admitted": self.admitted,
+                "rejected": self.rejected,
+                "avg_service_time": self.service_time
+            }
+
+class AdmissionController:
+    """
+    Limiters of the routes and models of the API server, created on first use.
+
+    Args:
+        route_limits (tuple): max in flight and max queue of each route.
+        model_limits (tuple): max in flight and max queue of each model.
+        queue_timeout (float): maximum seconds a request waits for a slot.
+        enabled (bool): set to False to admit every request.
+        threads (int): threads serving requests in the worker, 0 if unknown. Requests only
+          queue while holding a thread, and only reach a model while holding a slot of
+          their route, so the queues are shortened to what can actually fill up: a route
+          queue leaves a thread free to find it full and a model queue leaves a route slot
+          free to find it full. Otherwise the queue full rejection could never happen.
+    """
+    def __init__(self, route_limits=(12, 4), model_limits=(4, 6), queue_timeout=2, enabled=True, threads=0):
+        route_in_flight, route_queue = int(route_limits[0]), int(route_limits[1])
+        model_in_flight, model_queue = int(model_limits[0]), int(model_limits[1])
+        if int(threads) > 0:
+            route_queue = min(route_queue, max(0, int(threads) - route_in_flight - 1))
+        model_queue = min(model_queue, max(0, route_in_flight - model_in_flight - 1))
+        self.limits = {"route": (route_in_flight, route_queue), "model": (model_in_flight, model_queue)}
+        self.queue_timeout = float(queue_timeout)
+        self.enabled = enabled
+        self.limiters = {}
+        self.lock = threading.Lock()
+
+    def limiter(self, kind, name):
+        """
+        Get the limiter of a route or model.
+
+        Args:
+            kind (str): 'route' or 'model'.
+            name (str): name of the route or model.
+
+        Returns:
+            (Limiter): the limiter.
+        """
+        key = f"{kind}:{name}"
+        with self.lock:
+            if key not in self.limiters:
+                max_in_flight, max_queue = self.limits[kind]
+                self.limiters[key] = Limiter(key, max_in_flight, max_queue, self.queue_timeout)
+            return self.limiters[key]
+
+    @contextmanager
+    def slot(self, kind, name):
+        """
+        Hold a slot of a route or model while the block runs.
+
+        Args:
+            kind (str): 'route' or 'model'.
+            name (str): name of the route or model.
+
+        Raises:
+            Rejected: if the request could not be admitted.
+        """
+        if not self.enabled:
+            yield
+            return
+        with self.limiter(kind, name).slot():
+            yield
+
+    def stats(self):
+        """
+        Get the state of every limiter.
+
+        Returns:
+            (dict): stats of each limiter by name.
+        """
+        with self.lock:
+            limiters = dict(self.limiters)
+        return {"enabled": self.enabled, "limiters": {key: limiter.stats() for key, limiter in limiters.items()}}
@@ -0,0 +1,378 @@
+# Copyright (C) 2024 Eneo Tecnologia S.L.
+#
+# Authors:
+# Miguel Álvarez Adsuara <malvarez@redborder.com>
+# Pablo Rodriguez Flores <prodriguez@redborder.com>
+#
+# This program is free software: you can redistribute it and/or modify it under the terms of the
+# GNU Affero General Public License as published by the Free Software Foundation, either version 3
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without
+# even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with this program.
+# If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Response cache for the outliers API. Identical requests arriving within the same
+granularity bucket share the result of a single druid query and model execution.
+"""
+import copy
+import json
+import math
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+from resources.src.logger import logger
+from resources.src.druid.utils import fingerprint, parse_iso8601, to_iso8601
+from resources.src.metrics import metrics
+
+class CacheEntry:
+    """
+    Value stored in the response cache together with its lifetime.
+    """
+    def __init__(self, value, size, expires_at, stale_until, series=None, interval_end=None):
+        self.value = value
+        self.size = size
+        self.expires_at = expires_at
+        self.stale_until = stale_until
+        self.series = series
+        self.interval_end = interval_end
+
+class ResponseCache:
+    """
+    Thread safe LRU cache for the responses of '/api/v1/outliers'.
+
+    Druid queries are normalized before hashing: the intervals are aligned to the query
+    granularity and the context is ignored, so two dashboards asking for the same data
+    within the same bucket get the same key. Entries expire at the next bucket boundary
+    and, if stale_ttl is set, are served stale while a background refresh computes the
+    new result.
+
+    Args:
+        granularity_to_seconds (callable): converts a druid granularity to seconds.
+        max_entries (int): maximum number of cached responses.
+        max_bytes (int): maximum approximate size of the cached responses.
+        default_ttl (float): seconds to keep results whose granularity is unknown.
+        stale_ttl (float): seconds an expired entry can still be served while refreshing.
+        enabled (bool): set to False to bypass the cache.
+        clock (callable): function returning the current epoch seconds.
+    """
+    def __init__(self, granularity_to_seconds, max_entries=256, max_bytes=64*1024*1024,
+                 default_ttl=60, stale_ttl=0, enabled=True, clock=time.time):
+        self.granularity_to_seconds = granularity_to_seconds
+        self.max_entries = int(max_entries)
+        self.max_bytes = int(max_bytes)
+        self.default_ttl = float(default_ttl)
+        self.stale_ttl = float(stale_ttl)
+        self.enabled = enabled
+        self.clock = clock
+        self.entries = OrderedDict()
+        self.latest = {}
+        self.refreshing = set()
+        self.lock = threading.Lock()
+        self.size = 0
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def query_granularity(self, druid_query):
+        """
+        Get the bucket size and origin of a druid query.
+
+        Args:
+            druid_query (dict): druid query.
+
+        Returns:
+            (tuple): granularity in seconds and origin in epoch seconds. The granularity is
+              None if it is unknown or not periodic (e.g. 'all').
+        """
+        granularity = druid_query.get("granularity")
+        origin = 0.0
+        if isinstance(granularity, dict):
+            origin = parse_iso8601(granularity.get("origin")) or 0.0
+            if granularity.get("type") == "duration":
+                try:
+                    return float(granularity.get("duration")) / 1000, origin
+                except (TypeError, ValueError):
+                    return None, origin
+            granularity = granularity.get("period")
+        if not isinstance(granularity, str) or granularity.lower() in ("all", "none"):
+            return None, origin
+        try:
+            return float(self.granularity_to_seconds(granularity)), origin
+        except ValueError:
+            return None, origin
+
+    def align(self, epoch, seconds, origin):
+        """
+        Floor a timestamp to the start of its granularity bucket.
+
+        Args:
+            epoch (float): epoch seconds.
+            seconds (float): bucket size.
+            origin (float): epoch seconds where buckets start.
+
+        Returns:
+            (float): start of the bucket containing epoch.
+        """
+        return origin + math.floor((epoch - origin) / seconds) * seconds
+
+    def normalize_query(self, druid_query):
+        """
+        Build the canonical form of a druid query used for hashing.
+
+        Args:
+            druid_query (dict): druid query.
+
+        Returns:
+            (tuple): normalized query, normalized query without interval positions and the
+              aligned end of the last interval (or None).
+        """
+        normalized = copy.deepcopy(druid_query)
+        normalized.pop("context", None)
+        seconds, origin = self.query_granularity(druid_query)
+        intervals = normalized.get("intervals")
+        if not seconds or not isinstance(intervals, list):
+            return normalized, normalized, None
+        aligned, durations, interval_end = [], [], None
+        for interval in intervals:
+            start, _, end = str(interval).partition("/")
+            start, end = parse_iso8601(start), parse_iso8601(end)
+            if start is None or end is None:
+                aligned.append(interval)
+                durations.append(interval)
+                continue
+            start, end = self.align(start, seconds, origin), self.align(end, seconds, origin)
+            aligned.append(f"{to_iso8601(start)}/{to_iso8601(end)}")
+            durations.append(end - start)
+            interval_end = end if interval_end is None else max(interval_end, end)
+        normalized["intervals"] = aligned
+        series = dict(normalized, intervals=durations)
+        return normalized, series, interval_end
+
+    def query_key(self, druid_query, model, metric):
+        """
+        Get the cache key of a druid query request.
+
+        Args:
+            druid_query (dict): decoded druid query.
+            model (str): model name.
+            metric (str): metric being analyzed.
+
+        Returns:
+            (tuple): cache key, series key and aligned interval end. The series key is shared by
+              requests that only differ in the position of their intervals.
+        """
+        normalized, series, interval_end = self.normalize_query(druid_query)
+        return (
+            fingerprint("query", normalized, model, metric),
+            fingerprint("series", series, model, metric),
+            interval_end
+        )
+
+    def payload_key(self, payload, model, metric):
+        """
+        Get the cache key of a request carrying its own data.
+
+        Args:
+            payload (str or bytes): raw data field of the request.
+            model (str): model name.
+            metric (str): metric being analyzed.
+
+        Returns:
+            (tuple): cache key, series key and interval end. Only the first one is set.
+        """
+        if isinstance(payload, str):
+            payload = payload.encode('utf-8')
+        return fingerprint("data", hashlib.sha256(payload).hexdigest(), model, metric), None, None
+
+    def ttl_for_query(self, druid_query):
+        """
+        Seconds until the next bucket boundary of the query granularity, which is when
+        druid may return new data for the query.
+
+        Args:
+            druid_query (dict): druid query.
+
+        Returns:
+            (float): time to live of the response.
+        """
+        seconds, origin = self.query_granularity(druid_query)
+        if not seconds:
+            return self.default_ttl
+        now = self.clock()
+        return self.align(now, seconds, origin) + seconds - now
+
+    def lookup(self, key):
+        """
+        Get a cached value.
+
+        Args:
+            key (tuple): key returned by query_key or payload_key.
+
+        Returns:
+            (tuple): value and its state, 'fresh' or 'stale'. If there is no usable value, the
+              result is (None, None).
+        """
+        cache_key, series, interval_end = key
+        now = self.clock()
+        with self.lock:
+            entry = self.entries.get(cache_key)
+            if entry is None and series is not None and series in self.latest:
+                entry = self.entries.get(self.latest[series])
+                if entry is not None and (interval_end is None or entry.interval_end is None
+                                          or entry.interval_end > interval_end):
+                    entry = None
+                elif entry is not None:
+                    entry = CacheEntry(entry.value, entry.size, now, entry.stale_until)
+            if entry is None:
+                self.misses += 1
+                metrics.CACHE_REQUESTS.labels("miss").inc()
+                return None, None
+            if cache_key in self.entries:
+                self.entries.move_to_end(cache_key)
+            if now < entry.expires_at:
+                self.hits += 1
+                metrics.CACHE_REQUESTS.labels("hit").inc()
+                return entry.value, 'fresh'
+            if now < entry.stale_until:
+                self.stale_hits += 1
+                metrics.CACHE_REQUESTS.labels("stale").inc()
+                return entry.value, 'stale'
+            self.misses += 1
+            metrics.CACHE_REQUESTS.labels("miss").inc()
+            return None, None
+
+    def store(self, key, value, ttl):
+        """
+        Store a value in the cache evicting the least recently used entries if the cache
+        grows over its limits.
+
+        Args:
+            key (tuple): key returned by query_key or payload_key.
+            value (dict): response to store.
+            ttl (float): seconds the value stays fresh.
+        """
+        cache_key, series, interval_end = key
+        size = len(json.dumps(value, default=str))
+        if size > self.max_bytes:
+            return
+        now = self.clock()
+        entry = CacheEntry(value, size, now + ttl, now + ttl + self.stale_ttl, series, interval_end)
+        with self.lock:
+            self.discard(cache_key)
+            self.entries[cache_key] = entry
+            self.size += size
+            if series is not None:
+                self.latest[series] = cache_key
+            while self.entries and (len(self.entries) > self.max_entries or self.size > self.max_bytes):
+                self.discard(next(iter(self.entries)))
+                self.evictions += 1
+
+    def discard(self, cache_key):
+        """
+        Remove an entry. The cache lock must be held by the caller.
+
+        Args:
+            cache_key (str): key of the entry.
+        """
+        entry = self.entries.pop(cache_key, None)
+        if entry is None:
+            return
+        self.size -= entry.size
+        if entry.series is not None and self.latest.get(entry.series) == cache_key:
+            del self.latest[entry.series]
+
+    def get_or_compute(self, key, compute, ttl):
+        """
+        Get a response from the cache or compute it.
+
+        Only successful responses are cached. Stale responses are returned immediately
+        and refreshed in a background thread.
+
+        Args:
+            key (tuple): key returned by query_key or payload_key.
+            compute (callable): function computing the response.
+            ttl (callable): function returning the time to live of a fresh response.
+
+        Returns:
+            (dict): the response.
+        """
+        if not self.enabled:
+            return compute()
+        value, state = self.lookup(key)
+        if state == 'stale':
+            self.refresh(key, compute, ttl)
+        if value is not None:
+            return value
+        value = compute()
+        if self.cacheable(value):
+            self.store(key, value, ttl())
+        return value
+
+    def refresh(self, key, compute, ttl):
+        """
+        Recompute a stale response in the background, at most once at a time per key.
+
+        Args:
+            key (tuple): key returned by query_key or payload_key.
+            compute (callable): function computing the response.
+            ttl (callable): function returning the time to live of a fresh response.
+        """
+        with self.lock:
+            if key[0] in self.refreshing:
+                return
+            self.refreshing.add(key[0])
+        def run():
+            try:
+                value = compute()
+                if self.cacheable(value):
+                    self.store(key, value, ttl())
+            except Exception as e:
+                logger.logger.error(f"Could not refresh cached response: {e}")
+            finally:
+                with self.lock:
+                    self.refreshing.discard(key[0])
+        thread = threading.Thread(target=run)
+        thread.daemon = True
+        thread.start()
+
+    @staticmethod
+    def cacheable(value):
+        """
+        Check whether a response can be stored.
+
+        Args:
+            value (dict): response.
+
+        Returns:
+            (bool): True for successful responses.
+        """
+        return isinstance(value, dict) and value.get("status") == "success"
+
+    def stats(self):
+        """
+        Get usage statistics of the cache.
+
+        Returns:
+            (dict): entries, memory used, hits, stale hits, misses, evictions and hit ratio.
+        """
+        with self.lock:
+            requests = self.hits + self.stale_hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "entries": len(self.entries),
+                "size_bytes": self.size,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "stale_hits": self.stale_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": (self.hits + self.stale_hits) / requests if requests else 0.0
+            }
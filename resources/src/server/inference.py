@@ -0,0 +1,396 @@
+# Copyright (C) 2024 Eneo Tecnologia S.L.
+#
+# Authors:
+# Miguel Álvarez Adsuara <malvarez@redborder.com>
+# Pablo Rodriguez Flores <prodriguez@redborder.com>
+#
+# This program is free software: you can redistribute it and/or modify it under the terms of the
+# GNU Affero General Public License as published by the Free Software Foundation, either version 3
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without
+# even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with this program.
+# If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Inference server shared by every gunicorn worker of a node.
+
+A single long-lived process owns the deep learning models. Workers copy the sliced input
+of the model into a shared memory buffer and send its name over a unix socket. The server
+batches the requests of every worker for the same model into a single prediction and
+writes the result back into the same buffer, since the output of the autoencoders has the
+shape of their input, and the worker copies it out before releasing the buffer. Tensors
+are copied, but never pickled. Workers only keep the model configuration, so their memory does not
+grow with the models and recycling them does not reload any model.
+"""
+import os
+import time
+import queue
+import threading
+import multiprocessing
+import numpy as np
+from multiprocessing import connection, shared_memory
+
+from resources.src.logger import logger
+from resources.src.metrics import metrics
+from resources.src.server.model_registry import ModelRegistry
+
+class InferenceError(Exception):
+    """
+    Raised when the inference server could not run a prediction.
+    """
+
+class Task:
+    """
+    Prediction requested by a worker, stored in its shared memory buffer.
+    """
+    def __init__(self, data):
+        self.data = data
+        self.error = None
+        self.done = threading.Event()
+
+class InferenceServer:
+    """
+    Process owning the models and batching the predictions requested by the workers.
+
+    Args:
+        socket_path (str): path of the unix socket used as control channel.
+        authkey (bytes): secret shared with the workers.
+        models (ModelRegistry): registry of the models.
+        max_batch (int): maximum slices predicted in a single call.
+        batch_wait (float): maximum seconds to wait for more requests to batch.
+    """
+    def __init__(self, socket_path, authkey, models, max_batch=512, batch_wait=0.005):
+        self.socket_path = socket_path
+        self.authkey = authkey
+        self.models = models
+        self.max_batch = int(max_batch)
+        self.batch_wait = float(batch_wait)
+        self.queues = {}
+        self.lock = threading.Lock()
+        self.listener = None
+        self.batches = 0
+        self.predictions = 0
+
+    def listen(self):
+        """
+        Bind the unix socket, replacing the one left by a previous server.
+        """
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        self.listener = connection.Listener(self.socket_path, family='AF_UNIX', authkey=self.authkey)
+
+    def serve_forever(self):
+        """
+        Accept worker connections, each handled by its own thread.
+        """
+        if self.listener is None:
+            self.listen()
+        logger.logger.info(f"Inference server listening on {self.socket_path}")
+        while True:
+            try:
+                conn = self.listener.accept()
+            except OSError:
+                return
+            except Exception as e:
+                logger.logger.error(f"Rejected inference connection: {e}")
+                continue
+            thread = threading.Thread(target=self.handle, args=(conn,))
+            thread.daemon = True
+            thread.start()
+
+    def close(self):
+        """
+        Stop accepting connections.
+        """
+        if self.listener is not None:
+            self.listener.close()
+
+    def handle(self, conn):
+        """
+        Answer the requests of a worker connection until it is closed.
+
+        Args:
+            conn (multiprocessing.connection.Connection): connection with a worker.
+        """
+        with conn:
+            while True:
+                try:
+                    request = conn.recv()
+                except (EOFError, OSError):
+                    return
+                try:
+                    self.predict(request)
+                    reply = {"status": "success"}
+                except Exception as e:
+                    logger.logger.error(f"Inference of model {request.get('model')} failed: {e}")
+                    reply = {"status": "error", "msg": str(e)}
+                try:
+                    conn.send(reply)
+                except (EOFError, OSError):
+                    return
+
+    def predict(self, request):
+        """
+        Run the prediction of a request over its shared memory buffer.
+
+        Args:
+            request (dict): model name and name, shape and dtype of the buffer.
+        """
+        # The server is spawned by the gunicorn master and shares its resource tracker with
+        # the workers, so attaching does not take ownership of the buffer from the worker.
+        shm = shared_memory.SharedMemory(name=request["shm"])
+        try:
+            task = Task(np.ndarray(request["shape"], dtype=request["dtype"], buffer=shm.buf))
+            self.tasks(request["model"]).put(task)
+            task.done.wait()
+            task.data = None
+            if task.error is not None:
+                raise task.error
+        finally:
+            shm.close()
+
+    def tasks(self, model):
+        """
+        Get the queue of pending predictions of a model, starting its batcher if needed.
+
+        Args:
+            model (str): model name.
+
+        Returns:
+            (queue.Queue): pending tasks of the model.
+        """
+        with self.lock:
+            if model not in self.queues:
+                self.queues[model] = queue.Queue()
+                thread = threading.Thread(target=self.batcher, args=(model, self.queues[model]))
+                thread.daemon = True
+                thread.start()
+            return self.queues[model]
+
+    def next_batch(self, tasks):
+        """
+        Wait for a task and gather the ones arriving shortly after it.
+
+        Args:
+            tasks (queue.Queue): pending tasks of a model.
+
+        Returns:
+            (list): tasks to predict together.
+        """
+        batch = [tasks.get()]
+        rows = len(batch[0].data)
+        deadline = time.monotonic() + self.batch_wait
+        while rows < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                task = tasks.get(timeout=remaining)
+            except queue.Empty:
+                break
+            batch.append(task)
+            rows += len(task.data)
+        return batch
+
+    def batcher(self, model, tasks):
+        """
+        Predict the pending tasks of a model in batches.
+
+        Args:
+            model (str): model name.
+            tasks (queue.Queue): pending tasks of the model.
+        """
+        while True:
+            batch = self.next_batch(tasks)
+            try:
+                with self.models.checkout(model) as autoencoder:
+                    with metrics.timer("shared_predict", model):
+                        predicted = autoencoder.model.predict(
+                            np.concatenate([task.data for task in batch]), verbose=0
+                        )
+                offset = 0
+                for task in batch:
+                    task.data[:] = predicted[offset:offset+len(task.data)]
+                    offset += len(task.data)
+                self.batches += 1
+                self.predictions += len(batch)
+            except Exception as e:
+                for task in batch:
+                    task.error = e
+            finally:
+                for task in batch:
+                    task.done.set()
+
+class InferenceClient:
+    """
+    Connection of a worker with the inference server. Each thread uses its own connection,
+    opened on first use so it is never shared across a fork.
+
+    Args:
+        socket_path (str): path of the unix socket of the server.
+        authkey (bytes): secret shared with the server.
+        connect_timeout (float): seconds to keep retrying while the server starts.
+    """
+    def __init__(self, socket_path, authkey, connect_timeout=30):
+        self.socket_path = socket_path
+        self.authkey = authkey
+        self.connect_timeout = float(connect_timeout)
+        self.local = threading.local()
+
+    def connection(self):
+        """
+        Get the connection of the current thread.
+
+        Returns:
+            (multiprocessing.connection.Connection): connection with the server.
+        """
+        conn = getattr(self.local, "conn", None)
+        if conn is not None and getattr(self.local, "pid", None) == os.getpid():
+            return conn
+        deadline = time.monotonic() + self.connect_timeout
+        while True:
+            try:
+                conn = connection.Client(self.socket_path, family='AF_UNIX', authkey=self.authkey)
+                break
+            except (FileNotFoundError, ConnectionRefusedError):
+                if time.monotonic() > deadline:
+                    raise InferenceError(f"Inference server is not listening on {self.socket_path}")
+                time.sleep(0.1)
+        self.local.conn = conn
+        self.local.pid = os.getpid()
+        return conn
+
+    def disconnect(self):
+        """
+        Drop the connection of the current thread after a failure.
+        """
+        conn = getattr(self.local, "conn", None)
+        self.local.conn = None
+        if conn is not None:
+            conn.close()
+
+    def predict(self, model, data):
+        """
+        Predict the output of a model through the inference server.
+
+        Args:
+            model (str): model name.
+            data (numpy.ndarray): input of the model.
+
+        Returns:
+            (numpy.ndarray): output of the model, with the shape of the input.
+
+        Raises:
+            InferenceError: if the server could not run the prediction.
+        """
+        data = np.ascontiguousarray(data, dtype=np.float64)
+        shm = shared_memory.SharedMemory(create=True, size=max(1, data.nbytes))
+        try:
+            buffer = np.ndarray(data.shape, dtype=data.dtype, buffer=shm.buf)
+            buffer[:] = data
+            request = {"model": model, "shm": shm.name, "shape": data.shape, "dtype": data.dtype.str}
+            try:
+                conn = self.connection()
+                conn.send(request)
+                reply = conn.recv()
+            except (EOFError, OSError) as e:
+                self.disconnect()
+                raise InferenceError(f"Lost connection with the inference server: {e}")
+            if reply["status"] != "success":
+                raise InferenceError(reply["msg"])
+            return buffer.copy()
+        finally:
+            buffer = None
+            shm.close()
+            shm.unlink()
+
+    def model(self, name):
+        """
+        Get a stand-in for a model served by the inference server.
+
+        Args:
+            name (str): model name.
+
+        Returns:
+            (RemoteModel): object predicting through this client.
+        """
+        return RemoteModel(self, name)
+
+class RemoteModel:
+    """
+    Stand-in for a keras model whose predictions run in the inference server.
+
+    Args:
+        client (InferenceClient): connection with the inference server.
+        name (str): model name.
+    """
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+
+    def predict(self, data, verbose=0):
+        """
+        Predict the output of the model.
+
+        Args:
+            data (numpy.ndarray): input of the model.
+            verbose (int): ignored, kept for compatibility with keras.
+
+        Returns:
+            (numpy.ndarray): output of the model.
+        """
+        return self.client.predict(self.name, data)
+
+    def get_weights(self):
+        """
+        The weights live in the inference server.
+
+        Returns:
+            (list): no weights.
+        """
+        return []
+
+def serve(socket_path, authkey, ai_path, registry_options, max_batch, batch_wait, preload=()):
+    """
+    Entry point of the inference server process.
+
+    Args:
+        socket_path (str): path of the unix socket used as control channel.
+        authkey (bytes): secret shared with the workers.
+        ai_path (str): directory with the model files.
+        registry_options (dict): options of the ModelRegistry.
+        max_batch (int): maximum slices predicted in a single call.
+        batch_wait (float): maximum seconds to wait for more requests to batch.
+        preload (list): models loaded before serving.
+    """
+    server = InferenceServer(socket_path, authkey, ModelRegistry(ai_path, **registry_options), max_batch, batch_wait)
+    server.listen()
+    for model in preload:
+        try:
+            server.models.get(model)
+        except Exception as e:
+            logger.logger.error(f"Could not preload model {model}: {e}")
+    server.serve_forever()
+
+def start_server(socket_path, authkey, ai_path, registry_options, max_batch=512, batch_wait=0.005, preload=()):
+    """
+    Start the inference server in a new process. The process is spawned instead of forked
+    so it gets a clean TensorFlow runtime. The spawned process imports the main module of
+    the caller again, so the main module must not start the application on import.
+
+    Returns:
+        (multiprocessing.Process): the server process.
+    """
+    process = multiprocessing.get_context("spawn").Process(
+        target=serve,
+        args=(socket_path, authkey, ai_path, registry_options, max_batch, batch_wait, list(preload)),
+        name="rb-aioutliers-inference",
+        daemon=True
+    )
+    process.start()
+    logger.logger.info(f"Started inference server with pid {process.pid}")
+    return process
@@ -0,0 +1,406 @@
+# Copyright (C) 2024 Eneo Tecnologia S.L.
+#
+# Authors:
+# Miguel Álvarez Adsuara <malvarez@redborder.com>
+# Pablo Rodriguez Flores <prodriguez@redborder.com>
+#
+# This program is free software: you can redistribute it and/or modify it under the terms of the
+# GNU Affero General Public License as published by the Free Software Foundation, either version 3
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without
+# even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with this program.
+# If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Registry of the deep learning models loaded by the API server.
+"""
+import os
+import time
+import queue
+import hashlib
+import threading
+import tensorflow as tf
+from contextlib import contextmanager
+from collections import OrderedDict
+
+from resources.src.ai import outliers
+from resources.src.logger import logger
+from resources.src.metrics import metrics
+
+class Replica:
+    """
+    Instance of a model in a replica pool and its usage statistics.
+    """
+    def __init__(self, index, autoencoder):
+        self.index = index
+        self.autoencoder = autoencoder
+        self.executions = 0
+        self.wait_time = 0.0
+        self.execution_time = 0.0
+
+class ReplicaPool:
+    """
+    Pool of independent instances of the same model, so concurrent requests do not
+    serialize on a single keras model.
+
+    Args:
+        autoencoders (list): instances of the model.
+    """
+    def __init__(self, autoencoders):
+        self.replicas = [Replica(index, autoencoder) for index, autoencoder in enumerate(autoencoders)]
+        self.available = queue.Queue()
+        self.lock = threading.Lock()
+        for replica in self.replicas:
+            self.available.put(replica)
+
+    @contextmanager
+    def checkout(self):
+        """
+        Take a replica from the pool, waiting until one is available, and return it when
+        the block exits.
+
+        Yields:
+            (Autoencoder): instance of the model for the exclusive use of the caller.
+        """
+        start = time.time()
+        replica = self.available.get()
+        checked_out = time.time()
+        try:
+            yield replica.autoencoder
+        finally:
+            with self.lock:
+                replica.executions += 1
+                replica.wait_time += checked_out - start
+                replica.execution_time += time.time() - checked_out
+            self.available.put(replica)
+
+    def stats(self):
+        """
+        Get usage statistics of each replica.
+
+        Returns:
+            (list): executions, total queue wait and total execution time of each replica.
+        """
+        with self.lock:
+            return [{
+                "replica": replica.index,
+                "executions": replica.executions,
+                "wait_time": replica.wait_time,
+                "execution_time": replica.execution_time
+            } for replica in self.replicas]
+
+class ModelEntry:
+    """
+    Loaded model together with the state of the files it was loaded from.
+    """
+    def __init__(self, name, pool, signature, checksum, size, load_time=0.0, warm_up_time=0.0):
+        self.name = name
+        self.pool = pool
+        self.signature = signature
+        self.checksum = checksum
+        self.size = size
+        self.load_time = load_time
+        self.warm_up_time = warm_up_time
+        self.last_check = time.time()
+
+class ModelRegistry:
+    """
+    Thread safe, bounded cache of Autoencoder replica pools.
+
+    Each model is built at most once at a time. When the models use more memory than the
+    budget, the least recently used ones are evicted. The model files are checked for
+    changes and, when they are replaced (e.g. by the S3 sync), the new version is loaded
+    and warmed up in the background and swapped in once it is ready, so requests never
+    see a half loaded model.
+
+    Args:
+        ai_path (str): directory with the .keras and .ini files of the models.
+        max_memory_mb (float): approximate memory budget for the model weights.
+        check_interval (float): minimum seconds between checks of the files of a model.
+        settle_time (float): seconds a changed file must stay untouched before reloading it.
+        replicas (int): number of instances loaded for each model.
+        hot_models (dict): number of instances of specific models, overriding replicas.
+        intra_op_threads (int): threads TensorFlow may use inside a single operation. It is
+          set for the whole process, so it bounds what every replica can use. 0 keeps the
+          TensorFlow default.
+        inference_client (InferenceClient): if set, the keras models are not loaded in this
+          process and predictions run in the shared inference server.
+    """
+    def __init__(self, ai_path, max_memory_mb=1024, check_interval=5, settle_time=2,
+                 replicas=1, hot_models=None, intra_op_threads=0, inference_client=None):
+        self.ai_path = ai_path
+        self.inference_client = inference_client
+        self.replicas = int(replicas)
+        self.hot_models = hot_models or {}
+        self.max_bytes = float(max_memory_mb)*1024*1024
+        self.check_interval = float(check_interval)
+        self.settle_time = float(settle_time)
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.model_locks = {}
+        self.reloading = set()
+        self.loads = 0
+        self.evictions = 0
+        if int(intra_op_threads) > 0:
+            try:
+                tf.config.threading.set_intra_op_parallelism_threads(int(intra_op_threads))
+            except RuntimeError as e:
+                logger.logger.error(f"Could not set TensorFlow intra-op threads: {e}")
+
+    @staticmethod
+    def parse_hot_models(hot_models):
+        """
+        Parse the replica count of the hot models from its config format.
+
+        Args:
+            hot_models (str): comma separated list of 'model:replicas'.
+
+        Returns:
+            (dict): number of replicas of each model.
+        """
+        parsed = {}
+        for item in hot_models.split(","):
+            name, _, count = item.strip().partition(":")
+            if name and count:
+                parsed[name] = int(count)
+        return parsed
+
+    def model_files(self, name):
+        """
+        Get the files of a model.
+
+        Args:
+            name (str): model name.
+
+        Returns:
+            (tuple): paths to the .keras and .ini files.
+        """
+        return (
+            os.path.join(self.ai_path, f"{name}.keras"),
+            os.path.join(self.ai_path, f"{name}.ini")
+        )
+
+    def signature(self, name):
+        """
+        Get the modification time and size of the files of a model.
+
+        Args:
+            name (str): model name.
+
+        Returns:
+            (tuple): mtime and size of each file, or None if a file is missing.
+        """
+        try:
+            return tuple((stat.st_mtime_ns, stat.st_size) for stat in map(os.stat, self.model_files(name)))
+        except OSError:
+            return None
+
+    def checksum(self, name):
+        """
+        Get a checksum of the content of the files of a model.
+
+        Args:
+            name (str): model name.
+
+        Returns:
+            (str): hex digest of the files.
+        """
+        digest = hashlib.sha256()
+        for path in self.model_files(name):
+            with open(path, 'rb') as model_file:
+                for chunk in iter(lambda: model_file.read(1024*1024), b''):
+                    digest.update(chunk)
+        return digest.hexdigest()
+
+    def model_lock(self, name):
+        """
+        Get the lock used to construct a model.
+
+        Args:
+            name (str): model name.
+
+        Returns:
+            (threading.Lock): lock of the model.
+        """
+        with self.lock:
+            return self.model_locks.setdefault(name, threading.Lock())
+
+    def load(self, name):
+        """
+        Build and warm up the replicas of a model.
+
+        Args:
+            name (str): model name.
+
+        Returns:
+            (ModelEntry): the loaded model.
+        """
+        start = time.time()
+        warm_up_time = 0.0
+        with metrics.timer("load", name):
+            signature = self.signature(name)
+            checksum = self.checksum(name)
+            autoencoders = []
+            for _ in range(max(1, self.hot_models.get(name, self.replicas))):
+                if self.inference_client is not None:
+                    autoencoders.append(outliers.Autoencoder(
+                        *self.model_files(name), model=self.inference_client.model(name)
+                    ))
+                    continue
+                autoencoder = outliers.Autoencoder(*self.model_files(name))
+                warm_up_start = time.time()
+                autoencoder.warm_up()
+                warm_up_time += time.time() - warm_up_start
+                autoencoders.append(autoencoder)
+        size = sum(weight.nbytes for weight in autoencoders[0].model.get_weights())*len(autoencoders)
+        with self.lock:
+            self.loads += 1
+        metrics.MODEL_LOADS.labels(name).inc()
+        return ModelEntry(
+            name, ReplicaPool(autoencoders), signature, checksum, size, time.time() - start, warm_up_time
+        )
+
+    @contextmanager
+    def checkout(self, name):
+        """
+        Get an instance of a model for exclusive use, loading the model if needed.
+
+        Args:
+            name (str): model name.
+
+        Yields:
+            (Autoencoder): instance of the model.
+        """
+        with self.get(name).checkout() as autoencoder:
+            yield autoencoder
+
+    def get(self, name):
+        """
+        Get the replica pool of a model, loading it if needed.
+
+        Args:
+            name (str): model name.
+
+        Returns:
+            (ReplicaPool): the replicas of the model.
+        """
+        with self.lock:
+            entry = self.entries.get(name)
+            if entry is not None:
+                self.entries.move_to_end(name)
+        if entry is not None:
+            self.check_for_changes(entry)
+            return entry.pool
+        with self.model_lock(name):
+            with self.lock:
+                entry = self.entries.get(name)
+            if entry is None:
+                logger.logger.info(f"Creating instance of model {name}")
+                entry = self.load(name)
+                self.insert(entry)
+        return entry.pool
+
+    def insert(self, entry):
+        """
+        Add or replace a model and evict the least recently used ones while the registry
+        is over its memory budget. The newest model is never evicted.
+
+        Args:
+            entry (ModelEntry): the model to add.
+        """
+        with self.lock:
+            self.entries[entry.name] = entry
+            self.entries.move_to_end(entry.name)
+            while len(self.entries) > 1 and self.memory() > self.max_bytes:
+                evicted, _ = self.entries.popitem(last=False)
+                self.evictions += 1
+                logger.logger.info(f"Evicted model {evicted} from memory")
+
+    def memory(self):
+        """
+        Get the approximate memory used by the loaded models.
+
+        Returns:
+            (int): bytes used by the weights of the models.
+        """
+        return sum(entry.size for entry in self.entries.values())
+
+    def check_for_changes(self, entry):
+        """
+        Start a background reload if the files of a model changed since it was loaded.
+
+        Args:
+            entry (ModelEntry): the loaded model.
+        """
+        now = time.time()
+        if now - entry.last_check < self.check_interval:
+            return
+        entry.last_check = now
+        signature = self.signature(entry.name)
+        if signature is None or signature == entry.signature:
+            return
+        if now - max(mtime for mtime, _ in signature)/1e9 < self.settle_time:
+            return
+        with self.lock:
+            if entry.name in self.reloading:
+                return
+            self.reloading.add(entry.name)
+        thread = threading.Thread(target=self.reload, args=(entry,))
+        thread.daemon = True
+        thread.start()
+
+    def reload(self, entry):
+        """
+        Load the new version of a model and swap it in. If the content did not change
+        only the file signature is updated.
+
+        Args:
+            entry (ModelEntry): the currently loaded model.
+        """
+        try:
+            with self.model_lock(entry.name):
+                if self.checksum(entry.name) == entry.checksum:
+                    entry.signature = self.signature(entry.name)
+                    return
+                logger.logger.info(f"Model {entry.name} changed, reloading it")
+                self.insert(self.load(entry.name))
+        except Exception as e:
+            logger.logger.error(f"Could not reload model {entry.name}: {e}")
+        finally:
+            with self.lock:
+                self.reloading.discard(entry.name)
+
+    def names(self):
+        """
+        Get the names of the loaded models.
+
+        Returns:
+            (list): model names from least to most recently used.
+        """
+        with self.lock:
+            return list(self.entries)
+
+    def stats(self):
+        """
+        Get usage statistics of the registry.
+
+        Returns:
+            (dict): loaded models with their replica statistics, load and warm-up times,
+              memory used, loads and evictions.
+        """
+        with self.lock:
+            return {
+                "models": {name: entry.pool.stats() for name, entry in self.entries.items()},
+                "load_times": {
+                    name: {"load_time": entry.load_time, "warm_up_time": entry.warm_up_time}
+                    for name, entry in self.entries.items()
+                },
+                "size_bytes": self.memory(),
+                "max_bytes": self.max_bytes,
+                "loads": self.loads,
+                "evictions": self.evictions
+            }
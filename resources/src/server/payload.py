@@ -0,0 +1,161 @@
+# Copyright (C) 2024 Eneo Tecnologia S.L.
+#
+# Authors:
+# Miguel Álvarez Adsuara <malvarez@redborder.com>
+# Pablo Rodriguez Flores <prodriguez@redborder.com>
+#
+# This program is free software: you can redistribute it and/or modify it under the terms of the
+# GNU Affero General Public License as published by the Free Software Foundation, either version 3
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without
+# even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with this program.
+# If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Decoding of structured request bodies. Besides the base64 form fields, the outliers API
+accepts the same fields as a JSON or msgpack body, optionally gzip encoded.
+"""
+import json
+import zlib
+import msgpack
+
+JSON_TYPES = ("application/json",)
+MSGPACK_TYPES = ("application/msgpack", "application/x-msgpack", "application/vnd.msgpack")
+CHUNK_SIZE = 64*1024
+
+class PayloadError(Exception):
+    """
+    Raised when a request body cannot be decoded.
+    """
+
+class Payload:
+    """
+    Fields of a decoded request body.
+
+    Args:
+        fields (dict): decoded fields.
+    """
+    def __init__(self, fields):
+        self.fields = fields
+
+    def get(self, name, default=None):
+        """
+        Get a field of the body.
+
+        Args:
+            name (str): field name.
+            default: value returned if the field is missing.
+
+        Returns:
+            The value of the field.
+        """
+        return self.fields.get(name, default)
+
+def media_type(request):
+    """
+    Get the media type of a request without its parameters.
+
+    Args:
+        request (flask.Request): incoming request.
+
+    Returns:
+        (str): lowercase media type, e.g. 'application/json'.
+    """
+    return (request.mimetype or "").lower()
+
+def is_structured(request):
+    """
+    Check whether the request carries a JSON or msgpack body instead of form fields.
+
+    Args:
+        request (flask.Request): incoming request.
+
+    Returns:
+        (bool): True if the body has to be decoded with read_payload.
+    """
+    return media_type(request) in JSON_TYPES + MSGPACK_TYPES
+
+def iter_chunks(request, max_size):
+    """
+    Read the body of a request in chunks, decompressing it on the fly if it is gzip or
+    deflate encoded.
+
+    Args:
+        request (flask.Request): incoming request.
+        max_size (int): maximum size of the decompressed body.
+
+    Yields:
+        (bytes): chunks of the decompressed body.
+
+    Raises:
+        PayloadError: if the encoding is not supported, the body is corrupt or too large.
+    """
+    encoding = (request.headers.get("Content-Encoding") or "identity").lower()
+    if encoding in ("gzip", "x-gzip"):
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    elif encoding == "deflate":
+        decompressor = zlib.decompressobj()
+    elif encoding == "identity":
+        decompressor = None
+    else:
+        raise PayloadError(f"Unsupported content encoding {encoding}")
+    stream = request.stream
+    size = 0
+    while True:
+        chunk = stream.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        if decompressor is not None:
+            try:
+                chunk = decompressor.decompress(chunk, max_size - size + 1)
+            except zlib.error as e:
+                raise PayloadError(f"Corrupt {encoding} body: {e}")
+            if decompressor.unconsumed_tail:
+                raise PayloadError("Request body is too large")
+        size += len(chunk)
+        if size > max_size:
+            raise PayloadError("Request body is too large")
+        if chunk:
+            yield chunk
+    if decompressor is not None:
+        if not decompressor.eof:
+            raise PayloadError(f"Truncated {encoding} body")
+
+def read_payload(request, max_size):
+    """
+    Decode a JSON or msgpack request body. msgpack bodies are unpacked incrementally as
+    chunks arrive, JSON bodies are parsed once from the decompressed bytes.
+
+    Args:
+        request (flask.Request): incoming request.
+        max_size (int): maximum size of the decompressed body.
+
+    Returns:
+        (Payload): fields of the body.
+
+    Raises:
+        PayloadError: if the body cannot be decoded or is not an object.
+    """
+    if media_type(request) in MSGPACK_TYPES:
+        unpacker = msgpack.Unpacker(raw=False, max_buffer_size=max_size)
+        for chunk in iter_chunks(request, max_size):
+            unpacker.feed(chunk)
+        try:
+            fields = unpacker.unpack()
+        except (msgpack.OutOfData, ValueError) as e:
+            raise PayloadError(f"Invalid msgpack body: {e}")
+    else:
+        body = bytearray()
+        for chunk in iter_chunks(request, max_size):
+            body += chunk
+        try:
+            fields = json.loads(body)
+        except ValueError as e:
+            raise PayloadError(f"Invalid json body: {e}")
+    if not isinstance(fields, dict):
+        raise PayloadError("Request body must be an object")
+    return Payload(fields)
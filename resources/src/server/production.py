@@ -19,6 +19,31 @@
 import os
 from gunicorn.app.base import BaseApplication
 
+from resources.src.metrics import metrics
+
+def gunicorn_options(config):
+    """
+    Get the gunicorn options of the production server.
+
+    Args:
+        config (ConfigManager): configuration of the service.
+
+    Returns:
+        dict: gunicorn settings.
+    """
+    binding_host = config.get("OutliersServerProduction", "outliers_binding_address")
+    binding_port = config.get("OutliersServerProduction", "outliers_server_port")
+    return {
+        'bind': f"{binding_host}:{binding_port}",
+        'workers': config.get("OutliersServerProduction", "outliers_server_workers"),
+        'threads': config.get("OutliersServerProduction", "outliers_server_threads"),
+        'worker_class': 'gthread',
+        'max_requests': 100,
+        'max_requests_jitter': 10,
+        'max_worker_lifetime': 3600,
+        'child_exit': lambda server, worker: metrics.mark_process_dead(worker.pid)
+    }
+
 class GunicornApp(BaseApplication):
     def __init__(self, app, options=None):
         """
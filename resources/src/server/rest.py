@@ -22,12 +22,17 @@ import json
 import time
 import base64
 import threading
-from flask import Flask, jsonify, request
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from flask import Flask, Response, jsonify, request
 
 from resources.src.redborder.s3 import S3
+from resources.src.redborder.model_sync import ModelSync
+from resources.src.server import cache, singleflight, model_registry, payload, admission
 from resources.src.ai import outliers, shallow_outliers, outliers_identifier
 from resources.src.druid import client, query_builder
 from resources.src.logger import logger
+from resources.src.metrics import metrics
 from resources.src.config import configmanager
 
 '''
@@ -35,20 +40,249 @@ Init local variables
 '''
 
 config = configmanager.ConfigManager(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "config.ini"))
-druid_client = client.DruidClient(config.get("Druid", "druid_endpoint"))
+
+def druid_client_options():
+    """
+    Get the options of the druid client from the config file.
+
+    Returns:
+        (dict): keyword arguments of DruidClient.
+    """
+    return {
+        "druid_endpoint": config.get("Druid", "druid_endpoint"),
+        "pool_size": config.get("Druid", "pool_size", fallback="20"),
+        "connect_timeout": config.get("Druid", "connect_timeout", fallback="5"),
+        "read_timeout": config.get("Druid", "read_timeout", fallback="120"),
+        "retries": config.get("Druid", "retries", fallback="3"),
+        "retry_backoff": config.get("Druid", "retry_backoff", fallback="0.5"),
+        "gzip": config.get("Druid", "gzip", fallback="true").lower() == "true",
+        "chunk_max_buckets": config.get("Druid", "chunk_max_buckets", fallback="1440"),
+        "chunk_parallelism": config.get("Druid", "chunk_parallelism", fallback="4")
+    }
+
 query_modifier = query_builder.QueryBuilder(
     os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "druid", "data", "aggregations.json"),
     os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "druid", "data", "postAggregations.json")
 )
+druid_client = client.DruidClient(query_builder=query_modifier, **druid_client_options())
+
+class ModelRunner:
+    def __init__(self, inference_client=None):
+        """
+        Initialize the models and the druid access used to detect outliers.
+
+        The API server is built on top of it, and the scoring workers use it on its own, so
+        they do not start the S3 sync, the response cache or a Flask app. Without an API
+        server in front, model executions are not limited by admission control.
+
+        Args:
+            inference_client (InferenceClient, optional): connection with the shared inference
+              server. If set, deep learning models run there instead of in this process.
+        """
+        self.admission = admission.AdmissionController(enabled=False)
+        self.shallow = shallow_outliers.ShallowOutliers(
+            sensitivity = config.get("ShallowOutliers", "sensitivity"),
+            contamination = config.get("ShallowOutliers", "contamination")
+        )
+        self.identifier = outliers_identifier.OutlierIdentifier()
+        self.ai_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "ai")
+        if inference_client is None:
+            self.models = model_registry.ModelRegistry(self.ai_path, **self.model_registry_options())
+        else:
+            self.models = model_registry.ModelRegistry(
+                self.ai_path,
+                check_interval = config.get("ModelRegistry", "check_interval", fallback="5"),
+                replicas = config.get("InferenceServer", "worker_concurrency", fallback="8"),
+                inference_client = inference_client
+            )
+        self.druid_flight = singleflight.SingleFlight("druid")
+        self.druid_stream_columns = config.get("Druid", "stream_columns", fallback="false").lower() == "true"
+        self.model_flight = singleflight.SingleFlight("model")
+
+    @staticmethod
+    def model_registry_options():
+        """
+        Get the options of the model registry from the configuration.
+
+        Returns:
+            (dict): keyword arguments of ModelRegistry.
+        """
+        return {
+            "max_memory_mb": config.get("ModelRegistry", "max_memory_mb", fallback="1024"),
+            "check_interval": config.get("ModelRegistry", "check_interval", fallback="5"),
+            "replicas": config.get("ModelRegistry", "replicas", fallback="1"),
+            "hot_models": model_registry.ModelRegistry.parse_hot_models(
+                config.get("ModelRegistry", "hot_models", fallback="")
+            ),
+            "intra_op_threads": config.get("ModelRegistry", "intra_op_threads", fallback="0")
+        }
+
+    def get_data_from_druid(self, druid_query, model='default'):
+        """
+        Get the data from druid for the execution of a model.
+        Identical queries running at the same time share a single druid request.
+
+        Args:
+            druid_query (dict): druid query for the data that we want to analyze.
+            model (string): the name of the model we want to use.
+
+        Returns:
+            (JSON): json containing the model's predictions and the outliers detected.
+        """
+
+        if model != 'default':
+            logger.logger.info(f"Calculating predictions with keras model {model}.keras")
+            druid_query = query_modifier.modify_aggregations(druid_query)
+        else:
+            logger.logger.info("Calculating predictions with default model")
+        try:
+            logger.logger.info(f"Executing druid query: {druid_query}")
+            with metrics.timer("druid", model):
+                data = self.druid_flight.do(
+                    cache.fingerprint(druid_query),
+                    lambda: self.execute_druid_query(druid_query)
+                )
+        except Exception as e:
+            error_message = "Could not execute druid query"
+            logger.logger.error(error_message + ": " + str(e))
+            raise Exception(error_message)
+        logger.logger.info("Druid query executed succesfully")
+        return data
+
+    def execute_druid_query(self, druid_query):
+        """
+        Execute a druid query, parsing the response into columns if streaming is enabled.
+
+        Args:
+            druid_query (dict): druid query for the data that we want to analyze.
+
+        Returns:
+            (list or TimeseriesColumns): the druid response.
+        """
+        if self.druid_stream_columns:
+            return druid_client.execute_query_columns(druid_query)
+        return druid_client.execute_query(druid_query)
+
+    def execute_model(self, data, metric, model='default', key=None):
+        """
+        Execute a keras deep learning model to detect outliers.
+        If a key identifying the data is given, identical executions running at the same
+        time share a single prediction.
+
+        Args:
+            data (dict): deserialized druid response with the data that we want to analyze.
+            metric (string): the name of field being analyzed.
+            model (string): the name of the model we want to use.
+            key (string, optional): fingerprint of the data.
+
+        Returns:
+            (dict): deserialized json containing the model's predictions and the outliers detected.
+        """
+        with metrics.timer("model", model):
+            if key is None:
+                return self.run_model(data, metric, model)
+            return self.model_flight.do(f"{model}:{metric}:{key}", lambda: self.run_model(data, metric, model))
 
-class APIServer:
-    def __init__(self):
+    def run_model(self, data, metric, model='default'):
+        """
+        Run the requested model over the data.
+
+        Args:
+            data (dict): deserialized druid response with the data that we want to analyze.
+            metric (string): the name of field being analyzed.
+            model (string): the name of the model we want to use.
+
+        Returns:
+            (dict): deserialized json containing the model's predictions and the outliers detected.
+
+        Raises:
+            admission.Rejected: if the model has too many executions in flight.
+        """
+        try:
+            with self.admission.slot("model", model):
+                if model == 'default':
+                    result = self.shallow.execute_prediction_model(data)
+                else:
+                    with self.models.checkout(model) as autoencoder:
+                        result = autoencoder.execute_prediction_model(
+                            autoencoder,
+                            data,
+                            metric,
+                        )
+            if isinstance(result.get("msg"), Exception):
+                raise result["msg"]
+            return result
+        except admission.Rejected:
+            raise
+        except Exception as e:
+            return self.error_payload(msg="Error while calculating prediction model", exception=e)
+
+    def run_model_batch(self, items, model='default'):
+        """
+        Run the requested model over several inputs. Deep learning models predict all the
+        inputs with a single call.
+
+        Args:
+            items (list): (data, metric) tuples.
+            model (string): the name of the model we want to use.
+
+        Returns:
+            (list): deserialized json with the predictions or an error for each item.
+        """
+        if model == 'default':
+            results = []
+            for data, metric in items:
+                try:
+                    with metrics.timer("model", model):
+                        results.append(self.run_model(data, metric, model))
+                except admission.Rejected as e:
+                    results.append(self.error_payload(msg="Too many requests", exception=e))
+            return results
+        try:
+            with metrics.timer("model", model), self.admission.slot("model", model):
+                with self.models.checkout(model) as autoencoder:
+                    results = autoencoder.execute_prediction_model_batch(
+                        autoencoder,
+                        [(metric, data) for data, metric in items]
+                    )
+        except admission.Rejected as e:
+            return [self.error_payload(msg="Too many requests", exception=e) for _ in items]
+        except Exception as e:
+            return [self.error_payload(msg="Error while calculating prediction model", exception=e) for _ in items]
+        return [
+            self.error_payload(msg="Error while calculating prediction model", exception=result["msg"])
+            if isinstance(result.get("msg"), Exception) else result
+            for result in results
+        ]
+
+    def error_payload(self, msg="error", exception=None):
+        """
+        Log an error and build the body of an error response.
+
+        Args:
+            msg (str): Message detailing the type of error that has occurred.
+            exception (Exception, optional): Exception object to include in the error message. Defaults to None.
+
+        Returns:
+            dict: Dictionary indicating an error status.
+        """
+        logged_error = msg + f": {exception}" if exception else msg
+        logger.logger.error(logged_error)
+        metrics.ERRORS.labels("api").inc()
+        return { "status": "error", "msg":msg }
+
+class APIServer(ModelRunner):
+    def __init__(self, inference_client=None):
         """
         Initialize the API server.
 
         This class uses Flask to create a web API for processing requests.
-        """
 
+        Args:
+            inference_client (InferenceClient, optional): connection with the shared inference
+              server. If set, deep learning models run there instead of in this process.
+        """
+        super().__init__(inference_client)
         self.s3_client = S3(
             config.get("AWS", "s3_public_key"),
             config.get("AWS", "s3_private_key"),
@@ -59,18 +293,69 @@ class APIServer:
 
         self.s3_sync_interval = 60
         self.s3_sync_thread = None
+        self.model_sync = ModelSync(
+            self.s3_client,
+            'rbaioutliers/latest',
+            os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "ai")
+        )
         self.start_s3_sync_thread()
         self.app = Flask(__name__)
-        self.app.add_url_rule('/api/v1/outliers', view_func=self.calculate, methods=['POST'])
-        self.app.add_url_rule('/api/v1/ip_identifier', view_func=self.identify_ip, methods=['POST'])
+        self.admission = admission.AdmissionController(
+            route_limits = (
+                config.get("Admission", "max_in_flight", fallback="12"),
+                config.get("Admission", "max_queue", fallback="4")
+            ),
+            model_limits = (
+                config.get("Admission", "model_max_in_flight", fallback="4"),
+                config.get("Admission", "model_max_queue", fallback="6")
+            ),
+            queue_timeout = config.get("Admission", "queue_timeout", fallback="2"),
+            enabled = config.get("Admission", "enabled", fallback="true").lower() == "true",
+            threads = config.get("OutliersServerProduction", "outliers_server_threads", fallback="0")
+        )
+        self.app.add_url_rule('/api/v1/outliers', view_func=self.admitted("outliers", self.calculate), methods=['POST'])
+        self.app.add_url_rule(
+            '/api/v1/outliers/batch', view_func=self.admitted("outliers_batch", self.calculate_batch), methods=['POST']
+        )
+        self.app.add_url_rule(
+            '/api/v1/ip_identifier', view_func=self.admitted("ip_identifier", self.identify_ip), methods=['POST']
+        )
+        self.app.add_url_rule(
+            '/api/v1/outliers/jobs', view_func=self.admitted("outliers_jobs", self.submit_outliers_job), methods=['POST']
+        )
+        self.app.add_url_rule(
+            '/api/v1/ip_identifier/jobs', view_func=self.admitted("ip_identifier_jobs", self.submit_ip_identifier_job),
+            methods=['POST']
+        )
+        self.app.add_url_rule('/api/v1/outliers/jobs/<job_id>', view_func=self.job_status, methods=['GET'])
+        self.app.add_url_rule(
+            '/api/v1/ip_identifier/jobs/<job_id>', view_func=self.job_status, endpoint='ip_identifier_job_status',
+            methods=['GET']
+        )
+        self.app.add_url_rule('/api/v1/cache', view_func=self.cache_stats, methods=['GET'])
+        self.app.add_url_rule('/api/v1/models', view_func=self.model_stats, methods=['GET'])
+        self.app.add_url_rule('/api/v1/admission', view_func=self.admission_stats, methods=['GET'])
+        self.app.add_url_rule('/metrics', view_func=self.export_metrics, methods=['GET'])
+        self.app.add_url_rule('/health', view_func=self.health, methods=['GET'])
+        self.app.add_url_rule('/ready', view_func=self.ready, methods=['GET'])
         self.exit_code = 0
-        self.shallow = shallow_outliers.ShallowOutliers(
-            sensitivity = config.get("ShallowOutliers", "sensitivity"),
-            contamination = config.get("ShallowOutliers", "contamination")
+        self.response_cache = cache.ResponseCache(
+            query_modifier.granularity_to_seconds,
+            max_entries = config.get("ResponseCache", "max_entries", fallback="256"),
+            max_bytes = int(config.get("ResponseCache", "max_size_mb", fallback="64"))*1024*1024,
+            default_ttl = config.get("ResponseCache", "default_ttl", fallback="60"),
+            stale_ttl = config.get("ResponseCache", "stale_ttl", fallback="0"),
+            enabled = config.get("ResponseCache", "enabled", fallback="true").lower() == "true"
         )
-        self.identifier = outliers_identifier.OutlierIdentifier()
-        self.ai_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "ai")
-        self.deep_models={}
+        self.max_batch_items = int(config.get("BatchRequests", "max_items", fallback="200"))
+        self.druid_executor = ThreadPoolExecutor(
+            max_workers=int(config.get("BatchRequests", "druid_parallelism", fallback="8")),
+            thread_name_prefix="druid"
+        )
+        self.scoring = None
+        self.warm_up_state = {}
+        self.warm_up_lock = threading.Lock()
+        self.max_body_size = int(float(config.get("RequestBody", "max_size_mb", fallback="64"))*1024*1024)
 
     def calculate(self):
         """
@@ -91,31 +376,361 @@ class APIServer:
         - data (Optional): A base64 encoded json with the data to analyze. Overrides the query
         parameter.
 
+        The same fields can also be sent as an 'application/json' or 'application/msgpack'
+        body, optionally with 'Content-Encoding: gzip'. In that case the model is a plain name
+        and query and data can be objects instead of base64 strings:
+        {
+            "query": {<druid_query>},
+            "model": "<model_name>",
+            "data": {<data>}
+        }
+
         Returns:
             A JSON response containing the prediction results or an error message.
         """
-        model = request.form.get('model')
-        model = self.decode_model(model)
+        try:
+            fields = self.request_fields()
+        except payload.PayloadError as e:
+            return self.return_error(msg="Could not decode request body", exception=e)
+        model, data, druid_query = fields["model"], fields["data"], fields["query"]
         if model != 'default':
             logger.logger.info(f"Calculating predictions with keras model {model}.keras")
         else:
             logger.logger.info("Calculating predictions with default model")
 
-        data = request.form.get('data')
-        druid_query = request.form.get('query')
         if data is None and druid_query is None:
             return self.return_error(msg="No data provided or requested")
+        metric = config.get("Outliers","metric")
         try:
             if data is None:
-                druid_query=self.decode_b64_json(druid_query)
-                data = self.get_data_from_druid(druid_query, model)
-                logger.logger.info("Druid query successfully decoded and loaded")
+                if isinstance(druid_query, str):
+                    with metrics.timer("decode", model):
+                        druid_query=self.decode_b64_json(druid_query)
+                cache_key = self.response_cache.query_key(druid_query, model, metric)
+                ttl = lambda: self.response_cache.ttl_for_query(druid_query)
+                compute = lambda: self.execute_model(
+                    self.get_data_from_druid(druid_query, model), metric, model, key=cache_key[0]
+                )
+                logger.logger.info("Druid query successfully decoded")
             else:
-                data = self.decode_b64_json(data)
+                cache_key = self.response_cache.payload_key(
+                    data if isinstance(data, str) else cache.fingerprint(data), model, metric
+                )
+                ttl = lambda: self.response_cache.default_ttl
+                if isinstance(data, str):
+                    with metrics.timer("decode", model):
+                        data = self.decode_b64_json(data)
+                compute = lambda: self.execute_model(data, metric, model, key=cache_key[0])
+            logger.logger.info("Starting outliers execution")
+            result = self.response_cache.get_or_compute(cache_key, compute, ttl)
+        except admission.Rejected as e:
+            return self.too_many_requests(e)
         except Exception as e:
             return self.return_error(msg="Could not execute druid query", exception=e)
-        logger.logger.info("Starting outliers execution")
-        return self.execute_model(data, config.get("Outliers","metric"), model)
+        with metrics.timer("serialize", model):
+            return jsonify(result)
+
+    def calculate_batch(self):
+        """
+        Handle POST requests to '/api/v1/outliers/batch'.
+        The endpoint expects an 'application/json' or 'application/msgpack' body, optionally
+        gzip encoded, with the following format:
+        {
+            "items": [
+                {
+                    "query": {<druid_query>},
+                    "data": {<data>},  # Optional field, overrides query
+                    "model": "<model_name>",  # Optional field
+                    "metric": "<metric>"  # Optional field
+                },
+                ...
+            ]
+        }
+
+        Query and data can also be base64 encoded strings. The druid queries of all the items
+        run concurrently, and the items using the same deep learning model are predicted with
+        a single call to the model.
+
+        Returns:
+            A JSON response with the prediction results or an error for each item, in the
+            same order as the request.
+        """
+        if not payload.is_structured(request):
+            return self.return_error(msg="Batch requests must have a json or msgpack body")
+        try:
+            with metrics.timer("decode"):
+                body = payload.read_payload(request, self.max_body_size)
+        except payload.PayloadError as e:
+            return self.return_error(msg="Could not decode request body", exception=e)
+        items = body.get('items')
+        if not isinstance(items, list) or not items:
+            return self.return_error(msg="No items provided")
+        if len(items) > self.max_batch_items:
+            return self.return_error(msg=f"Too many items, the maximum is {self.max_batch_items}")
+        default_metric = config.get("Outliers","metric")
+        results = [None]*len(items)
+        pending = []
+        for index, item in enumerate(items):
+            try:
+                task = self.prepare_batch_item(item, default_metric)
+            except Exception as e:
+                results[index] = self.error_payload(msg="Invalid batch item", exception=e)
+                continue
+            if self.response_cache.enabled:
+                value, state = self.response_cache.lookup(task["key"])
+                if state == 'fresh':
+                    results[index] = value
+                    continue
+            task["index"] = index
+            if task["data"] is None:
+                task["future"] = self.druid_executor.submit(self.get_data_from_druid, task["query"], task["model"])
+            pending.append(task)
+        groups = {}
+        for task in pending:
+            if "future" in task:
+                try:
+                    task["data"] = task["future"].result()
+                except Exception as e:
+                    results[task["index"]] = self.error_payload(msg="Could not execute druid query", exception=e)
+                    continue
+            groups.setdefault(task["model"], []).append(task)
+        for model, tasks in groups.items():
+            predictions = self.run_model_batch([(task["data"], task["metric"]) for task in tasks], model)
+            for task, result in zip(tasks, predictions):
+                results[task["index"]] = result
+                if self.response_cache.enabled and self.response_cache.cacheable(result):
+                    self.response_cache.store(task["key"], result, task["ttl"]())
+        with metrics.timer("serialize"):
+            return jsonify({"status": "success", "results": results})
+
+    def prepare_batch_item(self, item, default_metric):
+        """
+        Decode an item of a batch request.
+
+        Args:
+            item (dict): query or data, model and metric of the item.
+            default_metric (str): metric used if the item does not set one.
+
+        Returns:
+            (dict): decoded query, data, model and metric of the item with its cache key
+              and time to live.
+        """
+        if not isinstance(item, dict):
+            raise ValueError("Batch items must be objects")
+        model = self.check_model(item.get('model'))
+        metric = item.get('metric', default_metric)
+        data, druid_query = item.get('data'), item.get('query')
+        if data is None and druid_query is None:
+            raise ValueError("No data provided or requested")
+        if data is None:
+            if isinstance(druid_query, str):
+                druid_query = self.decode_b64_json(druid_query)
+            key = self.response_cache.query_key(druid_query, model, metric)
+            ttl = lambda: self.response_cache.ttl_for_query(druid_query)
+        else:
+            key = self.response_cache.payload_key(
+                data if isinstance(data, str) else cache.fingerprint(data), model, metric
+            )
+            ttl = lambda: self.response_cache.default_ttl
+            if isinstance(data, str):
+                data = self.decode_b64_json(data)
+        return {"query": druid_query, "data": data, "model": model, "metric": metric, "key": key, "ttl": ttl}
+
+    def submit_outliers_job(self):
+        """
+        Handle POST requests to '/api/v1/outliers/jobs'.
+        The endpoint takes the same parameters as '/api/v1/outliers' but, instead of waiting
+        for the result, enqueues the work for the scoring workers.
+
+        Returns:
+            A 202 JSON response with the id of the job, or an error message.
+        """
+        try:
+            fields = self.request_fields()
+        except payload.PayloadError as e:
+            return self.return_error(msg="Could not decode request body", exception=e)
+        data, druid_query = fields["data"], fields["query"]
+        if data is None and druid_query is None:
+            return self.return_error(msg="No data provided or requested")
+        try:
+            if isinstance(data, str):
+                data = self.decode_b64_json(data)
+            if data is None and isinstance(druid_query, str):
+                druid_query = self.decode_b64_json(druid_query)
+            rq_manager, job = self.scoring_jobs()
+            job_id = rq_manager.enqueue_scoring_job(
+                job.score_outliers,
+                druid_query=druid_query if data is None else None,
+                data=data,
+                model=fields["model"],
+                metric=config.get("Outliers","metric")
+            )
+        except Exception as e:
+            return self.return_error(msg="Could not enqueue scoring job", exception=e)
+        return jsonify({"status": "queued", "job_id": job_id}), 202
+
+    def submit_ip_identifier_job(self):
+        """
+        Handle POST requests to '/api/v1/ip_identifier/jobs'.
+        The endpoint takes the same payload as '/api/v1/ip_identifier' and enqueues the work
+        for the scoring workers.
+
+        Returns:
+            A 202 JSON response with the id of the job, or an error message.
+        """
+        try:
+            body = json.loads(request.form.get('payload', '{}'))
+        except ValueError:
+            return jsonify({"error": "Invalid data format"}), 400
+        if not isinstance(body, dict):
+            return jsonify({"error": "Invalid data format"}), 400
+        outliers = body.get('outliers', [])
+        all_ips_data = body.get('all_ips_data', {})
+        if not isinstance(outliers, list) or not isinstance(all_ips_data, dict):
+            return jsonify({"error": "Invalid data format"}), 400
+        try:
+            rq_manager, job = self.scoring_jobs()
+            job_id = rq_manager.enqueue_scoring_job(job.identify_ips, outliers=outliers, all_ips_data=all_ips_data)
+        except Exception as e:
+            logger.logger.error(f"Could not enqueue ip identifier job: {e}")
+            return jsonify({"error": "An internal error has occurred!"}), 500
+        return jsonify({"status": "queued", "job_id": job_id}), 202
+
+    def job_status(self, job_id):
+        """
+        Handle GET requests to '/api/v1/outliers/jobs/<job_id>' and
+        '/api/v1/ip_identifier/jobs/<job_id>'.
+
+        Args:
+            job_id (str): id returned when the job was submitted.
+
+        Returns:
+            A JSON response with the status of the job and its result once finished, or 404
+            if the job does not exist or its result expired.
+        """
+        try:
+            rq_manager, _ = self.scoring_jobs()
+            status = rq_manager.fetch_job_status(job_id)
+        except Exception as e:
+            return self.return_error(msg="Could not fetch scoring job", exception=e)
+        if status is None:
+            return jsonify({"status": "error", "msg": "Job not found"}), 404
+        status["status"] = "success"
+        return jsonify(status)
+
+    def scoring_jobs(self):
+        """
+        Get the queue manager and the job used to run scoring jobs. They are imported on
+        first use because the queue manager depends on the configuration of this module.
+
+        Returns:
+            (tuple): RqManager and RbOutlierScoreJob.
+        """
+        if self.scoring is None:
+            from resources.src.redborder.rq import RqManager
+            from resources.src.redborder.async_jobs.score_job import RbOutlierScoreJob
+            self.scoring = (RqManager(), RbOutlierScoreJob())
+        return self.scoring
+
+    def request_fields(self):
+        """
+        Read the fields of an outliers request, either from a json or msgpack body or from
+        base64 encoded form fields.
+
+        Returns:
+            (dict): validated model name, query and data.
+
+        Raises:
+            payload.PayloadError: if the body cannot be decoded.
+        """
+        if payload.is_structured(request):
+            with metrics.timer("decode"):
+                body = payload.read_payload(request, self.max_body_size)
+            return {
+                "model": self.check_model(body.get('model')),
+                "data": body.get('data'),
+                "query": body.get('query')
+            }
+        return {
+            "model": self.decode_model(request.form.get('model')),
+            "data": request.form.get('data'),
+            "query": request.form.get('query')
+        }
+
+    def admitted(self, route, view):
+        """
+        Wrap a view so it only runs while holding a slot of its route.
+
+        Args:
+            route (str): name of the route.
+            view (callable): flask view function.
+
+        Returns:
+            (callable): view that answers 429 if the request is not admitted in time.
+        """
+        @functools.wraps(view)
+        def admitted_view(*args, **kwargs):
+            try:
+                with self.admission.slot("route", route):
+                    return view(*args, **kwargs)
+            except admission.Rejected as e:
+                return self.too_many_requests(e)
+        return admitted_view
+
+    def too_many_requests(self, rejection):
+        """
+        Build the response of a request rejected by the admission control.
+
+        Args:
+            rejection (admission.Rejected): the rejection.
+
+        Returns:
+            A 429 JSON response with a Retry-After header.
+        """
+        logger.logger.error(str(rejection))
+        response = jsonify({"status": "error", "msg": "Too many requests"})
+        response.status_code = 429
+        response.headers["Retry-After"] = str(rejection.retry_after)
+        return response
+
+    def admission_stats(self):
+        """
+        Handle GET requests to '/api/v1/admission'.
+
+        Returns:
+            A JSON response with the requests in flight, queue depth and rejections of each
+            route and model.
+        """
+        return jsonify(self.admission.stats())
+
+    def export_metrics(self):
+        """
+        Handle GET requests to '/metrics'.
+
+        Returns:
+            The metrics of every worker of the server in the Prometheus text format.
+        """
+        body, content_type = metrics.export()
+        return Response(body, content_type=content_type)
+
+    def cache_stats(self):
+        """
+        Handle GET requests to '/api/v1/cache'.
+
+        Returns:
+            A JSON response with the hit ratio and memory usage of the response cache.
+        """
+        return jsonify(self.response_cache.stats())
+
+    def model_stats(self):
+        """
+        Handle GET requests to '/api/v1/models'.
+
+        Returns:
+            A JSON response with the loaded models, their memory usage and the queue wait and
+            execution time of each replica.
+        """
+        return jsonify(self.models.stats())
 
     def identify_ip(self):
         """
@@ -178,74 +793,105 @@ class APIServer:
             return 'default'
         try:
             decoded_model = base64.b64decode(model).decode('utf-8')
-            model_path = os.path.normpath(os.path.join(self.ai_path, f"{decoded_model}.keras"))
         except Exception as e:
-            logger.logger.error(f"Error decoding or checking model: {e}")
-            return 'default'
-        if not model_path.startswith(os.path.normpath(self.ai_path)):
-            logger.logger.error(f"Attempted unauthorized file access: {decoded_model}")
+            logger.logger.error(f"Error decoding model: {e}")
             return 'default'
-        if not os.path.isfile(model_path):
-            logger.logger.error(f"Model {decoded_model} does not exist")
-            return 'default'
-        return decoded_model
+        return self.check_model(decoded_model)
 
-    def get_data_from_druid(self, druid_query, model='default'):
+    def check_model(self, model):
         """
-        Get the data from druid for the execution of a model.
+        Validate that a model name refers to an existing model file.
 
         Args:
-            druid_query (dict): druid query for the data that we want to analyze.
-            model (string): the name of the model we want to use.
+            model (str): model name.
 
         Returns:
-            (JSON): json containing the model's predictions and the outliers detected.
+            str: The model name if valid, 'default' otherwise.
         """
+        if model is None:
+            logger.logger.info("No model requested")
+            return 'default'
+        if not isinstance(model, str):
+            logger.logger.error(f"Invalid model name: {model}")
+            return 'default'
+        model_path = os.path.normpath(os.path.join(self.ai_path, f"{model}.keras"))
+        if not model_path.startswith(os.path.normpath(self.ai_path)):
+            logger.logger.error(f"Attempted unauthorized file access: {model}")
+            return 'default'
+        if not os.path.isfile(model_path):
+            logger.logger.error(f"Model {model} does not exist")
+            return 'default'
+        return model
 
-        if model != 'default':
-            logger.logger.info(f"Calculating predictions with keras model {model}.keras")
-            druid_query = query_modifier.modify_aggregations(druid_query)
-        else:
-            logger.logger.info("Calculating predictions with default model")
-        try:
-            logger.logger.info(f"Executing druid query: {druid_query}")
-            data = druid_client.execute_query(druid_query)
-        except Exception as e:
-            error_message = "Could not execute druid query"
-            logger.logger.error(error_message + ": " + str(e))
-            raise Exception(error_message)
-        logger.logger.info("Druid query executed succesfully")
-        return data
+    def preload_models(self, model_names):
+        """
+        Load and warm up a list of deep learning models so the first request for each of
+        them does not pay the loading cost. Models that cannot be loaded are skipped.
+        The progress is reported by '/ready'.
 
-    def execute_model(self, data, metric, model='default'):
+        Args:
+            model_names (list): names of the models to load.
         """
-        Execute a keras deep learning model to detect outliers.
+        with self.warm_up_lock:
+            for model in model_names:
+                self.warm_up_state.setdefault(model, {"state": "pending"})
+        for model in model_names:
+            with self.warm_up_lock:
+                self.warm_up_state[model] = {"state": "loading"}
+            start = time.time()
+            try:
+                self.models.get(model)
+            except Exception as e:
+                logger.logger.error(f"Could not preload model {model}: {e}")
+                with self.warm_up_lock:
+                    self.warm_up_state[model] = {"state": "failed", "error": str(e)}
+                continue
+            elapsed = time.time() - start
+            with self.warm_up_lock:
+                self.warm_up_state[model] = {"state": "ready", "load_time": elapsed}
+            logger.logger.info(f"Model {model} preloaded in {elapsed:.2f}s")
+
+    def start_warm_up(self, model_names):
+        """
+        Preload a list of models in a background thread, so the server can start accepting
+        requests while they load.
 
         Args:
-            druid_query (dict): druid query for the data that we want to analyze.
-            metric (string): the name of field being analyzed.
-            model (string): the name of the model we want to use.
+            model_names (list): names of the models to load.
+        """
+        with self.warm_up_lock:
+            for model in model_names:
+                self.warm_up_state.setdefault(model, {"state": "pending"})
+        thread = threading.Thread(target=self.preload_models, args=(model_names,))
+        thread.daemon = True
+        thread.start()
+
+    def health(self):
+        """
+        Handle GET requests to '/health'.
 
         Returns:
-            (JSON): json containing the model's predictions and the outliers detected.
+            A JSON response telling the process is alive.
         """
+        return jsonify({"status": "ok"})
 
-        try:
-            if model == 'default':
-                return jsonify(self.shallow.execute_prediction_model(data))
-            if model not in self.deep_models:
-                logger.logger.info(f"Creating instance of model {model}")
-                self.deep_models[model]=outliers.Autoencoder(
-                    os.path.join(self.ai_path, f"{model}.keras"),
-                    os.path.join(self.ai_path, f"{model}.ini")
-                )
-            return jsonify(self.deep_models[model].execute_prediction_model(
-                self.deep_models[model],
-                data,
-                metric,
-            ))
-        except Exception as e:
-            return self.return_error(msg="Error while calculating prediction model", exception=e)
+    def ready(self):
+        """
+        Handle GET requests to '/ready'.
+
+        Returns:
+            A JSON response with the load state and timings of each preloaded model. The
+            status code is 503 while any of them is still loading, so load balancers only
+            route to warm workers. Models that failed to load do not block readiness.
+        """
+        with self.warm_up_lock:
+            models = {model: dict(state) for model, state in self.warm_up_state.items()}
+        load_times = self.models.stats()["load_times"]
+        for model, state in models.items():
+            if model in load_times:
+                state["warm_up_time"] = load_times[model]["warm_up_time"]
+        ready = all(state["state"] in ("ready", "failed") for state in models.values())
+        return jsonify({"status": "ready" if ready else "loading", "models": models}), 200 if ready else 503
 
     def return_error(self, msg="error", exception=None):
         """
@@ -258,9 +904,7 @@ class APIServer:
         Returns:
             Response: JSON response indicating an error status.
         """
-        logged_error = msg + f": {exception}" if exception else msg
-        logger.logger.error(logged_error)
-        return jsonify({ "status": "error", "msg":msg })
+        return jsonify(self.error_payload(msg, exception))
 
     def start_s3_sync_thread(self):
         """
@@ -275,22 +919,29 @@ class APIServer:
         Periodically sync with Amazon S3.
         """
         while True:
-            logger.logger.info("Sync with S3 Started")
-            self.sync_models_with_s3()
-            logger.logger.info("Sync with S3 Finished")
+            try:
+                self.sync_models_with_s3()
+            except Exception as e:
+                logger.logger.error(f"Sync with S3 failed: {e}")
             time.sleep(self.s3_sync_interval)
 
     def sync_models_with_s3(self):
         """
         Synchronize models with Amazon S3.
 
-        This function retrieves a list of objects in the 'rbaioutliers/latest' folder on Amazon S3 using the S3 client.
-        It then iterates through the list, extracts the file name, and downloads each object to the local 'ai' directory.
+        Only one process per node syncs the 'rbaioutliers/latest' folder into the local 'ai'
+        directory. Objects whose ETag and size are unchanged are skipped and the rest are
+        downloaded to temporary files that atomically replace the old ones.
+
+        Returns:
+            dict: statistics of the sync, or None if another process is in charge of it.
         """
-        objects = self.s3_client.list_objects_in_folder('rbaioutliers/latest')
-        for obj in objects:
-            file_name = obj.split("/")[-1]
-            self.s3_client.download_file(obj, os.path.join(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "ai"), file_name))
+        if not self.model_sync.acquire_leadership():
+            return None
+        logger.logger.info("Sync with S3 Started")
+        stats = self.model_sync.sync()
+        logger.logger.info("Sync with S3 Finished")
+        return stats
 
     def run_test_app(self):
         """
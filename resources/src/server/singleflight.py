@@ -0,0 +1,88 @@
+# Copyright (C) 2024 Eneo Tecnologia S.L.
+#
+# Authors:
+# Miguel Álvarez Adsuara <malvarez@redborder.com>
+# Pablo Rodriguez Flores <prodriguez@redborder.com>
+#
+# This program is free software: you can redistribute it and/or modify it under the terms of the
+# GNU Affero General Public License as published by the Free Software Foundation, either version 3
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without
+# even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with this program.
+# If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Coalescing of identical concurrent calls, so a burst of equal requests only queries
+druid and runs the model once.
+"""
+import threading
+
+from resources.src.metrics import metrics
+
+class Call:
+    """
+    Call in progress whose result is shared with every duplicate caller.
+    """
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.exception = None
+
+class SingleFlight:
+    """
+    Execute a function once per key among concurrent callers. The first caller runs the
+    function while the rest wait for it and receive the same result or exception.
+
+    Args:
+        name (str): kind of calls coalesced, used to label the metrics.
+    """
+    def __init__(self, name="call"):
+        self.name = name
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.executed = 0
+        self.shared = 0
+
+    def do(self, key, function):
+        """
+        Run a function or wait for the identical call already in progress.
+
+        Args:
+            key (str): identifier of the call.
+            function (callable): function to execute.
+
+        Returns:
+            The value returned by the function.
+
+        Raises:
+            Exception: whatever the function raised.
+        """
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = Call()
+                self.calls[key] = call
+                self.executed += 1
+            else:
+                self.shared += 1
+                metrics.COALESCED_CALLS.labels(self.name).inc()
+        if not leader:
+            call.done.wait()
+            if call.exception is not None:
+                raise call.exception
+            return call.result
+        try:
+            call.result = function()
+        except Exception as e:
+            call.exception = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.done.set()
+        return call.result
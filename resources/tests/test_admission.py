@@ -0,0 +1,102 @@
+# Copyright (C) 2024 Eneo Tecnologia S.L.
+#
+# Authors:
+# Miguel Álvarez Adsuara <malvarez@redborder.com>
+# Pablo Rodriguez Flores <prodriguez@redborder.com>
+#
+# This program is free software: you can redistribute it and/or modify it under the terms of the
+# GNU Affero General Public License as published by the Free Software Foundation, either version 3
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without
+# even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with this program.
+# If not, see <https://www.gnu.org/licenses/>.
+
+
+import time
+import unittest
+import threading
+
+from resources.src.server.admission import AdmissionController, Limiter, Rejected
+
+class TestAdmission(unittest.TestCase):
+
+    def hold(self, limiter, release):
+        def run():
+            with limiter.slot():
+                release.wait(5)
+        thread = threading.Thread(target=run)
+        thread.start()
+        return thread
+
+    def test_rejects_when_queue_is_full(self):
+        limiter = Limiter("test", max_in_flight=1, max_queue=0, queue_timeout=5)
+        release = threading.Event()
+        thread = self.hold(limiter, release)
+        while limiter.in_flight == 0:
+            time.sleep(0.01)
+        start = time.time()
+        with self.assertRaises(Rejected) as context:
+            limiter.acquire()
+        self.assertLess(time.time() - start, 1)
+        self.assertGreaterEqual(context.exception.retry_after, 1)
+        release.set()
+        thread.join()
+        self.assertEqual(limiter.stats()["rejected"], 1)
+
+    def test_rejects_after_queue_timeout(self):
+        limiter = Limiter("test", max_in_flight=1, max_queue=1, queue_timeout=0.1)
+        release = threading.Event()
+        thread = self.hold(limiter, release)
+        while limiter.in_flight == 0:
+            time.sleep(0.01)
+        with self.assertRaises(Rejected):
+            limiter.acquire()
+        self.assertEqual(limiter.stats()["queue_depth"], 0)
+        release.set()
+        thread.join()
+
+    def test_waits_for_free_slot(self):
+        limiter = Limiter("test", max_in_flight=1, max_queue=1, queue_timeout=5)
+        release = threading.Event()
+        thread = self.hold(limiter, release)
+        while limiter.in_flight == 0:
+            time.sleep(0.01)
+        threading.Timer(0.1, release.set).start()
+        with limiter.slot():
+            self.assertEqual(limiter.in_flight, 1)
+        thread.join()
+        self.assertEqual(limiter.stats()["admitted"], 2)
+        self.assertEqual(limiter.stats()["in_flight"], 0)
+
+    def test_controller_limiters(self):
+        controller = AdmissionController(route_limits=(2, 2), model_limits=(1, 0))
+        with controller.slot("model", "traffic"):
+            with self.assertRaises(Rejected):
+                with controller.slot("model", "traffic"):
+                    pass
+            with controller.slot("model", "default"):
+                pass
+        self.assertEqual(set(controller.stats()["limiters"]), {"model:traffic", "model:default"})
+
+    def test_queues_fit_in_threads(self):
+        controller = AdmissionController(route_limits=(16, 32), model_limits=(4, 16), threads=20)
+        self.assertEqual(controller.limiter("route", "outliers").max_queue, 3)
+        self.assertEqual(controller.limiter("model", "traffic").max_queue, 11)
+        controller = AdmissionController(route_limits=(12, 4), model_limits=(4, 6), threads=20)
+        self.assertEqual(controller.limiter("route", "outliers").max_queue, 4)
+        self.assertEqual(controller.limiter("model", "traffic").max_queue, 6)
+        self.assertEqual(AdmissionController(route_limits=(16, 32)).limiter("route", "outliers").max_queue, 32)
+
+    def test_disabled_controller(self):
+        controller = AdmissionController(model_limits=(1, 0), enabled=False)
+        with controller.slot("model", "traffic"):
+            with controller.slot("model", "traffic"):
+                pass
+        self.assertEqual(controller.stats()["limiters"], {})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+# Copyright (C) 2024 Eneo Tecnologia S.L.
+#
+# Authors:
+# Miguel Álvarez Adsuara <malvarez@redborder.com>
+# Pablo Rodriguez Flores <prodriguez@redborder.com>
+#
+# This program is free software: you can redistribute it and/or modify it under the terms of the
+# GNU Affero General Public License as published by the Free Software Foundation, either version 3
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without
+# even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with this program.
+# If not, see <https://www.gnu.org/licenses/>.
+
+
+import os
+import tempfile
+import unittest
+
+from resources.benchmarks import bench_models
+from resources.benchmarks.fake_druid import FakeDruid
+
+class TestBenchModels(unittest.TestCase):
+    baseline = {"case": {"seconds": 0.010, "peak_bytes": 1000000}}
+
+    def test_no_regression(self):
+        results = {"case": {"seconds": 0.012, "peak_bytes": 1100000}, "new case": {"seconds": 1, "peak_bytes": 1}}
+        self.assertEqual(bench_models.compare(results, self.baseline), [])
+
+    def test_time_and_memory_regressions(self):
+        results = {"case": {"seconds": 0.013, "peak_bytes": 2000000}}
+        regressions = bench_models.compare(results, self.baseline)
+        self.assertEqual(len(regressions), 2)
+        self.assertIn("ms", regressions[0])
+        self.assertIn("KiB", regressions[1])
+
+    def test_measure(self):
+        result = bench_models.measure(lambda: bytearray(200000), repeat=1, min_time=0.001)
+        self.assertGreater(result["seconds"], 0)
+        self.assertGreaterEqual(result["peak_bytes"], 200000)
+
+    def test_baseline_round_trip(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "baselines", "models.json")
+            self.assertEqual(bench_models.load_baseline(path), {})
+            bench_models.save_baseline(path, self.baseline)
+            self.assertEqual(bench_models.load_baseline(path), self.baseline)
+
+    def test_druid_response(self):
+        rows = bench_models.druid_response(FakeDruid(), 30)
+        self.assertEqual(len(rows), 30)
+        self.assertIn("bits_per_sec_per_client", rows[0]["result"])
+
+    def test_identifier_cases(self):
+        cases = bench_models.identifier_cases([3], minutes=10)
+        self.assertEqual(list(cases), ["OutlierIdentifier.execute[3]"])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+# Copyright (C) 2024 Eneo Tecnologia S.L.
+#
+# Authors:
+# Miguel Álvarez Adsuara <malvarez@redborder.com>
+# Pablo Rodriguez Flores <prodriguez@redborder.com>
+#
+# This program is free software: you can redistribute it and/or modify it under the terms of the
+# GNU Affero General Public License as published by the Free Software Foundation, either version 3
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without
+# even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with this program.
+# If not, see <https://www.gnu.org/licenses/>.
+
+
+import os
+import tempfile
+import unittest
+
+from resources.benchmarks import bench_training
+from resources.src.redborder.training_cache import TrainingDataCache
+
+class TestBenchTraining(unittest.TestCase):
+
+    def test_synthetic_data(self):
+        raw_data = bench_training.synthetic_data(0.1, ["pt1m", "pt5m"])
+        self.assertEqual([len(rows) for rows in raw_data], [144, 29])
+
+    def test_cached_data(self):
+        rows = bench_training.synthetic_data(0.05, ["pt1m"])[0]
+        with tempfile.TemporaryDirectory() as directory:
+            cache = TrainingDataCache(directory, 7, None)
+            path = os.path.join(directory, "traffic_pt1m.npz")
+            timestamps, columns = cache.to_columns(rows)
+            cache.save(path, (timestamps[0], timestamps[-1], timestamps[0]), timestamps, columns)
+            self.assertEqual(bench_training.cached_data([path])[0][5]["timestamp"], rows[5]["timestamp"])
+            with self.assertRaises(ValueError):
+                bench_training.cached_data([os.path.join(directory, "missing.npz")])
+
+    def test_run(self):
+        result = bench_training.run(
+            bench_training.synthetic_data(0.1, ["pt1m"]), epochs=2, batch_size=16,
+            model_file="resources/tests/model_test.keras", model_config_file="resources/tests/model_test_config.ini"
+        )
+        self.assertGreater(result["samples"], 0)
+        self.assertGreater(result["samples_per_second"], 0)
+        self.assertGreater(result["peak_rss_bytes"], 0)
+        self.assertTrue(0 < result["prep_share"] < 1)
+        report = bench_training.format_report([dict(
+            result, days=0.1, batch_size=16, intra_op_threads=0, inter_op_threads=0
+        )])
+        self.assertEqual(len(report.splitlines()), 2)
+
+if __name__ == '__main__':
+    unittest.main()
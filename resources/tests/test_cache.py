@@ -0,0 +1,113 @@
+# Copyright (C) 2024 Eneo Tecnologia S.L.
+#
+# Authors:
+# Miguel Álvarez Adsuara <malvarez@redborder.com>
+# Pablo Rodriguez Flores <prodriguez@redborder.com>
+#
+# This program is free software: you can redistribute it and/or modify it under the terms of the
+# GNU Affero General Public License as published by the Free Software Foundation, either version 3
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without
+# even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with this program.
+# If not, see <https://www.gnu.org/licenses/>.
+
+
+import os
+import time
+import unittest
+from unittest.mock import Mock
+
+from resources.src.server.cache import ResponseCache, parse_iso8601
+from resources.src.druid.query_builder import QueryBuilder
+
+class TestResponseCache(unittest.TestCase):
+    success = {"status": "success", "anomalies": [], "predicted": []}
+
+    def setUp(self):
+        self.now = parse_iso8601("2023-01-01T10:07:30Z")
+        builder = QueryBuilder(
+            os.path.join(os.getcwd(), "resources", "src", "druid", "data", "aggregations.json"),
+            os.path.join(os.getcwd(), "resources", "src", "druid", "data", "postAggregations.json")
+        )
+        self.cache = ResponseCache(
+            builder.granularity_to_seconds,
+            stale_ttl=120,
+            clock=lambda: self.now
+        )
+
+    def query(self, start, end):
+        return {
+            "granularity": {"type": "period", "period": "pt5m"},
+            "intervals": [f"{start}/{end}"],
+            "context": {"timeout": 90000}
+        }
+
+    def test_same_bucket_same_key(self):
+        key1 = self.cache.query_key(self.query("2023-01-01T09:06:00Z", "2023-01-01T10:06:00Z"), "m", "bytes")
+        key2 = self.cache.query_key(self.query("2023-01-01T09:09:00Z", "2023-01-01T10:09:00Z"), "m", "bytes")
+        key3 = self.cache.query_key(self.query("2023-01-01T09:11:00Z", "2023-01-01T10:11:00Z"), "m", "bytes")
+        self.assertEqual(key1, key2)
+        self.assertNotEqual(key1[0], key3[0])
+        self.assertEqual(key1[1], key3[1])
+
+    def test_ttl_expires_at_bucket_boundary(self):
+        ttl = self.cache.ttl_for_query(self.query("2023-01-01T09:00:00Z", "2023-01-01T10:00:00Z"))
+        self.assertAlmostEqual(ttl, 150)
+
+    def test_hit_and_miss(self):
+        key = self.cache.payload_key("ZGF0YQ==", "default", "bytes")
+        compute = Mock(return_value=self.success)
+        self.assertEqual(self.cache.get_or_compute(key, compute, lambda: 60), self.success)
+        self.assertEqual(self.cache.get_or_compute(key, compute, lambda: 60), self.success)
+        self.assertEqual(compute.call_count, 1)
+        stats = self.cache.stats()
+        self.assertEqual(stats["hits"], 1)
+        self.assertEqual(stats["misses"], 1)
+        self.assertEqual(stats["hit_ratio"], 0.5)
+        self.assertGreater(stats["size_bytes"], 0)
+
+    def test_errors_are_not_cached(self):
+        key = self.cache.payload_key("ZGF0YQ==", "default", "bytes")
+        compute = Mock(return_value={"status": "error", "msg": "error"})
+        self.cache.get_or_compute(key, compute, lambda: 60)
+        self.cache.get_or_compute(key, compute, lambda: 60)
+        self.assertEqual(compute.call_count, 2)
+
+    def test_stale_while_revalidate(self):
+        query = self.query("2023-01-01T09:00:00Z", "2023-01-01T10:07:00Z")
+        key = self.cache.query_key(query, "m", "bytes")
+        self.cache.get_or_compute(key, Mock(return_value=self.success), lambda: 150)
+        self.now += 200
+        next_query = self.query("2023-01-01T09:05:00Z", "2023-01-01T10:12:00Z")
+        next_key = self.cache.query_key(next_query, "m", "bytes")
+        refreshed = dict(self.success, anomalies=[1])
+        compute = Mock(return_value=refreshed)
+        self.assertEqual(self.cache.get_or_compute(next_key, compute, lambda: 300), self.success)
+        for _ in range(50):
+            if not self.cache.refreshing:
+                break
+            time.sleep(0.01)
+        compute.assert_called_once()
+        self.assertEqual(self.cache.get_or_compute(next_key, compute, lambda: 300), refreshed)
+
+    def test_lru_eviction(self):
+        cache = ResponseCache(lambda g: 60, max_entries=2)
+        for payload in ("a", "b", "c"):
+            cache.get_or_compute(cache.payload_key(payload, "default", "bytes"), lambda: self.success, lambda: 60)
+        self.assertEqual(cache.stats()["entries"], 2)
+        self.assertEqual(cache.stats()["evictions"], 1)
+
+    def test_disabled_cache(self):
+        cache = ResponseCache(lambda g: 60, enabled=False)
+        key = cache.payload_key("a", "default", "bytes")
+        compute = Mock(return_value=self.success)
+        cache.get_or_compute(key, compute, lambda: 60)
+        cache.get_or_compute(key, compute, lambda: 60)
+        self.assertEqual(compute.call_count, 2)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+# Copyright (C) 2024 Eneo Tecnologia S.L.
+#
+# Authors:
+# Miguel Álvarez Adsuara <malvarez@redborder.com>
+# Pablo Rodriguez Flores <prodriguez@redborder.com>
+#
+# This program is free software: you can redistribute it and/or modify it under the terms of the
+# GNU Affero General Public License as published by the Free Software Foundation, either version 3
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without
+# even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with this program.
+# If not, see <https://www.gnu.org/licenses/>.
+
+
+import io
+import os
+import json
+import unittest
+import numpy as np
+import pandas as pd
+
+from resources.src.druid.columns import ColumnBuffer, load_json, parse_timeseries, to_frame
+
+class TestColumns(unittest.TestCase):
+    def setUp(self):
+        current_dir = os.path.dirname(os.path.abspath(__file__))
+        with open(os.path.join(current_dir, "outliers_test_data.json"), "r") as data_file:
+            self.raw = data_file.read()
+        self.rows = json.loads(self.raw)
+
+    def test_column_buffer_grows(self):
+        buffer = ColumnBuffer(capacity=1)
+        for value in range(100):
+            buffer.append(value)
+        np.testing.assert_array_equal(buffer.values(), np.arange(100))
+
+    def test_parse_matches_json_normalize(self):
+        parsed = parse_timeseries(io.BytesIO(self.raw.encode()), chunk_size=7)
+        self.assertEqual(len(parsed), len(self.rows))
+        pd.testing.assert_frame_equal(
+            to_frame(parsed), to_frame(self.rows).astype({"timestamp": object}), check_dtype=False
+        )
+
+    def test_selected_fields(self):
+        parsed = parse_timeseries(io.BytesIO(self.raw.encode()), fields=["bytes", "missing"])
+        self.assertEqual(list(parsed.columns), ["bytes", "missing"])
+        self.assertEqual(parsed.columns["bytes"][0], self.rows[0]["result"]["bytes"])
+        self.assertTrue(np.isnan(parsed.columns["missing"]).all())
+
+    def test_fields_appearing_later(self):
+        raw = b'[{"timestamp": "2023-01-01T00:00:00.000Z", "result": {"a": 1}},' \
+              b' {"timestamp": "2023-01-01T00:01:00.000Z", "result": {"a": null, "b": 2}}]'
+        parsed = parse_timeseries(io.BytesIO(raw), chunk_size=3)
+        np.testing.assert_array_equal(parsed.columns["a"], [1, np.nan])
+        np.testing.assert_array_equal(parsed.columns["b"], [np.nan, 2])
+        self.assertEqual(list(parsed.timestamp_strings()), ["2023-01-01T00:00:00.000Z", "2023-01-01T00:01:00.000Z"])
+
+    def test_empty_response(self):
+        self.assertEqual(len(parse_timeseries(io.BytesIO(b" [ ] "))), 0)
+
+    def test_invalid_response(self):
+        for raw in (b'{"error": "Query timeout"}', b'[{"timestamp": "2023-01-01T00:00:00.000Z"', b'[1,'):
+            with self.assertRaises(ValueError):
+                parse_timeseries(io.BytesIO(raw))
+
+    def test_load_json(self):
+        self.assertEqual(load_json(io.BytesIO(self.raw.encode()), chunk_size=100), self.rows)
+        self.assertEqual(load_json(io.BytesIO(b' {"error": "Query timeout"}'), chunk_size=4), {"error": "Query timeout"})
+        self.assertEqual(load_json(io.BytesIO(b"[]")), [])
+        for raw in (b"", b"[1,", b'{"error"'):
+            with self.assertRaises(ValueError):
+                load_json(io.BytesIO(raw), chunk_size=2)
+
+    def test_load_json_numbers_across_chunks(self):
+        for chunk_size in range(1, 8):
+            self.assertEqual(load_json(io.BytesIO(b"[1, 2345, 6]"), chunk_size=chunk_size), [1, 2345, 6])
+            self.assertEqual(load_json(io.BytesIO(b"[-1.5e3, 0.25, 1e+2]"), chunk_size=chunk_size), [-1500.0, 0.25, 100.0])
+
+    def test_load_json_rejects_malformed_arrays(self):
+        for raw in (b'["x"] junk', b'["x"]]', b"[] []", b"[1 2]", b"[1,,2]", b"[1,]", b"[,1]", b"[1.]"):
+            for chunk_size in (1, 3, 64):
+                with self.assertRaises(ValueError):
+                    load_json(io.BytesIO(raw), chunk_size=chunk_size)
+        self.assertEqual(load_json(io.BytesIO(b'["x"] \n'), chunk_size=2), ["x"])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -16,35 +16,44 @@
 # If not, see <https://www.gnu.org/licenses/>.
 
 
+import io
 import os
+import json
 import sys
 import unittest
 from unittest.mock import MagicMock, patch
 
 from resources.src.druid.client import DruidClient
+from resources.src.druid.query_builder import QueryBuilder
 
 class TestDruidClient(unittest.TestCase):
     def setUp(self):
         self.druid_endpoint = "http://mock.druid.endpoint"
         self.druid_client = DruidClient(self.druid_endpoint)
 
-    def test_execute_query_success(self):
+    def mock_response(self, status_code, body=b""):
         mock_response = MagicMock()
-        mock_response.status_code = 200
-        mock_response.json.return_value = {"result": "mocked_data"}
+        mock_response.status_code = status_code
+        mock_response.raw = io.BytesIO(body)
+        mock_response.__enter__.return_value = mock_response
+        return mock_response
+
+    def test_execute_query_success(self):
+        mock_response = self.mock_response(200, b'{"result": "mocked_data"}')
 
-        with patch("requests.post", return_value=mock_response):
+        with patch("requests.Session.post", return_value=mock_response) as post:
             druid_query = {"query": "sample_query"}
 
             response = self.druid_client.execute_query(druid_query)
 
             self.assertEqual(response, {"result": "mocked_data"})
+            self.assertEqual(post.call_args.kwargs["timeout"], (5.0, 120.0))
+            self.assertTrue(post.call_args.kwargs["stream"])
 
     def test_execute_query_failure(self):
-        mock_response = MagicMock()
-        mock_response.status_code = 500
+        mock_response = self.mock_response(500)
 
-        with patch("requests.post", return_value=mock_response):
+        with patch("requests.Session.post", return_value=mock_response):
             druid_query = {"query": "sample_query"}
 
             with self.assertRaises(Exception) as context:
@@ -52,5 +61,88 @@ class TestDruidClient(unittest.TestCase):
 
             self.assertIn("status code 500", str(context.exception))
 
+    def test_execute_query_columns(self):
+        body = b'[{"timestamp": "2023-01-01T00:00:00.000Z", "result": {"bytes": 10, "pkts": 1}}]'
+        with patch("requests.Session.post", return_value=self.mock_response(200, body)):
+            response = self.druid_client.execute_query_columns({"query": "sample_query"}, fields=["bytes"])
+
+            self.assertEqual(len(response), 1)
+            self.assertEqual(list(response.columns), ["bytes"])
+            self.assertEqual(response.columns["bytes"][0], 10)
+
+    def chunked_client(self):
+        builder = QueryBuilder(
+            os.path.join(os.getcwd(), "resources", "src", "druid", "data", "aggregations.json"),
+            os.path.join(os.getcwd(), "resources", "src", "druid", "data", "postAggregations.json")
+        )
+        return DruidClient(self.druid_endpoint, query_builder=builder, chunk_max_buckets=2)
+
+    def chunk_response(self, url, data, **kwargs):
+        start = json.loads(data)["intervals"][0].split("/")[0]
+        hour = int(start[11:13])
+        rows = [
+            {"timestamp": f"2023-01-01T{bucket:02d}:00:00.000Z", "result": {"bytes": bucket}}
+            for bucket in range(max(0, hour - 1), hour + 2)
+        ]
+        return self.mock_response(200, json.dumps(rows).encode())
+
+    def test_execute_query_in_chunks(self):
+        druid_client = self.chunked_client()
+        query = {
+            "queryType": "timeseries",
+            "granularity": {"type": "period", "period": "pt1h", "origin": "2023-01-01T00:00:00Z"},
+            "intervals": ["2023-01-01T00:00:00Z/2023-01-01T06:00:00Z"]
+        }
+        with patch("requests.Session.post", side_effect=self.chunk_response) as post:
+            response = druid_client.execute_query(query)
+            self.assertEqual(post.call_count, 3)
+        self.assertEqual([row["result"]["bytes"] for row in response], [0, 1, 2, 3, 4, 5])
+
+        with patch("requests.Session.post", side_effect=self.chunk_response):
+            response = druid_client.execute_query_columns(query)
+        self.assertEqual(response.columns["bytes"].tolist(), [0, 1, 2, 3, 4, 5])
+
+    def test_execute_query_decodes_rows_incrementally(self):
+        rows = [{"timestamp": f"2023-01-01T00:{minute:02d}:00.000Z", "result": {"bytes": minute}} for minute in range(60)]
+        body = MagicMock(wraps=io.BytesIO(json.dumps(rows).encode()))
+        response = self.mock_response(200)
+        response.raw = body
+        with patch("requests.Session.post", return_value=response):
+            self.assertEqual(self.druid_client.execute_query({"query": "sample_query"}), rows)
+        self.assertNotIn(unittest.mock.call(), body.read.call_args_list)
+        self.assertNotIn(unittest.mock.call(-1), body.read.call_args_list)
+
+    def test_chunk_error_response(self):
+        druid_client = self.chunked_client()
+        query = {
+            "queryType": "timeseries",
+            "granularity": {"type": "period", "period": "pt1h", "origin": "2023-01-01T00:00:00Z"},
+            "intervals": ["2023-01-01T00:00:00Z/2023-01-01T06:00:00Z"]
+        }
+        error = lambda *args, **kwargs: self.mock_response(200, b'{"error": "Query timeout"}')
+        with patch("requests.Session.post", side_effect=error):
+            with self.assertRaises(Exception) as context:
+                druid_client.execute_query(query)
+        self.assertNotIsInstance(context.exception, AttributeError)
+        self.assertIn("Query timeout", str(context.exception))
+
+    def test_session_is_reused(self):
+        session = self.druid_client.get_session()
+        self.assertIs(self.druid_client.get_session(), session)
+        adapter = session.get_adapter(self.druid_endpoint)
+        self.assertEqual(adapter._pool_maxsize, 20)
+        self.assertEqual(adapter.max_retries.total, 3)
+        self.assertIn(503, adapter.max_retries.status_forcelist)
+        self.assertIn("POST", adapter.max_retries.allowed_methods)
+
+    def test_new_session_after_fork(self):
+        session = self.druid_client.get_session()
+        with patch("os.getpid", return_value=os.getpid() + 1):
+            self.assertIsNot(self.druid_client.get_session(), session)
+
+    def test_gzip_disabled(self):
+        druid_client = DruidClient(self.druid_endpoint, gzip=False)
+        self.assertEqual(druid_client.get_session().headers["Accept-Encoding"], "identity")
+
 if __name__ == '__main__':
     unittest.main()
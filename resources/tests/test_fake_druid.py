@@ -0,0 +1,131 @@
+# Copyright (C) 2024 Eneo Tecnologia S.L.
+#
+# Authors:
+# Miguel Álvarez Adsuara <malvarez@redborder.com>
+# Pablo Rodriguez Flores <prodriguez@redborder.com>
+#
+# This program is free software: you can redistribute it and/or modify it under the terms of the
+# GNU Affero General Public License as published by the Free Software Foundation, either version 3
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without
+# even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with this program.
+# If not, see <https://www.gnu.org/licenses/>.
+
+
+import json
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from resources.benchmarks.fake_druid import FakeDruid, granularity_seconds
+from resources.benchmarks.load_test import percentile, summarize, run_load
+from resources.src.druid.client import DruidClient
+
+class TestFakeDruid(unittest.TestCase):
+
+    def query(self, period="pt5m", **kwargs):
+        return dict({
+            "queryType": "timeseries",
+            "granularity": {"type": "period", "period": period, "origin": "2023-01-01T00:00:00Z"},
+            "intervals": ["2023-01-01T00:00:00Z/2023-01-01T01:00:00Z"],
+            "aggregations": [
+                {"type": "longSum", "name": "bytes", "fieldName": "sum_bytes"},
+                {"type": "hyperUnique", "name": "clients", "fieldName": "clients"}
+            ],
+            "postAggregations": [{
+                "type": "arithmetic", "name": "bytes_per_client", "fn": "/",
+                "fields": [{"type": "fieldAccess", "fieldName": "bytes"}, {"type": "fieldAccess", "fieldName": "clients"}]
+            }]
+        }, **kwargs)
+
+    def test_timeseries_buckets(self):
+        rows = FakeDruid().timeseries(self.query())
+        self.assertEqual(len(rows), 12)
+        self.assertEqual(rows[1]["timestamp"], "2023-01-01T00:05:00.000Z")
+        result = rows[0]["result"]
+        self.assertIsInstance(result["bytes"], int)
+        self.assertAlmostEqual(result["bytes_per_client"], result["bytes"]/result["clients"])
+
+    def test_deterministic_and_descending(self):
+        fake = FakeDruid(seed=3)
+        rows = fake.timeseries(self.query())
+        self.assertEqual(rows, FakeDruid(seed=3).timeseries(self.query()))
+        self.assertEqual(fake.timeseries(self.query(descending=True)), rows[::-1])
+
+    def test_anomalies_are_injected(self):
+        fake = FakeDruid(anomaly_rate=1.0, anomaly_factor=10)
+        normal = FakeDruid(anomaly_rate=0.0).timeseries(self.query())
+        anomalous = fake.timeseries(self.query())
+        self.assertGreater(anomalous[0]["result"]["bytes"], 5*normal[0]["result"]["bytes"])
+
+    def test_unsupported_query(self):
+        with self.assertRaises(ValueError):
+            FakeDruid().timeseries(self.query(queryType="groupBy"))
+
+    def test_http_endpoint(self):
+        fake = FakeDruid()
+        url = fake.start()
+        try:
+            rows = DruidClient(url, retries=0).execute_query(self.query(period="pt1h"))
+        finally:
+            fake.stop()
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(fake.queries, 1)
+
+    def test_granularity_seconds(self):
+        self.assertEqual(granularity_seconds("pt5m"), 300)
+        self.assertEqual(granularity_seconds("P1D"), 86400)
+
+class TestLoadTestReport(unittest.TestCase):
+
+    def test_percentile(self):
+        self.assertEqual(percentile([], 50), 0.0)
+        self.assertEqual(percentile([3, 1, 2], 50), 2)
+        self.assertAlmostEqual(percentile([0, 10], 95), 9.5)
+
+    def test_summarize(self):
+        samples = [("outliers", "m", 60, 0.1, True), ("outliers", "m", 60, 0.3, False), ("ip_identifier", "-", 10, 1.0, True)]
+        report = summarize(samples, 2.0)
+        self.assertEqual([row["route"] for row in report], ["ip_identifier", "outliers"])
+        self.assertEqual(report[1]["requests"], 2)
+        self.assertEqual(report[1]["errors"], 1)
+        self.assertEqual(report[1]["throughput"], 1.0)
+        self.assertAlmostEqual(report[1]["p50_ms"], 200)
+
+    def test_error_bodies_are_counted_as_errors(self):
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                if self.path.endswith("outliers"):
+                    body = {"status": "error", "msg": "Could not execute druid query"}
+                else:
+                    body = json.dumps({"ips": []})
+                payload = json.dumps(body).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        scenarios = [("outliers", "m", 60, lambda n: {}), ("ip_identifier", "-", 10, lambda n: {})]
+        try:
+            samples, duration = run_load(f"http://127.0.0.1:{server.server_port}", scenarios, 0.3, 2)
+        finally:
+            server.shutdown()
+            server.server_close()
+        report = {row["route"]: row for row in summarize(samples, duration)}
+        self.assertEqual(report["outliers"]["errors"], report["outliers"]["requests"])
+        self.assertGreater(report["outliers"]["errors"], 0)
+        self.assertEqual(report["ip_identifier"]["errors"], 0)
+
+if __name__ == '__main__':
+    unittest.main()
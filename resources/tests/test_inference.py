@@ -0,0 +1,107 @@
+# Copyright (C) 2024 Eneo Tecnologia S.L.
+#
+# Authors:
+# Miguel Álvarez Adsuara <malvarez@redborder.com>
+# Pablo Rodriguez Flores <prodriguez@redborder.com>
+#
+# This program is free software: you can redistribute it and/or modify it under the terms of the
+# GNU Affero General Public License as published by the Free Software Foundation, either version 3
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without
+# even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with this program.
+# If not, see <https://www.gnu.org/licenses/>.
+
+
+import os
+import runpy
+import shutil
+import tempfile
+import unittest
+import threading
+import numpy as np
+from unittest.mock import patch
+
+from resources.src.ai.outliers import Autoencoder
+from resources.src.server.model_registry import ModelRegistry
+from resources.src.server.inference import InferenceClient, InferenceError, InferenceServer, start_server
+
+class TestInference(unittest.TestCase):
+    ai_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src", "ai")
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        socket_path = os.path.join(self.tmp_dir, "inference.sock")
+        self.server = InferenceServer(socket_path, b"secret", ModelRegistry(self.ai_path), batch_wait=0.05)
+        self.server.listen()
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.client = InferenceClient(socket_path, b"secret", connect_timeout=5)
+        self.model_files = (os.path.join(self.ai_path, "traffic.keras"), os.path.join(self.ai_path, "traffic.ini"))
+
+    def tearDown(self):
+        self.client.disconnect()
+        self.server.close()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_remote_prediction_matches_local(self):
+        local = Autoencoder(*self.model_files)
+        data = np.random.rand(3, local.window_size*local.num_window, len(local.columns))
+        remote = self.client.predict("traffic", data)
+        self.assertEqual(remote.shape, data.shape)
+        np.testing.assert_allclose(remote, local.model.predict(data, verbose=0), rtol=1e-4, atol=1e-5)
+
+    def test_batches_concurrent_requests(self):
+        remote = Autoencoder(*self.model_files, model=self.client.model("traffic"))
+        data = np.zeros((1, remote.window_size*remote.num_window, len(remote.columns)))
+        remote.model.predict(data)
+        batches = self.server.batches
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(self.client.predict("traffic", data)))
+            for _ in range(4)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(results), 4)
+        self.assertLess(self.server.batches - batches, 4)
+
+    def test_unknown_model(self):
+        with self.assertRaises(InferenceError):
+            self.client.predict("nonexistent", np.zeros((1, 2, 3)))
+
+class TestInferenceProcess(unittest.TestCase):
+    ai_path = TestInference.ai_path
+
+    def test_spawned_server_predicts(self):
+        tmp_dir = tempfile.mkdtemp()
+        socket_path = os.path.join(tmp_dir, "inference.sock")
+        process = start_server(socket_path, b"secret", self.ai_path, {}, batch_wait=0.001, preload=["traffic"])
+        client = InferenceClient(socket_path, b"secret", connect_timeout=120)
+        try:
+            local = Autoencoder(os.path.join(self.ai_path, "traffic.keras"), os.path.join(self.ai_path, "traffic.ini"))
+            data = np.random.rand(2, local.window_size*local.num_window, len(local.columns))
+            remote = client.predict("traffic", data)
+            self.assertTrue(process.is_alive())
+            np.testing.assert_allclose(remote, local.model.predict(data, verbose=0), rtol=1e-4, atol=1e-5)
+        finally:
+            client.disconnect()
+            process.terminate()
+            process.join()
+            shutil.rmtree(tmp_dir)
+
+    def test_main_module_does_not_start_when_imported_by_spawn(self):
+        main_path = os.path.join(self.ai_path, "..", "__main__.py")
+        with patch.dict(os.environ, {"ENVIRONMENT": "none"}):
+            module_globals = runpy.run_path(main_path, run_name="__mp_main__")
+        self.assertIn("Outliers", module_globals)
+        self.assertNotIn("_Outliers", module_globals)
+
+if __name__ == '__main__':
+    unittest.main()
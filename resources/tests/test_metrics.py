@@ -0,0 +1,69 @@
+# Copyright (C) 2024 Eneo Tecnologia S.L.
+#
+# Authors:
+# Miguel Álvarez Adsuara <malvarez@redborder.com>
+# Pablo Rodriguez Flores <prodriguez@redborder.com>
+#
+# This program is free software: you can redistribute it and/or modify it under the terms of the
+# GNU Affero General Public License as published by the Free Software Foundation, either version 3
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without
+# even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with this program.
+# If not, see <https://www.gnu.org/licenses/>.
+
+
+import time
+import unittest
+import threading
+from prometheus_client import REGISTRY
+
+from resources.src.metrics import metrics
+from resources.src.server.singleflight import SingleFlight
+
+class TestMetrics(unittest.TestCase):
+
+    def sample(self, name, labels):
+        return REGISTRY.get_sample_value(name, labels) or 0
+
+    def test_timer_observes_latency(self):
+        labels = {"model": "test", "stage": "timed"}
+        before = self.sample("rb_aioutliers_stage_seconds_count", labels)
+        with metrics.timer("timed", "test"):
+            pass
+        self.assertEqual(self.sample("rb_aioutliers_stage_seconds_count", labels), before + 1)
+
+    def test_timer_counts_errors(self):
+        before = self.sample("rb_aioutliers_errors_total", {"stage": "failing"})
+        with self.assertRaises(ValueError):
+            with metrics.timer("failing"):
+                raise ValueError("error")
+        self.assertEqual(self.sample("rb_aioutliers_errors_total", {"stage": "failing"}), before + 1)
+
+    def test_coalesced_calls(self):
+        flight = SingleFlight("test")
+        release = threading.Event()
+        before = self.sample("rb_aioutliers_coalesced_calls_total", {"kind": "test"})
+        leader = threading.Thread(target=flight.do, args=("key", lambda: release.wait(5)))
+        leader.start()
+        while "key" not in flight.calls:
+            time.sleep(0.01)
+        follower = threading.Thread(target=flight.do, args=("key", lambda: None))
+        follower.start()
+        while flight.shared == 0:
+            time.sleep(0.01)
+        release.set()
+        leader.join()
+        follower.join()
+        self.assertEqual(self.sample("rb_aioutliers_coalesced_calls_total", {"kind": "test"}), before + 1)
+
+    def test_export(self):
+        body, content_type = metrics.export()
+        self.assertIn(b"rb_aioutliers_stage_seconds", body)
+        self.assertTrue(content_type.startswith("text/plain"))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,139 @@
+# Copyright (C) 2024 Eneo Tecnologia S.L.
+#
+# Authors:
+# Miguel Álvarez Adsuara <malvarez@redborder.com>
+# Pablo Rodriguez Flores <prodriguez@redborder.com>
+#
+# This program is free software: you can redistribute it and/or modify it under the terms of the
+# GNU Affero General Public License as published by the Free Software Foundation, either version 3
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without
+# even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with this program.
+# If not, see <https://www.gnu.org/licenses/>.
+
+
+import os
+import time
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest.mock import patch, MagicMock
+
+from resources.src.server.model_registry import ModelRegistry
+
+class TestModelRegistry(unittest.TestCase):
+    main_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+
+    def setUp(self):
+        self.ai_path = tempfile.mkdtemp()
+        for name in ("traffic", "other"):
+            shutil.copy(os.path.join(self.main_dir, "ai", "traffic.keras"), os.path.join(self.ai_path, f"{name}.keras"))
+            shutil.copy(os.path.join(self.main_dir, "ai", "traffic.ini"), os.path.join(self.ai_path, f"{name}.ini"))
+        self.autoencoder = patch('resources.src.server.model_registry.outliers.Autoencoder').start()
+        self.autoencoder.side_effect = lambda *args: MagicMock(**{"model.get_weights.return_value": []})
+
+    def tearDown(self):
+        patch.stopall()
+        shutil.rmtree(self.ai_path)
+
+    def wait_for_reloads(self, registry):
+        for _ in range(100):
+            if not registry.reloading:
+                return
+            time.sleep(0.01)
+
+    def test_model_is_built_once(self):
+        registry = ModelRegistry(self.ai_path)
+        threads = [threading.Thread(target=registry.get, args=("traffic",)) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.autoencoder.call_count, 1)
+        self.assertIs(registry.get("traffic"), registry.get("traffic"))
+        with registry.checkout("traffic") as autoencoder:
+            autoencoder.warm_up.assert_called_once()
+
+    def test_concurrent_loads_are_counted(self):
+        names = [f"model{index}" for index in range(16)]
+        for name in names:
+            shutil.copy(os.path.join(self.ai_path, "traffic.keras"), os.path.join(self.ai_path, f"{name}.keras"))
+            shutil.copy(os.path.join(self.ai_path, "traffic.ini"), os.path.join(self.ai_path, f"{name}.ini"))
+        registry = ModelRegistry(self.ai_path)
+        threads = [threading.Thread(target=registry.get, args=(name,)) for name in names]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(registry.stats()["loads"], len(names))
+
+    def test_inference_client_models(self):
+        self.autoencoder.side_effect = lambda *args, **kwargs: MagicMock(**{"model.get_weights.return_value": []})
+        client = MagicMock()
+        registry = ModelRegistry(self.ai_path, replicas=3, inference_client=client)
+        with registry.checkout("traffic") as autoencoder:
+            autoencoder.warm_up.assert_not_called()
+        self.assertEqual(self.autoencoder.call_count, 3)
+        self.assertEqual(self.autoencoder.call_args.kwargs["model"], client.model.return_value)
+        client.model.assert_called_with("traffic")
+
+    def test_missing_model(self):
+        registry = ModelRegistry(self.ai_path)
+        with self.assertRaises(FileNotFoundError):
+            registry.get("nonexistent")
+        self.assertEqual(registry.names(), [])
+
+    def test_lru_eviction_over_budget(self):
+        registry = ModelRegistry(self.ai_path, max_memory_mb=1)
+        weights = MagicMock(nbytes=600*1024)
+        self.autoencoder.side_effect = lambda *args: MagicMock(**{"model.get_weights.return_value": [weights]})
+        registry.get("traffic")
+        registry.get("other")
+        self.assertEqual(registry.names(), ["other"])
+        self.assertEqual(registry.stats()["evictions"], 1)
+
+    def test_reload_on_change(self):
+        registry = ModelRegistry(self.ai_path, check_interval=0, settle_time=0)
+        old = registry.get("traffic")
+        with open(os.path.join(self.ai_path, "traffic.ini"), "a") as config_file:
+            config_file.write("\n")
+        self.assertIs(registry.get("traffic"), old)
+        self.wait_for_reloads(registry)
+        self.assertIsNot(registry.get("traffic"), old)
+        self.assertEqual(registry.stats()["loads"], 2)
+
+    def test_touched_file_is_not_reloaded(self):
+        registry = ModelRegistry(self.ai_path, check_interval=0, settle_time=0)
+        old = registry.get("traffic")
+        os.utime(os.path.join(self.ai_path, "traffic.ini"), (0, 0))
+        registry.get("traffic")
+        self.wait_for_reloads(registry)
+        self.assertIs(registry.get("traffic"), old)
+        self.assertEqual(registry.stats()["loads"], 1)
+
+    def test_replicas(self):
+        registry = ModelRegistry(self.ai_path, replicas=2, hot_models=ModelRegistry.parse_hot_models("other:3"))
+        self.assertEqual(len(registry.get("traffic").replicas), 2)
+        self.assertEqual(len(registry.get("other").replicas), 3)
+
+    def test_replicas_are_checked_out_exclusively(self):
+        registry = ModelRegistry(self.ai_path, replicas=2)
+        with registry.checkout("traffic") as first:
+            with registry.checkout("traffic") as second:
+                self.assertIsNot(first, second)
+        stats = registry.stats()["models"]["traffic"]
+        self.assertEqual([replica["executions"] for replica in stats], [1, 1])
+
+    def test_load_times(self):
+        registry = ModelRegistry(self.ai_path)
+        registry.get("traffic")
+        load_times = registry.stats()["load_times"]["traffic"]
+        self.assertGreaterEqual(load_times["load_time"], load_times["warm_up_time"])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+# Copyright (C) 2024 Eneo Tecnologia S.L.
+#
+# Authors:
+# Miguel Álvarez Adsuara <malvarez@redborder.com>
+# Pablo Rodriguez Flores <prodriguez@redborder.com>
+#
+# This program is free software: you can redistribute it and/or modify it under the terms of the
+# GNU Affero General Public License as published by the Free Software Foundation, either version 3
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without
+# even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with this program.
+# If not, see <https://www.gnu.org/licenses/>.
+
+
+import os
+import shutil
+import tempfile
+import unittest
+import boto3
+from moto import mock_s3
+from unittest.mock import patch
+
+from resources.src.redborder.s3 import S3
+from resources.src.redborder.model_sync import ModelSync
+
+@mock_s3
+class TestModelSync(unittest.TestCase):
+    def setUp(self):
+        self.bucket_name = 'test-bucket'
+        self.s3_client = boto3.client('s3', aws_access_key_id='key', aws_secret_access_key='secret', region_name='us-west-1')
+        self.s3_client.create_bucket(Bucket=self.bucket_name, CreateBucketConfiguration={'LocationConstraint': 'us-west-1'})
+        self.s3 = S3('key', 'secret', 'us-west-1', self.bucket_name, None)
+        self.local_dir = tempfile.mkdtemp()
+        self.put('rbaioutliers/latest/traffic.ini', b'config')
+        self.put('rbaioutliers/latest/traffic.keras', b'model')
+
+    def tearDown(self):
+        shutil.rmtree(self.local_dir)
+
+    def put(self, key, body):
+        self.s3_client.put_object(Bucket=self.bucket_name, Key=key, Body=body)
+
+    def test_list_objects_with_metadata(self):
+        objects = self.s3.list_objects_with_metadata_in_folder('rbaioutliers/latest')
+        self.assertEqual(sorted(obj["key"] for obj in objects), ['rbaioutliers/latest/traffic.ini', 'rbaioutliers/latest/traffic.keras'])
+        self.assertTrue(all(obj["etag"] and obj["size"] for obj in objects))
+
+    def test_sync_downloads_only_changes(self):
+        sync = ModelSync(self.s3, 'rbaioutliers/latest', self.local_dir)
+        stats = sync.sync()
+        self.assertEqual(stats["downloaded"], 2)
+        self.assertEqual(stats["bytes"], 11)
+        with open(os.path.join(self.local_dir, "traffic.keras"), 'rb') as model_file:
+            self.assertEqual(model_file.read(), b'model')
+        self.assertEqual(sync.sync()["downloaded"], 0)
+        self.put('rbaioutliers/latest/traffic.keras', b'new model')
+        stats = sync.sync()
+        self.assertEqual(stats["downloaded"], 1)
+        self.assertEqual(stats["skipped"], 1)
+        with open(os.path.join(self.local_dir, "traffic.keras"), 'rb') as model_file:
+            self.assertEqual(model_file.read(), b'new model')
+
+    def test_synced_files_are_readable(self):
+        sync = ModelSync(self.s3, 'rbaioutliers/latest', self.local_dir)
+        sync.sync()
+        for name in ("traffic.ini", "traffic.keras", ".s3_sync.json"):
+            self.assertEqual(os.stat(os.path.join(self.local_dir, name)).st_mode & 0o777, 0o644)
+        os.chmod(os.path.join(self.local_dir, "traffic.keras"), 0o640)
+        self.put('rbaioutliers/latest/traffic.keras', b'new model')
+        sync.sync()
+        self.assertEqual(os.stat(os.path.join(self.local_dir, "traffic.keras")).st_mode & 0o777, 0o640)
+
+    def test_failed_download_keeps_old_file(self):
+        sync = ModelSync(self.s3, 'rbaioutliers/latest', self.local_dir)
+        sync.sync()
+        self.put('rbaioutliers/latest/traffic.keras', b'new model')
+        with patch.object(self.s3, 'download_file', return_value=False):
+            self.assertEqual(sync.sync()["downloaded"], 0)
+        with open(os.path.join(self.local_dir, "traffic.keras"), 'rb') as model_file:
+            self.assertEqual(model_file.read(), b'model')
+        self.assertEqual(sorted(os.listdir(self.local_dir)), ['.s3_sync.json', '.s3_sync.lock', 'traffic.ini', 'traffic.keras'])
+
+    def test_single_leader(self):
+        leader = ModelSync(self.s3, 'rbaioutliers/latest', self.local_dir)
+        follower = ModelSync(self.s3, 'rbaioutliers/latest', self.local_dir)
+        self.assertTrue(leader.acquire_leadership())
+        self.assertFalse(follower.acquire_leadership())
+        self.assertIsNone(follower.sync())
+
+if __name__ == '__main__':
+    unittest.main()
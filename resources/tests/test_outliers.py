@@ -25,6 +25,7 @@ os.environ['TF_CPP_MIN_LOG_LEVEL'] = '1'
 '''
 End of important OS Variables
 '''
+import io
 import sys
 import json
 import tempfile
@@ -32,6 +33,7 @@ import numpy as np
 import tensorflow as tf
 
 from resources.src.ai.outliers import Autoencoder
+from resources.src.druid.columns import parse_timeseries
 
 class TestAutoencoder(unittest.TestCase):
     main_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
@@ -81,6 +83,28 @@ class TestAutoencoder(unittest.TestCase):
             self.sample_data,
             "bytes",
         )
+    def test_input_json_with_columns(self):
+        parsed = parse_timeseries(io.BytesIO(json.dumps(self.sample_data).encode()))
+        data, timestamps = self.autoencoder.input_json(self.sample_data)
+        column_data, column_timestamps = self.autoencoder.input_json(parsed)
+        np.testing.assert_allclose(column_data, data)
+        self.assertEqual(list(column_timestamps), list(timestamps))
+
+    def test_model_batch_execution(self):
+        single = Autoencoder.execute_prediction_model(self.autoencoder, self.sample_data, "bytes")
+        results = Autoencoder.execute_prediction_model_batch(
+            self.autoencoder,
+            [("bytes", self.sample_data), ("bytes", self.sample_data[:10]), ("bytes", self.sample_data)]
+        )
+        self.assertEqual(results[0]['status'], 'success')
+        self.assertEqual(results[1]['status'], 'error')
+        self.assertEqual(len(results[2]['predicted']), len(single['predicted']))
+        np.testing.assert_allclose(
+            [entry['forecast'] for entry in results[2]['predicted']],
+            [entry['forecast'] for entry in single['predicted']],
+            rtol=1e-3
+        )
+
     def test_invalid_model(self):
         with self.assertRaises(FileNotFoundError):
             Autoencoder(
@@ -112,6 +136,15 @@ class TestAutoencoder(unittest.TestCase):
                 os.path.join(temp_file_path)
             )
 
+    def test_warm_up(self):
+        try:
+            self.autoencoder.warm_up()
+            execution_success = True
+        except Exception as e:
+            execution_success = False
+            print(e)
+        self.assertTrue(execution_success, "warm_up execution failed with an exception.")
+
     def test_flatten_slice_identity(self):
         np.random.seed(0)
         rand_data = np.random.rand(32, 3)
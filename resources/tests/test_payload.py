@@ -0,0 +1,83 @@
+# Copyright (C) 2024 Eneo Tecnologia S.L.
+#
+# Authors:
+# Miguel Álvarez Adsuara <malvarez@redborder.com>
+# Pablo Rodriguez Flores <prodriguez@redborder.com>
+#
+# This program is free software: you can redistribute it and/or modify it under the terms of the
+# GNU Affero General Public License as published by the Free Software Foundation, either version 3
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without
+# even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with this program.
+# If not, see <https://www.gnu.org/licenses/>.
+
+
+import gzip
+import json
+import zlib
+import unittest
+import msgpack
+from flask import Flask, request
+
+from resources.src.server import payload
+
+class TestPayload(unittest.TestCase):
+
+    def setUp(self):
+        self.app = Flask(__name__)
+
+    def read(self, body, content_type, encoding=None, max_size=1024*1024):
+        headers = {"Content-Type": content_type}
+        if encoding:
+            headers["Content-Encoding"] = encoding
+        with self.app.test_request_context('/', method='POST', data=body, headers=headers):
+            return payload.read_payload(request, max_size)
+
+    def test_is_structured(self):
+        for content_type, expected in (
+            ("application/json; charset=utf-8", True),
+            ("application/msgpack", True),
+            ("application/x-www-form-urlencoded", False)
+        ):
+            with self.app.test_request_context('/', method='POST', headers={"Content-Type": content_type}):
+                self.assertEqual(payload.is_structured(request), expected)
+
+    def test_json(self):
+        body = json.dumps({"data": [1, 2]}).encode()
+        decoded = self.read(body, "application/json")
+        self.assertEqual(decoded.get("data"), [1, 2])
+        self.assertEqual(self.read(gzip.compress(body), "application/json", "gzip").fields, {"data": [1, 2]})
+
+    def test_gzip_msgpack(self):
+        body = gzip.compress(msgpack.packb({"query": {"a": 1}, "model": "traffic"}))
+        decoded = self.read(body, "application/msgpack", "gzip")
+        self.assertEqual(decoded.get("query"), {"a": 1})
+        self.assertEqual(decoded.get("model"), "traffic")
+
+    def test_deflate(self):
+        decoded = self.read(zlib.compress(b'{"data": 1}'), "application/json", "deflate")
+        self.assertEqual(decoded.get("data"), 1)
+
+    def test_too_large(self):
+        body = json.dumps({"data": "a"*10000}).encode()
+        with self.assertRaises(payload.PayloadError):
+            self.read(body, "application/json", max_size=1000)
+        with self.assertRaises(payload.PayloadError):
+            self.read(gzip.compress(body), "application/json", "gzip", max_size=1000)
+
+    def test_invalid_bodies(self):
+        with self.assertRaises(payload.PayloadError):
+            self.read(b"[1, 2]", "application/json")
+        with self.assertRaises(payload.PayloadError):
+            self.read(b"not gzip", "application/json", "gzip")
+        with self.assertRaises(payload.PayloadError):
+            self.read(gzip.compress(b'{"data": 1}')[:-10], "application/json", "gzip")
+        with self.assertRaises(payload.PayloadError):
+            self.read(b"{}", "application/json", "br")
+
+if __name__ == '__main__':
+    unittest.main()
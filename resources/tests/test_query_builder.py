@@ -97,6 +97,80 @@ class TestQueryBuilder(unittest.TestCase):
         self.assertEqual(modified_query["granularity"]["period"], "pt5m")
         self.assertEqual(modified_query["postAggregations"][0]["fields"][1]["value"] , 300)
 
+    def test_post_aggregations_are_compiled_once(self):
+        query = {"granularity": {"period": "pt1h"}}
+        first = self.builder.modify_aggregations(query)
+        second = self.builder.modify_aggregations(dict(query))
+        self.assertIs(first["postAggregations"], second["postAggregations"])
+        self.assertEqual(first["postAggregations"][0]["fields"][1]["value"], 3600)
+        self.assertEqual(self.builder.post_aggregations[0]["fields"][1]["value"], "seconds_per_granularity")
+        self.assertEqual(
+            self.builder.modify_aggregations({"granularity": {"period": "pt2m"}})["postAggregations"][1]["fields"][1]["value"],
+            120
+        )
+
+    def test_original_query_is_not_modified(self):
+        query = {"granularity": {"period": "pt5m", "origin": ""}, "intervals": [""]}
+        original = json.loads(json.dumps(query))
+        modified = self.builder.set_time_origin(query, "2023-01-01T00:00:00Z")
+        modified = self.builder.modify_granularity(modified, "pt1m")
+        modified = self.builder.set_time_interval(modified, "2023-01-01T00:00:00Z", "2023-01-02T00:00:00Z")
+        self.builder.modify_aggregations(modified)
+        self.assertEqual(query, original)
+        self.assertEqual(modified["granularity"], {"period": "pt1m", "origin": "2023-01-01T00:00:00Z"})
+
+    def test_split_intervals(self):
+        query = {
+            "queryType": "timeseries",
+            "granularity": {"type": "period", "period": "pt1h", "origin": "2023-01-01T00:30:00Z"},
+            "intervals": ["2023-01-01T00:10:00Z/2023-01-01T10:00:00Z"]
+        }
+        chunks = self.builder.split_intervals(query, 3)
+        self.assertEqual([chunk["intervals"] for chunk in chunks], [
+            ["2023-01-01T00:10:00.000Z/2023-01-01T02:30:00.000Z"],
+            ["2023-01-01T02:30:00.000Z/2023-01-01T05:30:00.000Z"],
+            ["2023-01-01T05:30:00.000Z/2023-01-01T08:30:00.000Z"],
+            ["2023-01-01T08:30:00.000Z/2023-01-01T10:00:00.000Z"]
+        ])
+        self.assertEqual(query["intervals"], ["2023-01-01T00:10:00Z/2023-01-01T10:00:00Z"])
+        descending = self.builder.split_intervals(dict(query, descending=True), 3)
+        self.assertEqual(descending[0]["intervals"], chunks[-1]["intervals"])
+
+    def test_split_intervals_not_needed(self):
+        query = {
+            "queryType": "timeseries",
+            "granularity": {"type": "period", "period": "pt1h"},
+            "intervals": ["2023-01-01T00:00:00Z/2023-01-01T03:00:00Z"]
+        }
+        self.assertEqual(self.builder.split_intervals(query, 3), [query])
+        self.assertEqual(self.builder.split_intervals(query, 0), [query])
+        self.assertEqual(self.builder.split_intervals(dict(query, queryType="groupBy"), 1), [dict(query, queryType="groupBy")])
+        self.assertEqual(self.builder.split_intervals(dict(query, intervals=["x/y"]), 1), [dict(query, intervals=["x/y"])])
+
+    def test_group_by_filters(self):
+        query = self.builder.modify_aggregations({"granularity": {"period": "pt5m"}})
+        filters = {
+            "a": {"type": "selector", "dimension": "sensor_name", "value": "A"},
+            "b": {"type": "selector", "dimension": "sensor_name", "value": "B"}
+        }
+        grouped = self.builder.group_by_filters(query, filters)
+        self.assertEqual(len(grouped["aggregations"]), 2*len(self.builder.aggregations))
+        self.assertEqual(grouped["aggregations"][0]["filter"], filters["a"])
+        self.assertEqual(grouped["aggregations"][0]["aggregator"]["name"], "a::bytes")
+        self.assertEqual(grouped["filter"], {"type": "or", "fields": list(filters.values())})
+        self.assertNotIn("postAggregations", grouped)
+        self.assertEqual(self.builder.aggregations[0]["name"], "bytes")
+
+    def test_split_grouped_response(self):
+        rows = [
+            {"timestamp": "2023-01-01T00:00:00.000Z", "result": {"a::bytes": 1, "b::bytes": 0}},
+            {"timestamp": "2023-01-01T00:05:00.000Z", "result": {"a::bytes": 2, "b::bytes": 3}}
+        ]
+        split = self.builder.split_grouped_response(rows, ["a", "b"])
+        self.assertEqual([row["result"]["bytes"] for row in split["a"]], [1, 2])
+        self.assertEqual(split["b"], [{"timestamp": "2023-01-01T00:05:00.000Z", "result": {"bytes": 3}}])
+        self.assertEqual(len(self.builder.split_grouped_response(rows, ["a", "b"], skip_empty=False)["b"]), 2)
+
     def test_modify_filter(self):
         query = {"filter": {"type": "selector", "dimension": "sensor_name", "value": "FlowSensor"}}
         filter = {"type": "test1", "dimension": "test2", "value": "test3"}
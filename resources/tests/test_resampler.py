@@ -0,0 +1,79 @@
+# Copyright (C) 2024 Eneo Tecnologia S.L.
+#
+# Authors:
+# Miguel Álvarez Adsuara <malvarez@redborder.com>
+# Pablo Rodriguez Flores <prodriguez@redborder.com>
+#
+# This program is free software: you can redistribute it and/or modify it under the terms of the
+# GNU Affero General Public License as published by the Free Software Foundation, either version 3
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without
+# even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with this program.
+# If not, see <https://www.gnu.org/licenses/>.
+
+
+import os
+import unittest
+
+from resources.src.druid.query_builder import QueryBuilder
+from resources.src.druid.resampler import Resampler, evaluate
+
+class TestResampler(unittest.TestCase):
+    def setUp(self):
+        self.builder = QueryBuilder(
+            os.path.join(os.getcwd(), "resources", "src", "druid", "data", "aggregations.json"),
+            os.path.join(os.getcwd(), "resources", "src", "druid", "data", "postAggregations.json")
+        )
+        self.resampler = Resampler(self.builder)
+        self.query = {
+            "granularity": {"type": "period", "period": "pt5m", "origin": "2023-01-01T09:01:00Z"},
+            "postAggregations": []
+        }
+        self.rows = [
+            {"timestamp": f"2023-01-01T09:0{minute}:00.000Z",
+             "result": {"bytes": 100, "pkts": 10, "flows": 4, "clients": 2}}
+            for minute in range(1, 8)
+        ]
+
+    def test_queries(self):
+        base_query = self.resampler.base_query(self.query, "pt1m")
+        self.assertEqual(base_query["granularity"]["period"], "pt1m")
+        self.assertEqual(len(base_query["aggregations"]), 4)
+        self.assertNotIn("postAggregations", base_query)
+        clients_query = self.resampler.non_additive_query(self.query, "pt1h")
+        self.assertEqual([aggregation["name"] for aggregation in clients_query["aggregations"]], ["clients"])
+        self.assertEqual(self.query["granularity"]["period"], "pt5m")
+
+    def test_resample_aligns_to_origin(self):
+        clients = [
+            {"timestamp": "2023-01-01T09:01:00.000Z", "result": {"clients": 5}},
+            {"timestamp": "2023-01-01T09:06:00.000Z", "result": {"clients": 3}}
+        ]
+        rows = self.resampler.resample(self.rows, self.query, "pt5m", clients)
+        self.assertEqual([row["timestamp"] for row in rows], ["2023-01-01T09:01:00.000Z", "2023-01-01T09:06:00.000Z"])
+        self.assertEqual(rows[0]["result"]["bytes"], 500)
+        self.assertEqual(rows[1]["result"]["flows"], 8)
+        self.assertEqual(rows[0]["result"]["clients"], 5)
+        self.assertAlmostEqual(rows[0]["result"]["bps"], 500*8/300)
+        self.assertAlmostEqual(rows[0]["result"]["bytes_per_client"], 100)
+        self.assertAlmostEqual(rows[1]["result"]["flows_per_sec_per_client"], 8/300/3)
+
+    def test_missing_non_additive_values(self):
+        rows = self.resampler.resample(self.rows, self.query, "pt5m")
+        self.assertEqual(rows[0]["result"]["clients"], 0)
+        self.assertEqual(rows[0]["result"]["bytes_per_client"], 0)
+
+    def test_evaluate(self):
+        post_aggregation = {"type": "arithmetic", "fn": "-", "fields": [
+            {"type": "fieldAccess", "fieldName": "a"}, {"type": "constant", "value": 1}
+        ]}
+        self.assertEqual(evaluate(post_aggregation, {"a": 3}), 2)
+        with self.assertRaises(ValueError):
+            evaluate({"type": "javascript"}, {})
+
+if __name__ == '__main__':
+    unittest.main()
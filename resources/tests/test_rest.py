@@ -17,11 +17,16 @@
 
 import os
 import sys
+import gzip
 import json
+import time
 import base64
+import threading
+import msgpack
 import unittest
 from unittest.mock import patch
 
+from resources.src.ai import outliers
 from resources.src.server.rest import APIServer
 
 class TestAPIServer(unittest.TestCase):
@@ -76,6 +81,17 @@ class TestAPIServer(unittest.TestCase):
             self.assertEqual(response.status_code, 200)
             self.assertEqual(response.get_json(), self.output_data)
 
+    @patch('resources.src.druid.client.DruidClient.execute_query_columns')
+    @patch('resources.src.ai.shallow_outliers.ShallowOutliers.execute_prediction_model')
+    def test_calculate_endpoint_streaming_columns(self, mock_execute_model, mock_query):
+        mock_execute_model.return_value = self.output_data
+        mock_query.return_value = "columns"
+        self.api_server.druid_stream_columns = True
+        data = {'query':'eyJhc2RmIjoiYXNkZiJ9'}
+        with self.api_server.app.test_client().post('/api/v1/outliers', data=data) as response:
+            self.assertEqual(response.get_json(), self.output_data)
+        mock_execute_model.assert_called_once_with("columns")
+
     @patch('resources.src.druid.client.DruidClient.execute_query')
     @patch('resources.src.ai.shallow_outliers.ShallowOutliers.execute_prediction_model')
     @patch('os.path.isfile')
@@ -124,6 +140,19 @@ class TestAPIServer(unittest.TestCase):
             self.assertEqual(response.status_code, 200)
             self.assertEqual(response.get_json(), self.output_data)
 
+    @patch('resources.src.druid.client.DruidClient.execute_query')
+    @patch('resources.src.ai.shallow_outliers.ShallowOutliers.execute_prediction_model')
+    def test_calculate_endpoint_cached_response(self, mock_execute_model, mock_query):
+        mock_execute_model.return_value = self.output_data
+        mock_query.return_value = {}
+        data = {'query':'eyJhc2RmIjoiYXNkZiJ9'}
+        for _ in range(2):
+            with self.api_server.app.test_client().post('/api/v1/outliers', data=data) as response:
+                self.assertEqual(response.get_json(), self.output_data)
+        self.assertEqual(mock_query.call_count, 1)
+        with self.api_server.app.test_client().get('/api/v1/cache') as response:
+            self.assertEqual(response.get_json()["hits"], 1)
+
     @patch('resources.src.druid.client.DruidClient.execute_query')
     @patch('os.path.isfile')
     def test_execute_default_model_invalid_query(self, mock_isfile, mock_query):
@@ -137,6 +166,48 @@ class TestAPIServer(unittest.TestCase):
                 {'msg': 'Error while calculating prediction model', 'status': 'error'}
             )
 
+    @patch('resources.src.ai.outliers.Autoencoder.warm_up')
+    def test_preload_models(self, mock_warm_up):
+        self.api_server.preload_models(["traffic", "nonexistent"])
+        self.assertIn("traffic", self.api_server.models.names())
+        self.assertNotIn("nonexistent", self.api_server.models.names())
+        mock_warm_up.assert_called_once()
+
+    def test_metrics_endpoint(self):
+        data = {'query':'eyJhc2RmIjoiYXNkZiJ9'}
+        self.api_server.app.test_client().post('/api/v1/outliers', data=data)
+        with self.api_server.app.test_client().get('/metrics') as response:
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response.content_type.startswith("text/plain"))
+            body = response.get_data(as_text=True)
+            self.assertIn('rb_aioutliers_stage_seconds_count{model="default",stage="decode"}', body)
+            self.assertIn('rb_aioutliers_errors_total{stage="api"}', body)
+
+    @patch('resources.src.ai.outliers.Autoencoder.warm_up')
+    def test_ready_endpoint(self, mock_warm_up):
+        release = threading.Event()
+        mock_warm_up.side_effect = lambda: release.wait(5)
+        self.api_server.start_warm_up(["traffic", "nonexistent"])
+        with self.api_server.app.test_client().get('/ready') as response:
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(response.get_json()["status"], "loading")
+        release.set()
+        for _ in range(100):
+            with self.api_server.app.test_client().get('/ready') as response:
+                if response.status_code == 200:
+                    break
+            time.sleep(0.05)
+        self.assertEqual(response.status_code, 200)
+        models = response.get_json()["models"]
+        self.assertEqual(models["traffic"]["state"], "ready")
+        self.assertIn("warm_up_time", models["traffic"])
+        self.assertEqual(models["nonexistent"]["state"], "failed")
+
+    def test_health_endpoint(self):
+        with self.api_server.app.test_client().get('/health') as response:
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.get_json(), {"status": "ok"})
+
     def test_post_base64_encoded_data(self):
         current_dir = os.path.dirname(os.path.abspath(__file__))
         data_file_path = os.path.join(current_dir, "outliers_test_data.json")
@@ -148,6 +219,119 @@ class TestAPIServer(unittest.TestCase):
             self.assertEqual(response.get_json()["status"], "success")
             self.assertEqual(response.status_code, 200)
 
+    def test_post_json_body(self):
+        current_dir = os.path.dirname(os.path.abspath(__file__))
+        with open(os.path.join(current_dir, "shallow_outliers_test_data.json"), 'r') as file:
+            json_data = json.load(file)
+        with self.api_server.app.test_client().post('/api/v1/outliers', json={'data': json_data}) as response:
+            self.assertEqual(response.get_json()["status"], "success")
+
+    def test_post_gzip_msgpack_body(self):
+        current_dir = os.path.dirname(os.path.abspath(__file__))
+        with open(os.path.join(current_dir, "shallow_outliers_test_data.json"), 'r') as file:
+            json_data = json.load(file)
+        body = gzip.compress(msgpack.packb({'data': json_data}))
+        headers = {'Content-Type': 'application/msgpack', 'Content-Encoding': 'gzip'}
+        with self.api_server.app.test_client().post('/api/v1/outliers', data=body, headers=headers) as response:
+            self.assertEqual(response.get_json()["status"], "success")
+
+    @patch('resources.src.druid.client.DruidClient.execute_query')
+    def test_post_json_body_with_query(self, mock_query):
+        mock_query.return_value = {}
+        body = {'query': {'asdf': 'asdf'}, 'model': '../traffic'}
+        with self.api_server.app.test_client().post('/api/v1/outliers', json=body) as response:
+            self.assertEqual(response.status_code, 200)
+        mock_query.assert_called_once_with({'asdf': 'asdf'})
+
+    def test_post_invalid_json_body(self):
+        headers = {'Content-Type': 'application/json'}
+        with self.api_server.app.test_client().post('/api/v1/outliers', data=b'{', headers=headers) as response:
+            self.assertEqual(
+                response.get_json(),
+                {'msg': 'Could not decode request body', 'status': 'error'}
+            )
+
+    @patch('resources.src.druid.client.DruidClient.execute_query')
+    def test_batch_endpoint(self, mock_query):
+        current_dir = os.path.dirname(os.path.abspath(__file__))
+        with open(os.path.join(current_dir, "outliers_test_data.json"), 'r') as file:
+            json_data = json.load(file)
+        mock_query.return_value = json_data
+        items = [
+            {'query': {'queryType': 'timeseries', 'filter': {'value': 'a'}}, 'model': 'traffic'},
+            {'query': {'queryType': 'timeseries', 'filter': {'value': 'b'}}, 'model': 'traffic'},
+            {'data': json_data[:10], 'model': 'traffic'},
+            {'model': 'traffic'},
+            'invalid'
+        ]
+        with patch('resources.src.ai.outliers.Autoencoder.compute_json_batch',
+                   side_effect=outliers.Autoencoder.compute_json_batch, autospec=True) as mock_batch:
+            with self.api_server.app.test_client().post('/api/v1/outliers/batch', json={'items': items}) as response:
+                results = response.get_json()["results"]
+        self.assertEqual([result["status"] for result in results], ["success", "success", "error", "error", "error"])
+        self.assertEqual(mock_query.call_count, 2)
+        mock_batch.assert_called_once()
+
+    @patch('resources.src.ai.shallow_outliers.ShallowOutliers.execute_prediction_model')
+    def test_inline_data_shares_cache_across_endpoints(self, mock_execute_model):
+        mock_execute_model.return_value = self.output_data
+        json_data = [{"timestamp": "2023-09-21T09:00:00.000Z", "result": {"bytes": 1}}]
+        client = self.api_server.app.test_client()
+        with client.post('/api/v1/outliers', json={'data': json_data, 'model': 'default'}) as response:
+            self.assertEqual(response.get_json(), self.output_data)
+        with client.post('/api/v1/outliers', json={'model': 'default', 'data': json_data, 'extra': 1}) as response:
+            self.assertEqual(response.get_json(), self.output_data)
+        with client.post('/api/v1/outliers/batch', json={'items': [{'data': json_data}]}) as response:
+            self.assertEqual(response.get_json()["results"], [self.output_data])
+        self.assertEqual(mock_execute_model.call_count, 1)
+
+    def test_batch_endpoint_requires_items(self):
+        with self.api_server.app.test_client().post('/api/v1/outliers/batch', json={}) as response:
+            self.assertEqual(response.get_json(), {'msg': 'No items provided', 'status': 'error'})
+        with self.api_server.app.test_client().post('/api/v1/outliers/batch', data={'items': '[]'}) as response:
+            self.assertEqual(response.get_json()["status"], "error")
+
+    def test_calculate_endpoint_too_many_requests(self):
+        limiter = self.api_server.admission.limiter("route", "outliers")
+        limiter.max_queue = 0
+        limiter.in_flight = limiter.max_in_flight
+        data = {'query':'eyJhc2RmIjoiYXNkZiJ9'}
+        with self.api_server.app.test_client().post('/api/v1/outliers', data=data) as response:
+            self.assertEqual(response.status_code, 429)
+            self.assertEqual(response.headers["Retry-After"], "1")
+        with self.api_server.app.test_client().get('/api/v1/admission') as response:
+            self.assertEqual(response.get_json()["limiters"]["route:outliers"]["rejected"], 1)
+
+    @patch('resources.src.redborder.rq.RqManager.enqueue_scoring_job')
+    def test_submit_outliers_job(self, mock_enqueue):
+        mock_enqueue.return_value = "job"
+        data = {'model':'dHJhZmZpYw==', 'query':'eyJhc2RmIjoiYXNkZiJ9'}
+        with self.api_server.app.test_client().post('/api/v1/outliers/jobs', data=data) as response:
+            self.assertEqual(response.status_code, 202)
+            self.assertEqual(response.get_json(), {"status": "queued", "job_id": "job"})
+        kwargs = mock_enqueue.call_args.kwargs
+        self.assertEqual(kwargs["druid_query"], {"asdf": "asdf"})
+        self.assertEqual(kwargs["model"], "traffic")
+        self.assertEqual(mock_enqueue.call_args.args[0].__name__, "score_outliers")
+
+    @patch('resources.src.redborder.rq.RqManager.enqueue_scoring_job')
+    def test_submit_ip_identifier_job(self, mock_enqueue):
+        mock_enqueue.return_value = "job"
+        data = {'payload': json.dumps({'outliers': [], 'all_ips_data': {}})}
+        with self.api_server.app.test_client().post('/api/v1/ip_identifier/jobs', data=data) as response:
+            self.assertEqual(response.status_code, 202)
+        with self.api_server.app.test_client().post('/api/v1/ip_identifier/jobs', data={'payload': '[]'}) as response:
+            self.assertEqual(response.status_code, 400)
+
+    @patch('resources.src.redborder.rq.RqManager.fetch_job_status')
+    def test_job_status(self, mock_status):
+        mock_status.return_value = {"job_id": "job", "job_status": "started"}
+        with self.api_server.app.test_client().get('/api/v1/outliers/jobs/job') as response:
+            self.assertEqual(response.get_json()["job_status"], "started")
+        mock_status.return_value = None
+        with self.api_server.app.test_client().get('/api/v1/ip_identifier/jobs/job') as response:
+            self.assertEqual(response.status_code, 404)
+
     def test_shallow_outliers_executes(self):
         current_dir = os.path.dirname(os.path.abspath(__file__))
         data_file_path = os.path.join(current_dir, "shallow_outliers_test_data.json")
@@ -19,6 +19,8 @@
 import os, sys
 import unittest
 from rq import Queue
+from rq.job import JobStatus
+from rq.exceptions import NoSuchJobError
 from unittest.mock import Mock, patch, create_autospec
 from datetime import datetime, timedelta
 from croniter import croniter
@@ -81,5 +83,39 @@ class TestRqManager(unittest.TestCase):
         result_datetime = self.rq_manager.cron_to_rq_datetime(cron_expression)
         self.assertEqual(result_datetime, expected_datetime)
 
+    def test_enqueue_scoring_job(self):
+        self.rq_manager.scoring_queue = Mock()
+        self.rq_manager.scoring_queue.enqueue.return_value.id = "job"
+        function = Mock()
+        self.assertEqual(self.rq_manager.enqueue_scoring_job(function, model="traffic"), "job")
+        args, kwargs = self.rq_manager.scoring_queue.enqueue.call_args
+        self.assertEqual(args, (function,))
+        self.assertEqual(kwargs["kwargs"], {"model": "traffic"})
+        self.assertGreater(kwargs["result_ttl"], 0)
+
+    @patch('resources.src.redborder.rq.Job')
+    def test_fetch_job_status(self, mock_job):
+        job = mock_job.fetch.return_value
+        job.get_status.return_value = JobStatus.FINISHED
+        job.is_finished = True
+        job.return_value.return_value = {"status": "success"}
+        self.assertEqual(
+            self.rq_manager.fetch_job_status("job"),
+            {"job_id": "job", "job_status": "finished", "result": {"status": "success"}}
+        )
+        job.get_status.return_value = JobStatus.FAILED
+        job.is_finished = False
+        job.is_failed = True
+        job.exc_info = "Traceback...\nException: Could not execute druid query\n"
+        self.assertEqual(
+            self.rq_manager.fetch_job_status("job")["error"],
+            "Exception: Could not execute druid query"
+        )
+
+    @patch('resources.src.redborder.rq.Job')
+    def test_fetch_missing_job_status(self, mock_job):
+        mock_job.fetch.side_effect = NoSuchJobError
+        self.assertIsNone(self.rq_manager.fetch_job_status("job"))
+
 if __name__ == '__main__':
     unittest.main()
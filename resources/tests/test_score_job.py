@@ -0,0 +1,78 @@
+# Copyright (C) 2024 Eneo Tecnologia S.L.
+#
+# Authors:
+# Miguel Álvarez Adsuara <malvarez@redborder.com>
+# Pablo Rodriguez Flores <prodriguez@redborder.com>
+#
+# This program is free software: you can redistribute it and/or modify it under the terms of the
+# GNU Affero General Public License as published by the Free Software Foundation, either version 3
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without
+# even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with this program.
+# If not, see <https://www.gnu.org/licenses/>.
+
+
+import unittest
+from unittest.mock import patch, MagicMock
+
+from resources.src.redborder.async_jobs.score_job import RbOutlierScoreJob
+
+class TestRbOutlierScoreJob(unittest.TestCase):
+
+    def setUp(self):
+        self.server = patch('resources.src.redborder.async_jobs.score_job.ModelRunner').start()
+        RbOutlierScoreJob.server = None
+
+    def tearDown(self):
+        patch.stopall()
+        RbOutlierScoreJob.server = None
+
+    def test_server_is_reused(self):
+        RbOutlierScoreJob().setup_server()
+        RbOutlierScoreJob().setup_server()
+        self.server.assert_called_once()
+
+    def test_score_druid_query(self):
+        server = self.server.return_value
+        server.get_data_from_druid.return_value = [{"timestamp": 0}]
+        server.run_model.return_value = {"status": "success"}
+        result = RbOutlierScoreJob().score_outliers(druid_query={"a": 1}, model="traffic", metric="bytes")
+        self.assertEqual(result, {"status": "success"})
+        server.get_data_from_druid.assert_called_once_with({"a": 1}, "traffic")
+        server.run_model.assert_called_once_with([{"timestamp": 0}], "bytes", "traffic")
+
+    def test_score_data(self):
+        server = self.server.return_value
+        RbOutlierScoreJob().score_outliers(data=[{"timestamp": 0}])
+        server.get_data_from_druid.assert_not_called()
+
+    def test_identify_ips(self):
+        server = self.server.return_value
+        server.identifier.train_and_execute_model.return_value = {"implicated_ips": []}
+        self.assertEqual(RbOutlierScoreJob().identify_ips([], {}), {"implicated_ips": []})
+
+class TestScoringWorkerSetup(unittest.TestCase):
+
+    def tearDown(self):
+        patch.stopall()
+        RbOutlierScoreJob.server = None
+
+    def test_api_server_is_not_started(self):
+        s3 = patch('resources.src.server.rest.S3').start()
+        model_sync = patch('resources.src.server.rest.ModelSync').start()
+        response_cache = patch('resources.src.server.rest.cache.ResponseCache').start()
+        RbOutlierScoreJob.server = None
+        server = RbOutlierScoreJob().setup_server()
+        s3.assert_not_called()
+        model_sync.assert_not_called()
+        response_cache.assert_not_called()
+        self.assertFalse(hasattr(server, "app"))
+        self.assertEqual(server.models.names(), [])
+        self.assertEqual(server.run_model([], "bytes", "nonexistent")["status"], "error")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -17,11 +17,14 @@
 
 
 import unittest
+import io
 import os
 import sys
+import json
 import numpy as np
 
 from resources.src.ai.shallow_outliers import ShallowOutliers
+from resources.src.druid.columns import parse_timeseries
 
 class TestShallowOutliers(unittest.TestCase):
 
@@ -76,6 +79,14 @@ class TestShallowOutliers(unittest.TestCase):
         except Exception as e:
             self.fail(f"An exception occurred: {e}")
 
+    def test_compute_json_with_columns(self):
+        sample_json = [
+            {"timestamp": f"2023-01-01T0{hour}:00:00.000Z", "result": {"value": 1000 if hour == 2 else 1}}
+            for hour in range(8)
+        ]
+        parsed = parse_timeseries(io.BytesIO(json.dumps(sample_json).encode()))
+        self.assertEqual(self.model.compute_json(parsed), self.model.compute_json(sample_json))
+
     def test_compute_json_output_format(self):
         sample_json =[
             {"timestamp": "2023-01-01T00:00:00", "result": {"value": 1}},
@@ -0,0 +1,74 @@
+# Copyright (C) 2024 Eneo Tecnologia S.L.
+#
+# Authors:
+# Miguel Álvarez Adsuara <malvarez@redborder.com>
+# Pablo Rodriguez Flores <prodriguez@redborder.com>
+#
+# This program is free software: you can redistribute it and/or modify it under the terms of the
+# GNU Affero General Public License as published by the Free Software Foundation, either version 3
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without
+# even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with this program.
+# If not, see <https://www.gnu.org/licenses/>.
+
+
+import time
+import threading
+import unittest
+
+from resources.src.server.singleflight import SingleFlight
+
+class TestSingleFlight(unittest.TestCase):
+    def setUp(self):
+        self.flight = SingleFlight()
+        self.calls = 0
+
+    def slow_call(self, result):
+        self.calls += 1
+        time.sleep(0.2)
+        return result
+
+    def run_concurrently(self, function, count=5):
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(function())) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_concurrent_calls_are_coalesced(self):
+        results = self.run_concurrently(lambda: self.flight.do("key", lambda: self.slow_call("result")))
+        self.assertEqual(results, ["result"]*5)
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(self.flight.shared, 4)
+        self.assertEqual(self.flight.calls, {})
+
+    def test_sequential_calls_are_executed(self):
+        self.flight.do("key", lambda: self.slow_call(1))
+        self.flight.do("key", lambda: self.slow_call(2))
+        self.assertEqual(self.calls, 2)
+
+    def test_different_keys_are_not_coalesced(self):
+        self.run_concurrently(lambda: self.flight.do(threading.get_ident(), lambda: self.slow_call(1)), 3)
+        self.assertEqual(self.calls, 3)
+
+    def test_exception_is_shared(self):
+        def failing_call():
+            time.sleep(0.2)
+            raise ValueError("error")
+        errors = []
+        def call():
+            try:
+                self.flight.do("key", failing_call)
+            except ValueError as e:
+                errors.append(e)
+        self.run_concurrently(call, 3)
+        self.assertEqual(len(errors), 3)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -17,10 +17,14 @@
 
 
 import os, sys
+import time
+import tempfile
 import unittest
 from unittest.mock import Mock, patch
 
 from resources.src.redborder.async_jobs.train_job import RbOutlierTrainJob
+from resources.src.druid.query_builder import QueryBuilder
+from resources.src.redborder.training_cache import TrainingDataCache
 
 class TestRbOutlierTrainJob(unittest.TestCase):
 
@@ -30,6 +34,17 @@ class TestRbOutlierTrainJob(unittest.TestCase):
 
         self.mock_config.get.return_value = 0
 
+    def fetch_job(self, query_timeout="5", local_resampling="false"):
+        self.mock_config.get.side_effect = lambda section, option, fallback=None: {
+            "fetch_parallelism": "4", "query_timeout": query_timeout, "local_resampling": local_resampling
+        }.get(option, fallback)
+        job = RbOutlierTrainJob()
+        job.query_builder = QueryBuilder(
+            os.path.join(os.getcwd(), "resources", "src", "druid", "data", "aggregations.json"),
+            os.path.join(os.getcwd(), "resources", "src", "druid", "data", "postAggregations.json")
+        )
+        return job
+
     def tearDown(self):
         patch.stopall()
 
@@ -38,6 +53,128 @@ class TestRbOutlierTrainJob(unittest.TestCase):
         job.setup_s3()
         self.mock_S3.assert_called_with(0,0,0,0,0)
 
+    def test_fetch_traffic_data_concurrently(self):
+        job = self.fetch_job()
+        druid_client = Mock()
+        druid_client.execute_query.side_effect = lambda query: [query["granularity"]["period"]]
+        query = {"granularity": {"type": "period", "period": "pt5m"}, "context": {"timeout": 90000}}
+        data = job.fetch_traffic_data("traffic", query, druid_client, ["pt1m", "pt2m", "pt5m"])
+        self.assertEqual(data, [["pt1m"], ["pt2m"], ["pt5m"]])
+        self.assertEqual(query["granularity"]["period"], "pt5m")
+        self.assertEqual(druid_client.execute_query.call_args.args[0]["context"]["timeout"], 5000)
+
+    def test_fetch_traffic_data_drops_failed_granularities(self):
+        job = self.fetch_job(query_timeout="0.2")
+        def execute_query(query):
+            period = query["granularity"]["period"]
+            if period == "pt2m":
+                raise Exception("Druid query failed with status code 504.")
+            if period == "pt5m":
+                time.sleep(0.5)
+            return [period]
+        druid_client = Mock()
+        druid_client.execute_query.side_effect = execute_query
+        query = {"granularity": {"type": "period", "period": "pt5m"}}
+        data = job.fetch_traffic_data("traffic", query, druid_client, ["pt1m", "pt2m", "pt5m"])
+        self.assertEqual(data, [["pt1m"]])
+
+    def test_fetch_resampled_traffic_data(self):
+        job = self.fetch_job(local_resampling="true")
+        base = [
+            {"timestamp": f"2023-01-01T10:0{minute}:00.000Z", "result": {"bytes": 10, "pkts": 1, "flows": 2, "clients": 1}}
+            for minute in range(4)
+        ]
+        def execute_query(query):
+            names = [aggregation["name"] for aggregation in query["aggregations"]]
+            if query["granularity"]["period"] == "pt1m":
+                self.assertEqual(len(names), 4)
+                return base
+            self.assertEqual(names, ["clients"])
+            if query["granularity"]["period"] == "pt4m":
+                raise Exception("Druid query failed with status code 500.")
+            return [{"timestamp": "2023-01-01T10:00:00.000Z", "result": {"clients": 3}}]
+        druid_client = Mock()
+        druid_client.execute_query.side_effect = execute_query
+        query = {"granularity": {"type": "period", "period": "pt5m", "origin": "2023-01-01T10:00:00Z"}}
+        data = job.fetch_traffic_data("traffic", query, druid_client, ["pt1m", "pt2m", "pt4m"])
+        self.assertEqual(druid_client.execute_query.call_count, 3)
+        self.assertEqual(len(data), 2)
+        self.assertEqual(len(data[0]), 4)
+        self.assertEqual(data[1][0]["result"]["bytes"], 20)
+        self.assertEqual(data[1][0]["result"]["clients"], 3)
+        self.assertEqual(data[1][0]["result"]["bps"], 20*8/120)
+
+
+    def test_fetch_traffic_data_uses_cache(self):
+        job = self.fetch_job(local_resampling="true")
+        row = {"timestamp": "2023-01-01T10:00:00.000Z", "result": {"bytes": 10, "pkts": 1, "flows": 2, "clients": 1}}
+        druid_client = Mock()
+        druid_client.execute_query.return_value = [row]
+        query = {
+            "granularity": {"type": "period", "period": "pt5m", "origin": "2023-01-01T00:00:00Z"},
+            "intervals": ["2023-01-01T10:00:00Z/2023-01-01T10:30:00Z"]
+        }
+        with tempfile.TemporaryDirectory() as cache_dir:
+            job.training_cache = TrainingDataCache(cache_dir, 1, job.query_builder.granularity_to_seconds)
+            job.fetch_traffic_data("traffic", query, druid_client, ["pt1m", "pt2m"])
+            job.fetch_traffic_data("traffic", query, druid_client, ["pt1m", "pt2m"])
+            self.assertEqual(len(os.listdir(cache_dir)), 2)
+        self.assertEqual(druid_client.execute_query.call_count, 2)
+
+    def test_fetch_grouped_traffic_data(self):
+        job = self.fetch_job(local_resampling="true")
+        job.get_model_filter = lambda model_name: {"type": "selector", "dimension": "sensor_name", "value": model_name}
+        def execute_query(query):
+            self.assertEqual(len(query["filter"]["fields"]), 2)
+            if query["granularity"]["period"] == "pt1m":
+                return [
+                    {"timestamp": f"2023-01-01T10:0{minute}:00.000Z", "result": {
+                        "a::bytes": 10, "a::pkts": 1, "a::flows": 1, "a::clients": 1,
+                        "b::bytes": 20, "b::pkts": 2, "b::flows": 2, "b::clients": 2
+                    }}
+                    for minute in range(4)
+                ]
+            return [{"timestamp": "2023-01-01T10:00:00.000Z", "result": {"a::clients": 3, "b::clients": 4}}]
+        druid_client = Mock()
+        druid_client.execute_query.side_effect = execute_query
+        query = {
+            "granularity": {"type": "period", "period": "pt5m", "origin": "2023-01-01T10:00:00Z"},
+            "context": {"skipEmptyBuckets": "true"}
+        }
+        data = job.fetch_grouped_traffic_data(["a", "b"], query, druid_client, ["pt1m", "pt2m", "pt5m"])
+        self.assertEqual(druid_client.execute_query.call_count, 3)
+        self.assertEqual(len(data["a"]), 3)
+        self.assertEqual(data["a"][1][0]["result"]["bytes"], 20)
+        self.assertEqual(data["b"][2][0]["result"]["bytes"], 80)
+        self.assertEqual(data["b"][2][0]["result"]["clients"], 4)
+        self.assertEqual(data["b"][0][0]["result"]["bps"], 20*8/60)
+
+    def test_grouped_fetch_leaves_out_models_without_data(self):
+        job = self.fetch_job(local_resampling="true")
+        job.get_model_filter = lambda model_name: {"type": "selector", "dimension": "sensor_name", "value": model_name}
+        druid_client = Mock()
+        druid_client.execute_query.return_value = [
+            {"timestamp": "2023-01-01T10:00:00.000Z", "result": {"a::bytes": 10, "a::pkts": 1, "a::flows": 1, "a::clients": 1}}
+        ]
+        query = {"granularity": {"type": "period", "period": "pt1m"}, "context": {"skipEmptyBuckets": "true"}}
+        self.assertEqual(list(job.fetch_grouped_traffic_data(["a", "b"], query, druid_client, ["pt1m"])), ["a"])
+        druid_client.execute_query.side_effect = Exception("Druid unavailable")
+        self.assertEqual(job.fetch_grouped_traffic_data(["a", "b"], query, druid_client, ["pt1m"]), {})
+
+    def test_train_job_falls_back_when_grouped_query_fails(self):
+        job = self.fetch_job()
+        for method in (
+            "setup_s3", "initialize_ntp_client", "initialize_druid_client", "load_traffic_query",
+            "initialize_training_cache", "setup_remote_model_sync", "training_query", "process_model_data"
+        ):
+            patch.object(job, method).start()
+        patch('resources.src.redborder.async_jobs.train_job.Trainer').start()
+        patch('resources.src.redborder.async_jobs.train_job.QueryBuilder').start()
+        patch.object(job, "fetch_grouped_traffic_data", side_effect=Exception("Druid unavailable")).start()
+        job.train_job("a,b")
+        job.fetch_grouped_traffic_data.assert_called_once()
+        self.assertEqual([call.args[0] for call in job.process_model_data.call_args_list], ["a", "b"])
+        self.assertEqual([call.args[-1] for call in job.process_model_data.call_args_list], [None, None])
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -63,6 +63,33 @@ class TestTrainer(unittest.TestCase):
         self.assertEqual(prep_data.shape[1], self.trainer.num_window * self.trainer.window_size)
         self.assertEqual(prep_data.shape[2], 20)
 
+    def test_training_dataset_matches_slices(self):
+        with open("./resources/tests/outliers_test_data.json", "r") as file:
+            raw_data = [json.load(file)]*3
+        data = self.trainer.prepare_series_for_training(raw_data)
+        expected = self.trainer.slice(data.copy())
+        batches = list(self.trainer.training_dataset(data, batch_size=4, shuffle=False))
+        windows = np.concatenate([x.numpy() for x, _ in batches])
+        np.testing.assert_allclose(windows, expected, atol=1e-6)
+        self.assertEqual(batches[0][0].shape[0], 4)
+        shuffled = np.concatenate([x.numpy() for x, _ in self.trainer.training_dataset(data, batch_size=4)])
+        self.assertEqual(sorted(map(bytes, shuffled)), sorted(map(bytes, windows)))
+
+    def test_training_loss_matches_materialized_slices(self):
+        with open("./resources/tests/outliers_test_data.json", "r") as file:
+            raw_data = [json.load(file)]*3
+        data = self.trainer.prepare_series_for_training(raw_data)
+        prep_data = self.trainer.slice(data.copy())
+        loss = self.trainer.model_loss(prep_data, self.trainer.model.predict(prep_data), single_value=False)
+        loss = loss.numpy().astype(np.float64)
+        mean, std = self.trainer.training_loss(data, batch_size=4)
+        self.assertAlmostEqual(mean, loss.mean(), places=3)
+        self.assertAlmostEqual(std, loss.std(), places=3)
+
+    def test_training_dataset_too_few_datapoints(self):
+        with self.assertRaises(ValueError):
+            self.trainer.training_dataset(np.zeros((10, 20)))
+
     def test_train(self):
         with open("./resources/tests/outliers_test_data.json", "r") as file:
             raw_data = [json.load(file)]
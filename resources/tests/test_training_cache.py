@@ -0,0 +1,97 @@
+# Copyright (C) 2024 Eneo Tecnologia S.L.
+#
+# Authors:
+# Miguel Álvarez Adsuara <malvarez@redborder.com>
+# Pablo Rodriguez Flores <prodriguez@redborder.com>
+#
+# This program is free software: you can redistribute it and/or modify it under the terms of the
+# GNU Affero General Public License as published by the Free Software Foundation, either version 3
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without
+# even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with this program.
+# If not, see <https://www.gnu.org/licenses/>.
+
+
+import os
+import tempfile
+import unittest
+from unittest.mock import Mock
+
+from resources.src.redborder.training_cache import TrainingDataCache
+from resources.src.druid.query_builder import QueryBuilder
+from resources.src.druid.utils import parse_iso8601, to_iso8601
+
+class TestTrainingDataCache(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        builder = QueryBuilder(
+            os.path.join(os.getcwd(), "resources", "src", "druid", "data", "aggregations.json"),
+            os.path.join(os.getcwd(), "resources", "src", "druid", "data", "postAggregations.json")
+        )
+        self.cache = TrainingDataCache(self.temp_dir.name, 1, builder.granularity_to_seconds)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def query(self, start, end, origin="2023-01-01T00:00:00Z"):
+        return {
+            "dataSource": "rb_flow",
+            "granularity": {"type": "period", "period": "pt5m", "origin": origin},
+            "intervals": [f"{start}/{end}"],
+            "filter": {"type": "selector", "dimension": "sensor_name", "value": "FlowSensor"},
+            "context": {"timeout": 90000}
+        }
+
+    def druid(self, query):
+        start, end = (parse_iso8601(value) for value in query["intervals"][0].split("/"))
+        bucket = start - start % 300
+        rows = []
+        while bucket < end:
+            rows.append({"timestamp": to_iso8601(bucket), "result": {"bytes": bucket % 3600, "clients": 1.5}})
+            bucket += 300
+        return rows
+
+    def test_only_missing_interval_is_fetched(self):
+        execute_query = Mock(side_effect=self.druid)
+        first = self.cache.fetch("traffic", self.query("2023-01-01T10:00:00Z", "2023-01-01T11:02:00Z"), execute_query)
+        self.assertEqual(len(first), 13)
+        second = self.cache.fetch("traffic", self.query("2023-01-01T10:30:00Z", "2023-01-01T11:31:00Z"), execute_query)
+        self.assertEqual(
+            execute_query.call_args.args[0]["intervals"], ["2023-01-01T11:00:00.000Z/2023-01-01T11:31:00.000Z"]
+        )
+        self.assertEqual(second, self.druid(self.query("2023-01-01T10:30:00Z", "2023-01-01T11:31:00Z")))
+
+    def test_other_filter_is_not_shared(self):
+        execute_query = Mock(side_effect=self.druid)
+        query = self.query("2023-01-01T10:00:00Z", "2023-01-01T11:00:00Z")
+        self.cache.fetch("traffic", query, execute_query)
+        other = dict(query, filter={"type": "selector", "dimension": "sensor_name", "value": "Other"})
+        self.cache.fetch("traffic", other, execute_query)
+        self.assertEqual(
+            execute_query.call_args.args[0]["intervals"], ["2023-01-01T10:00:00.000Z/2023-01-01T11:00:00.000Z"]
+        )
+
+    def test_uncovered_start_is_refetched(self):
+        execute_query = Mock(side_effect=self.druid)
+        self.cache.fetch("traffic", self.query("2023-01-01T10:00:00Z", "2023-01-01T11:00:00Z"), execute_query)
+        query = self.query("2023-01-01T09:00:00Z", "2023-01-01T11:00:00Z")
+        self.cache.fetch("traffic", query, execute_query)
+        self.assertEqual(
+            execute_query.call_args.args[0]["intervals"], ["2023-01-01T09:00:00.000Z/2023-01-01T11:00:00.000Z"]
+        )
+
+    def test_retention(self):
+        execute_query = Mock(side_effect=self.druid)
+        self.cache.fetch("traffic", self.query("2023-01-01T10:00:00Z", "2023-01-01T11:00:00Z"), execute_query)
+        self.cache.fetch("traffic", self.query("2023-01-02T10:00:00Z", "2023-01-02T11:00:00Z"), execute_query)
+        path = self.cache.path("traffic", self.query("2023-01-02T10:00:00Z", "2023-01-02T11:00:00Z"))
+        coverage, timestamps, _ = self.cache.load(path)
+        self.assertGreaterEqual(timestamps.min(), parse_iso8601("2023-01-01T11:00:00Z"))
+        self.assertEqual(coverage[0], parse_iso8601("2023-01-02T10:00:00Z"))
+
+if __name__ == '__main__':
+    unittest.main()